@@ -0,0 +1,458 @@
+"""
+A compressed archive format for CDC logs.
+
+CDC counts change slowly from one sample to the next, so the differences
+between consecutive counts are small numbers that take one or two bytes
+as variable-length integers, where a CSV row takes eight or more. An
+archive (.cdca file) starts with a HEADER_SIZE byte header followed by
+blocks of up to BLOCK_SAMPLES consecutive samples. Each block starts
+with a BLOCK_HEADER:
+
+    magic       4s      'CDAB'
+    samples     uint32  number of samples in the block
+    flags       uint16  FLAG_TIMESTAMPS if the block has timestamps
+    reserved    uint16
+    size        uint32  bytes of payload following the header
+    crc         uint32  CRC-32 of the header (with crc 0) and payload
+    first       uint64  running sample index of the first sample
+    timestamp   float64 time of the first sample in seconds since the epoch
+
+followed by a payload of zigzag-encoded LEB128 varints: the difference
+of every count from the previous one (the first from 0), and then, if
+the block has timestamps, the second differences of the sample times
+in microseconds. Timestamps are therefore kept to the microsecond.
+Gaps (GAP_COUNT) are encoded like any other count.
+
+ArchiveWriter encodes SampleBatches as they are logged, and iter_blocks
+decodes an archive a block at a time, checking every block's CRC. A
+block that was only partially written (e.g. because the logger was
+killed) is ignored. Run this module to transcode existing logs:
+
+usage: python archive.py [-o DIR] [--delete] 2012-10-20.csv ...
+"""
+import argparse
+import os
+import struct
+import sys
+import zlib
+
+import numpy as np
+
+from binlog import BinaryLog, GAP_COUNT
+from samplebatch import SampleBatch
+
+
+MAGIC = 'CDCA'
+VERSION = 1
+
+# magic, version, header size, padding
+HEADER_FORMAT = '<4sHH24x'
+HEADER_SIZE = struct.calcsize(HEADER_FORMAT)
+
+BLOCK_MAGIC = 'CDAB'
+BLOCK_HEADER = '<4sIHHIIQd'
+BLOCK_HEADER_SIZE = struct.calcsize(BLOCK_HEADER)
+
+FLAG_TIMESTAMPS = 1
+
+# About 20 s at 50 Hz: samples reach the file a block at a time
+BLOCK_SAMPLES = 1024
+
+
+def zigzag(values):
+    """ Maps signed integers to unsigned ones, small magnitudes to
+        small numbers: 0, -1, 1, -2, ... to 0, 1, 2, 3, ...
+    """
+    values = np.asarray(values, np.int64)
+    return ((values << 1) ^ (values >> 63)).astype(np.uint64)
+
+
+def unzigzag(values):
+    values = np.asarray(values, np.uint64)
+    return (values >> np.uint64(1)).astype(np.int64) ^ -(values & np.uint64(1)).astype(np.int64)
+
+
+def deltas(values):
+    """ Differences of consecutive values, the first from 0. """
+    return np.diff(np.concatenate(([0], values)))
+
+
+def encode_varints(values):
+    """ The unsigned integers as a string of LEB128 varints: 7 bits
+        per byte, least significant first, with the high bit set
+        on all but the last byte of a value.
+    """
+    values = np.asarray(values, np.uint64)
+    lengths = np.ones(len(values), np.intp)
+    for bits in range(7, 64, 7):
+        lengths += values >= np.uint64(1 << bits)
+    starts = np.cumsum(lengths) - lengths
+
+    out = np.zeros(lengths.sum(), np.uint8)
+    for k in range(lengths.max() if len(values) else 0):
+        more = lengths > k
+        byte = (values[more] >> np.uint64(7 * k)) & np.uint64(0x7f)
+        byte |= np.where(lengths[more] > k + 1, 0x80, 0).astype(np.uint64)
+        out[starts[more] + k] = byte
+    return out.tostring()
+
+
+def decode_varints(data, n):
+    """ Decodes the first n varints of a uint8 array. Returns the
+        values and the number of bytes they took.
+    """
+    ends = np.flatnonzero(data < 0x80)
+    if len(ends) < n:
+        raise ValueError('truncated varints')
+    if n == 0:
+        return np.zeros(0, np.uint64), 0
+    ends = ends[:n]
+    used = ends[-1] + 1
+    data = data[:used]
+
+    starts = np.concatenate(([0], ends[:-1] + 1))
+    owner = np.zeros(used, np.intp)
+    owner[starts[1:]] = 1
+    owner = np.cumsum(owner)
+    shifts = (7 * (np.arange(used) - starts[owner])).astype(np.uint64)
+    parts = (data & 0x7f).astype(np.uint64) << shifts
+    return np.bitwise_or.reduceat(parts, starts), used
+
+
+def encode_block(first, counts, timestamps=None):
+    """ One block (header and payload) holding the samples. """
+    counts = np.asarray(counts, np.int64)
+    payload = encode_varints(zigzag(deltas(counts)))
+    flags = 0
+    base = 0.0
+    if timestamps is not None and len(timestamps):
+        timestamps = np.asarray(timestamps, np.float64)
+        base = timestamps[0]
+        micros = np.round((timestamps - base) * 1e6).astype(np.int64)
+        payload += encode_varints(zigzag(deltas(deltas(micros))))
+        flags |= FLAG_TIMESTAMPS
+
+    header = struct.pack(BLOCK_HEADER, BLOCK_MAGIC, len(counts), flags, 0,
+                         len(payload), 0, first, base)
+    crc = zlib.crc32(payload, zlib.crc32(header)) & 0xffffffff
+    return struct.pack(BLOCK_HEADER, BLOCK_MAGIC, len(counts), flags, 0,
+                       len(payload), crc, first, base) + payload
+
+
+def decode_block(header, payload):
+    """ The samples of a block as a SampleBatch. Timestamps are
+        None if the block has none. Raises ValueError if the block
+        fails its CRC.
+    """
+    magic, n, flags, _, size, crc, first, base = struct.unpack(BLOCK_HEADER, header)
+    zeroed = struct.pack(BLOCK_HEADER, magic, n, flags, 0, size, 0, first, base)
+    if zlib.crc32(payload, zlib.crc32(zeroed)) & 0xffffffff != crc:
+        raise ValueError('CRC mismatch')
+
+    data = np.frombuffer(payload, np.uint8)
+    diffs, used = decode_varints(data, n)
+    counts = np.cumsum(unzigzag(diffs)).astype(np.int32)
+    timestamps = None
+    if flags & FLAG_TIMESTAMPS:
+        steps, _ = decode_varints(data[used:], n)
+        micros = np.cumsum(np.cumsum(unzigzag(steps)))
+        timestamps = base + micros / 1e6
+    return SampleBatch(first, counts, timestamps)
+
+
+def write_header(f):
+    f.write(struct.pack(HEADER_FORMAT, MAGIC, VERSION, HEADER_SIZE))
+
+
+def read_header(f, path):
+    header = f.read(HEADER_SIZE)
+    if len(header) < HEADER_SIZE:
+        raise ValueError('%s: not a CDC archive' % path)
+    magic, version, header_size = struct.unpack(HEADER_FORMAT, header)
+    if magic != MAGIC:
+        raise ValueError('%s: not a CDC archive' % path)
+    f.seek(header_size)
+
+
+def iter_block_headers(f, path=''):
+    """ Yields (offset, samples, first, timestamp) for the blocks of
+        the archive file f from its current position on, skipping
+        over the payloads.
+    """
+    while True:
+        offset = f.tell()
+        header = f.read(BLOCK_HEADER_SIZE)
+        if len(header) < BLOCK_HEADER_SIZE:
+            return
+        magic, n, flags, _, size, crc, first, base = struct.unpack(BLOCK_HEADER, header)
+        if magic != BLOCK_MAGIC:
+            raise ValueError('%s: bad block at offset %d' % (path, offset))
+        f.seek(size, os.SEEK_CUR)
+        if f.tell() > os.fstat(f.fileno()).st_size:
+            return      # partially written
+        yield offset, n, first, base
+
+
+def iter_blocks(f, path=''):
+    """ Decodes the archive file f from its current position on,
+        yielding (offset, batch) for every block.
+    """
+    while True:
+        offset = f.tell()
+        header = f.read(BLOCK_HEADER_SIZE)
+        if len(header) < BLOCK_HEADER_SIZE:
+            return
+        magic, _, _, _, size, _, _, _ = struct.unpack(BLOCK_HEADER, header)
+        if magic != BLOCK_MAGIC:
+            raise ValueError('%s: bad block at offset %d' % (path, offset))
+        payload = f.read(size)
+        if len(payload) < size:
+            return      # partially written
+        try:
+            yield offset, decode_block(header, payload)
+        except ValueError, e:
+            raise ValueError('%s: block at offset %d: %s' % (path, offset, e))
+
+
+def open_archive(path):
+    """ Opens an archive for reading, positioned at its first block.
+    """
+    f = open(path, 'rb')
+    try:
+        read_header(f, path)
+    except ValueError:
+        f.close()
+        raise
+    return f
+
+
+class ArchiveWriter(object):
+    """ Writes SampleBatches to a new archive file, a block of
+        block_samples samples at a time. A batch that doesn't
+        continue the sample indices of the previous one starts a
+        new block.
+
+        timestamps:
+            If False, only the counts are kept.
+    """
+    def __init__(self, path, buffering=-1, block_samples=BLOCK_SAMPLES, timestamps=True):
+        self.path = path
+        self.block_samples = block_samples
+        self.timestamps = timestamps
+        self.file = open(path, 'wb', buffering)
+        write_header(self.file)
+        self.first = None
+        self.counts = []
+        self.times = []
+        self.pending = 0
+
+    def write_batch(self, batch):
+        n = len(batch.counts)
+        if n == 0:
+            return
+        if self.pending and batch.first != self.first + self.pending:
+            self.write_block(True)
+        if not self.pending:
+            self.first = batch.first
+        self.counts.append(batch.counts)
+        if self.timestamps:
+            self.times.append(batch.timestamps)
+        self.pending += n
+        if self.pending >= self.block_samples:
+            self.write_block()
+
+    def write_block(self, partial=False):
+        """ Writes the pending samples as full blocks, and the
+            remainder as a short block if 'partial' is True.
+        """
+        if not self.pending:
+            return
+        counts = np.concatenate(self.counts)
+        times = np.concatenate(self.times) if self.timestamps else None
+        size = self.block_samples
+        for i in xrange(0, len(counts), size):
+            if len(counts) - i < size and not partial:
+                # Keep the remainder for the next block
+                self.counts = [counts[i:]]
+                self.times = [times[i:]] if times is not None else []
+                self.first += i
+                self.pending = len(counts) - i
+                return
+            self.file.write(encode_block(self.first + i, counts[i:i + size],
+                                         times[i:i + size] if times is not None else None))
+        self.counts = []
+        self.times = []
+        self.pending = 0
+
+    def flush(self):
+        self.file.flush()
+
+    def fileno(self):
+        return self.file.fileno()
+
+    def close(self):
+        self.write_block(True)
+        self.file.close()
+
+
+def read_time_range(path, start, stop):
+    """ Returns (timestamps, values) of the samples of an archive
+        from time 'start' to 'stop', decoding only the blocks that
+        hold them. Gaps are read as NaN.
+    """
+    timestamps, values = [np.zeros(0)], [np.zeros(0)]
+    f = open_archive(path)
+    try:
+        blocks = list(iter_block_headers(f, path))
+        starts = [base for _, _, _, base in blocks]
+        i = max(0, np.searchsorted(starts, start, 'right') - 1)
+        if i < len(blocks):
+            f.seek(blocks[i][0])
+            for _, batch in iter_blocks(f, path):
+                if batch.timestamps is None:
+                    raise ValueError('%s: the archive has no timestamps' % path)
+                keep = (batch.timestamps >= start) & (batch.timestamps <= stop)
+                timestamps.append(batch.timestamps[keep])
+                values.append(batch.counts[keep].astype(np.float64))
+                if batch.timestamps[-1] > stop:
+                    break
+    finally:
+        f.close()
+    values = np.concatenate(values)
+    values[values == GAP_COUNT] = np.nan
+    return np.concatenate(timestamps), values
+
+
+def read_log_batches(path):
+    """ Yields the samples of a CSV or binary log as SampleBatches.
+        The samples of a CSV log are numbered from 0.
+    """
+    from logloader import iter_chunks, log_columns
+
+    if path.endswith('.cdcb'):
+        log = BinaryLog(path)
+        for i in xrange(0, len(log), 1 << 20):
+            records = log[i:i + (1 << 20)]
+            # Samples dropped before logging leave the indices
+            # discontinuous
+            breaks = np.flatnonzero(np.diff(records['index'].astype(np.int64)) != 1) + 1
+            for run in np.split(records, breaks):
+                yield SampleBatch(int(run['index'][0]),
+                                  np.array(run['count']),
+                                  np.array(run['timestamp']))
+        return
+
+    # Every row is kept; parse_block only skips malformed lines,
+    # such as a last line cut short by a crash
+    columns = log_columns(path)
+    first = 0
+    with open(path, 'rb') as f:
+        for _, rows in iter_chunks(f, 0, columns=columns):
+            if not len(rows):
+                continue
+            if columns > 1:
+                counts, timestamps = rows[:, -1], rows[:, 0]
+            else:
+                counts, timestamps = rows, None
+            counts = np.where(np.isnan(counts), GAP_COUNT, counts).astype(np.int32)
+            yield SampleBatch(first, counts, timestamps)
+            first += len(counts)
+
+
+def read_log_samples(path):
+    """ Returns (counts, timestamps) of all the samples of a CSV or
+        binary log, timestamps being None if the log has none. CSV
+        logs are parsed a line at a time, independently of
+        read_log_batches, so that transcode can check its archives
+        against them.
+    """
+    if path.endswith('.cdcb'):
+        log = BinaryLog(path)
+        return np.array(log.counts), np.array(log.timestamps)
+
+    # Rows by number of columns; the log's rows are those of the
+    # most common kind
+    rows = {1: [], 2: []}
+    with open(path, 'rb') as f:
+        for line in f:
+            fields = line.split(',')
+            if len(fields) not in rows:
+                continue
+            try:
+                rows[len(fields)].append([float(field) for field in fields])
+            except ValueError:
+                continue
+    columns = 2 if len(rows[2]) > len(rows[1]) else 1
+    values = np.array(rows[columns], np.float64).reshape(-1, columns)
+    counts = values[:, -1]
+    counts = np.where(np.isnan(counts), GAP_COUNT, counts).astype(np.int32)
+    return counts, values[:, 0] if columns == 2 else None
+
+
+def transcode(path, out_path):
+    """ Writes the samples of a CSV or binary log to an archive at
+        out_path and checks that it decodes to the counts and
+        timestamps of a separate, full read of the log. Returns the
+        number of samples.
+    """
+    writer = None
+    for batch in read_log_batches(path):
+        if writer is None:
+            writer = ArchiveWriter(out_path, 1 << 20,
+                                   timestamps=batch.timestamps is not None)
+        writer.write_batch(batch)
+    if writer is None:
+        writer = ArchiveWriter(out_path, timestamps=False)
+    writer.close()
+
+    counts, timestamps = [np.zeros(0, np.int32)], [np.zeros(0)]
+    f = open_archive(out_path)
+    try:
+        for _, batch in iter_blocks(f, out_path):
+            counts.append(batch.counts)
+            if batch.timestamps is not None:
+                timestamps.append(batch.timestamps)
+    finally:
+        f.close()
+    counts, timestamps = np.concatenate(counts), np.concatenate(timestamps)
+
+    expected_counts, expected_timestamps = read_log_samples(path)
+    if expected_timestamps is None:
+        expected_timestamps = np.zeros(0)
+    # Archives keep timestamps to the microsecond
+    if (not np.array_equal(counts, expected_counts) or
+            len(timestamps) != len(expected_timestamps) or
+            np.any(np.abs(timestamps - expected_timestamps) > 1e-6)):
+        raise ValueError('%s: the archive does not match the log' % out_path)
+    return len(counts)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Transcode CDC logs (CSV or .cdcb) to compressed .cdca archives')
+    parser.add_argument('logs', nargs='+', metavar='LOG')
+    parser.add_argument('-o', '--directory',
+        help='directory for the archives (default: next to each log)')
+    parser.add_argument('--delete', action='store_true',
+        help='delete each log once its archive has been verified')
+    args = parser.parse_args()
+
+    status = 0
+    for path in args.logs:
+        base = os.path.splitext(os.path.basename(path))[0] + '.cdca'
+        out_path = os.path.join(args.directory or os.path.dirname(path), base)
+        try:
+            n = transcode(path, out_path)
+        except (IOError, ValueError), e:
+            print >> sys.stderr, 'Error:', e
+            status = 1
+            continue
+        size, archived = os.path.getsize(path), os.path.getsize(out_path)
+        print '%s: %d samples, %d -> %d bytes (%.1fx)' % (
+            path, n, size, archived, size / float(max(1, archived)))
+        if args.delete:
+            os.remove(path)
+    return status
+
+if __name__ == "__main__":
+    sys.exit(main())
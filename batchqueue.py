@@ -0,0 +1,186 @@
+"""
+A bounded queue for sample batches.
+
+The acquisition threads put SampleBatches (or (port, batch) pairs) on a
+queue that the GUI drains on a timer. If the consumer stalls, an
+unbounded Queue.Queue grows for as long as the stall lasts. BatchQueue
+holds at most a fixed number of samples and applies an overflow policy
+when a batch doesn't fit:
+
+    'block'         the producer waits for room; nothing is lost in the
+                    queue, but the serial driver's buffer fills instead
+    'drop-oldest'   the oldest queued batches are dropped
+    'decimate'      every other queued batch is dropped, thinning the
+                    backlog evenly so it still spans the whole stall
+
+Dropped batches take their sample indices with them, so the gaps they
+leave are visible in the logs.
+"""
+import collections
+import threading
+import Queue
+
+from timebase import monotonic
+
+
+POLICIES = ('block', 'drop-oldest', 'decimate')
+
+
+def item_samples(item):
+    """ Number of samples in a queue item.
+    """
+    if hasattr(item, 'counts'):
+        return len(item.counts)
+    if isinstance(item, tuple) and len(item) == 2 and hasattr(item[1], 'counts'):
+        return len(item[1].counts)
+    return 1
+
+
+class BatchQueue(object):
+    """ A queue of sample batches holding at most 'capacity'
+        samples, with the get/put interface of Queue.Queue.
+
+        policy:
+            What happens when a batch doesn't fit: one of
+            POLICIES (see above).
+
+        Overload accounting:
+
+        samples:
+            Samples currently queued.
+
+        high_water:
+            Most samples that were ever queued at once.
+
+        dropped:
+            Samples dropped by the overflow policy.
+
+        full_time:
+            Seconds the queue has spent at capacity.
+
+        close():
+            Stop accepting batches and release any producer
+            blocked in put(). Later batches are discarded.
+    """
+    def __init__(self, capacity=65536, policy='drop-oldest'):
+        if policy not in POLICIES:
+            raise ValueError('unknown policy: %r' % policy)
+        self.capacity = capacity
+        self.policy = policy
+
+        self.items = collections.deque()     # (samples, item)
+        self.samples = 0
+        self.high_water = 0
+        self.dropped = 0
+        self._full_time = 0.0
+        self._full_since = None
+        self.closed = False
+
+        self.mutex = threading.Lock()
+        self.not_empty = threading.Condition(self.mutex)
+        self.not_full = threading.Condition(self.mutex)
+
+    def put(self, item, block=True, timeout=None):
+        n = item_samples(item)
+        with self.mutex:
+            if self.samples + n > self.capacity:
+                self._mark_full()
+                if self.policy == 'block':
+                    self._wait_for_room(n, block, timeout)
+                elif self.policy == 'drop-oldest':
+                    while self.items and self.samples + n > self.capacity:
+                        self._drop_oldest()
+                else:
+                    self._decimate(n)
+            if self.closed:
+                return
+
+            self.items.append((n, item))
+            self.samples += n
+            self.high_water = max(self.high_water, self.samples)
+            self.not_empty.notify()
+
+    def put_nowait(self, item):
+        return self.put(item, False)
+
+    def get(self, block=True, timeout=None):
+        with self.mutex:
+            if not block:
+                if not self.qsize():
+                    raise Queue.Empty
+            elif timeout is None:
+                while not self.qsize():
+                    self.not_empty.wait()
+            else:
+                end = monotonic() + timeout
+                while not self.qsize():
+                    remaining = end - monotonic()
+                    if remaining <= 0:
+                        raise Queue.Empty
+                    self.not_empty.wait(remaining)
+
+            n, item = self.items.popleft()
+            self.samples -= n
+            if self.samples < self.capacity:
+                self._mark_not_full()
+            self.not_full.notify()
+            return item
+
+    def get_nowait(self):
+        return self.get(False)
+
+    def qsize(self):
+        return len(self.items)
+
+    def empty(self):
+        return self.qsize() == 0
+
+    @property
+    def full_time(self):
+        with self.mutex:
+            if self._full_since is None:
+                return self._full_time
+            return self._full_time + monotonic() - self._full_since
+
+    def close(self):
+        with self.mutex:
+            self.closed = True
+            self.not_full.notifyAll()
+
+    def _wait_for_room(self, n, block, timeout):
+        if not block:
+            raise Queue.Full
+        end = None if timeout is None else monotonic() + timeout
+        while not self.closed and self.qsize() and self.samples + n > self.capacity:
+            if end is None:
+                self.not_full.wait()
+            else:
+                remaining = end - monotonic()
+                if remaining <= 0:
+                    raise Queue.Full
+                self.not_full.wait(remaining)
+
+    def _decimate(self, n):
+        while self.qsize() and self.samples + n > self.capacity:
+            live = self.items
+            self.items = collections.deque()
+            for i, entry in enumerate(live):
+                if i % 2 == 0:
+                    self.samples -= entry[0]
+                    self.dropped += entry[0]
+                else:
+                    self.items.append(entry)
+
+    def _drop_oldest(self):
+        n, _ = self.items.popleft()
+        self.samples -= n
+        self.dropped += n
+
+    def _mark_full(self):
+        if self._full_since is None:
+            self._full_since = monotonic()
+
+    def _mark_not_full(self):
+        if self._full_since is not None:
+            self._full_time += monotonic() - self._full_since
+            self._full_since = None
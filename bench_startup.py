@@ -0,0 +1,132 @@
+"""
+Startup time benchmark for cdcLogger.
+
+Launches a fresh interpreter for every run, so that each one pays for
+loading the modules the way a real launch does, and reports
+
+    import          from launching the interpreter to 'import cdcLogger'
+                    having returned
+    first frame     from launching the interpreter to the first paint
+                    of the main window
+
+as the median and minimum of the runs. It also lists the modules
+cdcLogger is supposed to import only on first use that were imported
+anyway. Run it with the interpreter the tool is deployed with:
+
+usage: python bench_startup.py [--runs N] [--import-only]
+"""
+import argparse
+import os
+import subprocess
+import sys
+import time
+
+
+# Modules that should not be loaded until an action needs them
+DEFERRED_MODULES = ['serial', 'socket', 'Tkinter', 'win32clipboard',
+                    'com_monitor', 'datalogger', 'logloader', 'streamserver']
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+def child(mode):
+    """ Runs in the launched interpreter: prints the time.time() at
+        which cdcLogger was imported and, unless mode is 'import',
+        at which the main window was first painted.
+    """
+    sys.path.insert(0, HERE)
+    import cdcLogger
+    imported = time.time()
+    loaded = [name for name in DEFERRED_MODULES if name in sys.modules]
+    print 'import %.6f' % imported
+    print 'loaded %s' % ','.join(loaded)
+    if mode == 'import':
+        return
+
+    from PyQt4.QtCore import QEvent, QObject, QTimer
+    from PyQt4.QtGui import QApplication
+
+    app = QApplication(sys.argv[:1])
+    form = cdcLogger.PlottingDataMonitor()
+
+    class FirstPaint(QObject):
+        def eventFilter(self, obj, event):
+            if event.type() == QEvent.Paint and not self.painted:
+                self.painted = time.time()
+                QTimer.singleShot(0, app.quit)
+            return False
+
+    first_paint = FirstPaint()
+    first_paint.painted = None
+    form.installEventFilter(first_paint)
+    form.show()
+    QTimer.singleShot(30000, app.quit)
+    app.exec_()
+    if first_paint.painted is not None:
+        print 'frame %.6f' % first_paint.painted
+
+
+def launch(mode):
+    """ Launches one child and returns its times relative to the
+        launch, and the deferred modules it loaded.
+    """
+    start = time.time()
+    output = subprocess.check_output(
+        [sys.executable, os.path.abspath(__file__), '--child', mode])
+    times = {}
+    loaded = []
+    for line in output.splitlines():
+        key, _, value = line.partition(' ')
+        if key == 'loaded':
+            loaded = [name for name in value.split(',') if name]
+        elif key in ('import', 'frame'):
+            times[key] = float(value) - start
+    return times, loaded
+
+
+def summary(values):
+    values = sorted(values)
+    return 'median %7.1f ms   min %7.1f ms' % (
+        values[len(values) // 2] * 1000, values[0] * 1000)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Measure the startup time of cdcLogger.')
+    parser.add_argument('--runs', type=int, default=10,
+        help='number of launches to measure (default: %(default)s)')
+    parser.add_argument('--import-only', action='store_true',
+        help='only measure the import, without opening the window')
+    parser.add_argument('--child', choices=['import', 'frame'],
+        help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        child(args.child)
+        return 0
+
+    mode = 'import' if args.import_only else 'frame'
+    results = {'import': [], 'frame': []}
+    loaded = set()
+    for i in range(args.runs):
+        try:
+            times, modules = launch(mode)
+        except subprocess.CalledProcessError, e:
+            print >> sys.stderr, 'Error: launch failed with status %d' % e.returncode
+            return 1
+        for key, value in times.items():
+            results[key].append(value)
+        loaded.update(modules)
+
+    print 'Runs:            %d' % args.runs
+    print 'Import:          %s' % summary(results['import'])
+    if results['frame']:
+        print 'First frame:     %s' % summary(results['frame'])
+    elif mode == 'frame':
+        print 'First frame:     not painted within 30 s'
+    if loaded:
+        print 'Loaded early:    %s' % ', '.join(sorted(loaded))
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,129 @@
+"""
+A fixed-width binary log format for CDC counts.
+
+A file starts with a HEADER_SIZE byte header followed by packed
+little-endian records of RECORD_DTYPE:
+
+    index       uint64   running sample index from the start of acquisition
+    timestamp   float64  sample time in seconds since the epoch
+    count       int32    CDC count, or GAP_COUNT
+
+Since every record has the same size, any range of samples can be
+located without parsing, and BinaryLog maps the whole file into memory
+so slices of it are views rather than copies.
+
+A record with the count GAP_COUNT marks a gap in the data, e.g. while
+the device was disconnected.
+"""
+import os
+import struct
+
+import numpy as np
+
+
+MAGIC = 'CDCB'
+VERSION = 1
+
+# magic, version, header size, record size, padding
+HEADER_FORMAT = '<4sHHH22x'
+HEADER_SIZE = struct.calcsize(HEADER_FORMAT)
+
+RECORD_DTYPE = np.dtype([('index', '<u8'),
+                         ('timestamp', '<f8'),
+                         ('count', '<i4')])
+
+# The count of a gap marker, which no real sample can have
+GAP_COUNT = np.iinfo(np.int32).min
+
+
+def counts_as_float(counts):
+    """ The counts as a float64 array, with NaN at the gaps.
+    """
+    values = np.asarray(counts, np.float64)
+    gaps = values == GAP_COUNT
+    if gaps.any():
+        values[gaps] = np.nan
+    return values
+
+
+def batch_records(batch):
+    """ The samples of a SampleBatch as an array of RECORD_DTYPE.
+    """
+    records = np.empty(len(batch.counts), RECORD_DTYPE)
+    records['index'] = batch.first + np.arange(len(batch.counts))
+    records['timestamp'] = batch.timestamps
+    records['count'] = batch.counts
+    return records
+
+
+class BinaryLogWriter(object):
+    """ Writes SampleBatches to a new binary log file.
+    """
+    def __init__(self, path, buffering=-1):
+        self.path = path
+        self.file = open(path, 'wb', buffering)
+        self.file.write(struct.pack(HEADER_FORMAT, MAGIC, VERSION,
+                                    HEADER_SIZE, RECORD_DTYPE.itemsize))
+
+    def write_batch(self, batch):
+        self.file.write(batch_records(batch).tostring())
+
+    def flush(self):
+        self.file.flush()
+
+    def fileno(self):
+        return self.file.fileno()
+
+    def close(self):
+        self.file.close()
+
+
+class BinaryLog(object):
+    """ Read-only, memory-mapped access to a binary log file.
+
+        records:
+            Array of RECORD_DTYPE mapped onto the file. Indexing
+            and slicing it (or the log itself) returns views.
+
+        indices/timestamps/counts:
+            Views of the individual record fields.
+
+        A record that was only partially written (e.g. because
+        the logger was killed) is ignored.
+    """
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as f:
+            header = f.read(HEADER_SIZE)
+        if len(header) < HEADER_SIZE:
+            raise ValueError('%s: not a binary CDC log' % path)
+        magic, version, header_size, record_size = struct.unpack(
+            HEADER_FORMAT, header)
+        if (magic != MAGIC or version != VERSION or
+                record_size != RECORD_DTYPE.itemsize):
+            raise ValueError('%s: not a binary CDC log' % path)
+
+        n = (os.path.getsize(path) - header_size) // record_size
+        if n > 0:
+            self.records = np.memmap(path, RECORD_DTYPE, 'r',
+                                     offset=header_size, shape=(n,))
+        else:
+            self.records = np.zeros(0, RECORD_DTYPE)
+
+    def __len__(self):
+        return len(self.records)
+
+    def __getitem__(self, key):
+        return self.records[key]
+
+    @property
+    def indices(self):
+        return self.records['index']
+
+    @property
+    def timestamps(self):
+        return self.records['timestamp']
+
+    @property
+    def counts(self):
+        return self.records['count']
@@ -22,49 +22,144 @@ from PyQt4.QtCore import *
 from PyQt4.QtGui import *
 import PyQt4.Qwt5 as Qwt
 import Queue
-import csv
-import datetime
 import time
 import math
-from Tkinter import Tk
-import win32clipboard
 
+import numpy as np
 
-from com_monitor import ComMonitorThread
+# Only what the main window needs is imported here. The serial port,
+# logging, log loading and stream server modules are imported by the
+# actions that use them, so they don't slow down every launch.
+from batchqueue import BatchQueue, POLICIES
+from binlog import GAP_COUNT
+from decimate import minmax_decimate
+from governor import FrameRateGovernor
 from eblib.serialutils import full_port_name, enumerate_serial_ports
-from eblib.utils import get_all_from_queue, get_item_from_queue
+from eblib.utils import get_all_from_queue
 from livedatafeed import LiveDataFeed
-
-class DateTimeScaleDraw( Qwt.QwtScaleDraw ):
-    '''Class used to draw a datetime axis on our plot.
+from metrics import MetricsReporter, format_status, registry
+from period import PeriodEstimator
+from plotwidgets import DateTimeScaleDraw, GapCurve, RawConsole
+from ringbuffer import RingBuffer
+from stats import RunningStats, WindowedStats
+from timebase import monotonic
+
+class LogLoaderThread(QThread):
+    '''Thread loading an overview of a log file for Open Graph, so
+    that large files don't freeze the GUI.
     '''
-    def __init__( self, *args ):
-        Qwt.QwtScaleDraw.__init__( self, *args )
-
-    def label( self, value ):
-        '''Function used to create the text of each label
-        used to draw the axis.
-        '''
+    def __init__(self, path, parent=None):
+        QThread.__init__(self, parent)
+        self.path = path
+        self.overview = None
+        self.error = None
+
+    def run(self):
+        from logloader import load_overview
         try:
-            dt = datetime.datetime.fromtimestamp(  value )
-        except:
-            dt = datetime.datetime.fromtimestamp(  1349931600 )
-        #return Qwt.QwtText( '%s' % dt.strftime( '%d/%m%Y %H:%M:%S' ) )
-        return Qwt.QwtText( '%s' % dt.strftime( '%H:%M:%S' ) )
+            self.overview = load_overview(self.path)
+        except (IOError, ValueError), e:
+            self.error = str(e)
+        except Exception, e:
+            # on_log_loaded needs either an overview or an error
+            self.error = 'Unexpected error: %s: %s' % (type(e).__name__, e)
+
+class TimeRangeDialog(QDialog):
+    '''Asks for the start and end of a time range within the span
+    (first, last) of a log, in seconds since the epoch.
+    '''
+    def __init__(self, span, parent=None):
+        QDialog.__init__(self, parent)
+        self.setWindowTitle('Open time range')
+
+        first = QDateTime.fromTime_t(int(span[0]))
+        last = QDateTime.fromTime_t(int(math.ceil(span[1])))
+        self.start_edit = self.create_edit(first, first, last)
+        self.stop_edit = self.create_edit(last, first, last)
+
+        buttons = QDialogButtonBox(QDialogButtonBox.Ok | QDialogButtonBox.Cancel)
+        buttons.accepted.connect(self.accept)
+        buttons.rejected.connect(self.reject)
+
+        layout = QFormLayout()
+        layout.addRow('From:', self.start_edit)
+        layout.addRow('To:', self.stop_edit)
+        layout.addRow(buttons)
+        self.setLayout(layout)
+
+    def create_edit(self, value, first, last):
+        edit = QDateTimeEdit(value)
+        edit.setDisplayFormat('yyyy-MM-dd hh:mm:ss')
+        edit.setCalendarPopup(True)
+        edit.setDateTimeRange(first, last)
+        return edit
+
+    def time_range(self):
+        return (float(self.start_edit.dateTime().toTime_t()),
+                float(self.stop_edit.dateTime().toTime_t()))
 
 class PlottingDataMonitor(QMainWindow):
-    def __init__(self, parent=None):
+    # Most samples of an opened log file drawn at full resolution
+    full_resolution_limit = 200000
+
+    # Milliseconds between reads of the data queue
+    ingest_interval = 10
+
+    # Format of the log files (see datalogger.DataLogger)
+    log_format = 'csv'
+
+    # Seconds between flushes of the log file (None to leave it to
+    # the file buffer), and whether flushes wait for the disk (see
+    # datalogger.LogWriterThread)
+    log_flush_interval = 1.0
+    log_fsync = False
+
+    # Most samples waiting in the data queue, and what to do with
+    # new batches when it is full (see batchqueue.POLICIES)
+    queue_capacity = 65536
+    queue_policy = 'drop-oldest'
+
+    # Number of recent periods the period statistics cover,
+    # or None for all periods since the last reset
+    period_window = None
+
+    # 'crossing' to time every period from mean crossings, or
+    # 'autocorrelation' for a windowed autocorrelation estimate
+    period_method = 'crossing'
+
+    def __init__(self, parent=None, window_size=765):
         super(PlottingDataMonitor, self).__init__(parent)
 
         self.monitor_active = False
         self.logger_active = False
+        self.log_writer = None
+        self.stream_server = None
+        self.metrics_reporter = None
+        self.update_time = registry.histogram('gui.update_monitor')
+        self.replot_time = registry.histogram('gui.replot')
         self.com_monitor = None
         self.com_data_q = None
+        self.data_q = None
         self.com_error_q = None
+        self.status_q = None
         self.livefeed = LiveDataFeed()
-        self.temperature_samples = []
+        self.plot_cursor = self.livefeed.subscribe()
+        self.period_cursor = self.livefeed.subscribe()
+        self.loader = None
+        self.overview = None
+        self.history = None
+        self.range_samples = None
+        self.temperature_samples = RingBuffer(window_size)
+        self.period_estimator = PeriodEstimator(method=self.period_method)
         self.timer = QTimer()
 
+        # Plot redraws are paced separately from data ingest
+        self.governor = FrameRateGovernor()
+        self.plot_dirty = False
+        self.render_timer = QTimer()
+        self.render_timer.setSingleShot(True)
+        self.connect(self.render_timer, SIGNAL('timeout()'), self.on_render_timer)
+
 
         self.create_menu()
         self.create_main_frame()
@@ -96,7 +191,7 @@ class PlottingDataMonitor(QMainWindow):
         #plot.setAxisScale(Qwt.QwtPlot.yLeft, 0, 8000000, 1000000)
         #plot.replot()
 
-        curve = Qwt.QwtPlotCurve('')
+        curve = GapCurve('')
         curve.setRenderHint(Qwt.QwtPlotItem.RenderAntialiased)
         pen = QPen(QColor('limegreen'))
         pen.setWidth(2)
@@ -108,14 +203,22 @@ class PlottingDataMonitor(QMainWindow):
     def create_status_bar(self):
         self.status_text = QLabel('Monitor idle')
         self.statusBar().addWidget(self.status_text, 1)
+        self.metrics_text = QLabel('')
+        self.statusBar().addPermanentWidget(self.metrics_text)
+        self.queue_text = QLabel('')
+        self.statusBar().addPermanentWidget(self.queue_text)
+        self.fps_text = QLabel('')
+        self.statusBar().addPermanentWidget(self.fps_text)
 
     def create_main_frame(self):
         # Edit Box
         #
-        self.editbox = QTextEdit()
-        self.editbox.setReadOnly(True)
+        self.console = RawConsole()
+        self.pauseConsole = QCheckBox('Pause')
+        self.connect(self.pauseConsole, SIGNAL('toggled(bool)'), self.console.set_paused)
         editbox_layout = QVBoxLayout()
-        editbox_layout.addWidget(self.editbox)
+        editbox_layout.addWidget(self.console)
+        editbox_layout.addWidget(self.pauseConsole)
         editbox_layout.addStretch(1)
         editbox_groupbox = QGroupBox('CDC Counts')
         editbox_groupbox.setLayout(editbox_layout)
@@ -185,6 +288,7 @@ class PlottingDataMonitor(QMainWindow):
             Qwt.QwtPicker.AlwaysOff,
             self.plot.canvas())
         self.zoomer.setRubberBandPen(QPen(Qt.red))
+        self.connect(self.zoomer, SIGNAL('zoomed(const QwtDoubleRect &)'), self.on_zoomed)
         #self.zoomer.setZoomBase(True)
         # Main frame and layout
         #
@@ -202,30 +306,26 @@ class PlottingDataMonitor(QMainWindow):
     def periodReset(self):
         print('Reset')
         self.periodAvg = []
+        self.period_stats = self.create_period_stats()
         self.periodCount = 0
+        self.period_estimator.reset()
         self.stop = 0
-        self.startTime=time.clock()
-        self.r = Tk()
-        self.r.withdraw()
-        self.r.clipboard_clear()
 
 
     def periodStop(self):
         print('Stop')
         self.stop = 1
-        try:
-            for elem in self.periodAvg[2:len(self.periodAvg)]:
-                self.r.clipboard_append(str(elem))
-                self.r.clipboard_append('\n')
-            self.r.destroy()
-        except:
+        periods = self.periodAvg[2:len(self.periodAvg)]
+        if len(periods) > 0:
+            # One period per line, ready to paste into a spreadsheet
+            self.copy_to_clipboard(''.join('%s\n' % elem for elem in periods))
+        else:
             print('There is nothing in the clipboard')
 
-        #win32clipboard.OpenClipboard()
-        #win32clipboard.EmptyClipboard()
-        #win32clipboard.SetClipboardText(str(self.periodAvg[1:len(self.periodAvg)]))
-
-        #win32clipboard.CloseClipboard()
+    def copy_to_clipboard(self, text):
+        # Qt's clipboard works the same on all platforms, and is
+        # only set up the first time it is asked for
+        QApplication.clipboard().setText(text)
 
 
     def create_menu(self):
@@ -249,6 +349,63 @@ class PlottingDataMonitor(QMainWindow):
         self.openFile.setStatusTip('Open Graph File')
         self.openFile.triggered.connect(self.on_Open)
 
+        history_action = self.create_action("Open &history...",
+            shortcut="Ctrl+H", slot=self.on_open_history,
+            tip="Browse the rollups the logger keeps of the whole history")
+
+        range_action = self.create_action("Open time &range...",
+            slot=self.on_open_time_range,
+            tip="Show a time range of a timestamped log")
+
+        self.log_format_menu = QMenu("Log &format", self)
+        self.log_format_group = QActionGroup(self)
+        for fmt, label, tip in (
+                ('csv', 'CSV', "Log one count per line"),
+                ('tcsv', 'Timestamped CSV',
+                    "Log a timestamp and a count per line, with a time index for seeking"),
+                ('bin', 'Binary', "Log to fixed-width binary .cdcb files"),
+                ('arc', 'Compressed archive',
+                    "Log to delta compressed .cdca archives, a tenth the size of CSV")):
+            action = self.create_action(label,
+                slot=lambda fmt=fmt: self.on_log_format(fmt),
+                checkable=True, tip=tip)
+            action.setChecked(fmt == self.log_format)
+            self.log_format_group.addAction(action)
+            self.log_format_menu.addAction(action)
+
+        flush_action = self.create_action("Log f&lush interval...",
+            slot=self.on_log_flush_interval,
+            tip="Set how often the log file is flushed")
+
+        self.fsync_action = self.create_action("Log f&sync",
+            slot=self.on_log_fsync, checkable=True,
+            tip="Wait for every flush of the log file to reach the disk")
+        self.fsync_action.setChecked(self.log_fsync)
+
+        fps_action = self.create_action("Frame &rate...",
+            slot=self.on_frame_rate, tip="Set the target frame rate of the live plot")
+
+        window_action = self.create_action("Plot &window...",
+            slot=self.on_window_size, tip="Set the number of samples shown in the live plot")
+
+        self.metrics_action = self.create_action("Pipeline &metrics...",
+            slot=self.on_metrics, checkable=True,
+            tip="Measure the acquisition, display and logging pipeline")
+
+        self.queue_menu = QMenu("Queue &overflow", self)
+        self.queue_policy_group = QActionGroup(self)
+        for policy in POLICIES:
+            action = self.create_action(policy.capitalize().replace('-', ' '),
+                slot=lambda policy=policy: self.on_queue_policy(policy),
+                checkable=True, tip="What to do with new data when the data queue is full")
+            action.setChecked(policy == self.queue_policy)
+            self.queue_policy_group.addAction(action)
+            self.queue_menu.addAction(action)
+
+        self.serve_action = self.create_action("Stream &server",
+            slot=self.on_serve, checkable=True,
+            tip="Publish the live samples to local subscribers")
+
 
 
 
@@ -264,8 +421,9 @@ class PlottingDataMonitor(QMainWindow):
         self.stopLog_action.setEnabled(False)
 
         self.add_actions(self.file_menu,
-            (   selectport_action, self.openFile, self.startMon_action, self.stopMon_action, self.startLog_action, self.stopLog_action,
-                None, exit_action))
+            (   selectport_action, self.openFile, history_action, range_action, self.startMon_action, self.stopMon_action, self.startLog_action, self.stopLog_action,
+                None, self.log_format_menu.menuAction(), flush_action, self.fsync_action, window_action, fps_action, self.serve_action,
+                self.queue_menu.menuAction(), self.metrics_action, None, exit_action))
 
         self.help_menu = self.menuBar().addMenu("&Help")
         about_action = self.create_action("&About",
@@ -277,46 +435,162 @@ class PlottingDataMonitor(QMainWindow):
     def selected(self, _):
         self.showInfo()
 
-    def meanstdv(self, x):
-        """ Calculate mean and standard deviation of data x[]:
-        mean = {\sum_i x_i \over n} std = sqrt(\sum_i (x_i - mean)^2 \over n-1)
+    def create_period_stats(self):
+        """ The first two periods are measured before the signal
+            has settled, so they are left out of the statistics.
         """
-        from math import sqrt
-        n, mean, std = len(x), 0, 0
-        for a in x:
-            mean = mean + a
-        mean = mean / float(n)
-        for a in x:
-            std = std + (a - mean)**2
-        std = sqrt(std / float(n-1))
-        return mean, std
+        if self.period_window is None:
+            return RunningStats(skip=2)
+        return WindowedStats(self.period_window, skip=2)
 
     def on_Open(self):
-        cdc_data = []
-        index = []
+        if self.loader is not None:
+            return
         fname = QFileDialog.getOpenFileName(self, 'Open file', 'QDir::currentPath()')
 
 
         if fname.isEmpty() == False:
-            f = open(fname, 'r')
-            cdc_data = f.readlines()
-            f.close()
-            cdc_data.pop(0) #Pop the first and the last to get rid of bad data
-            cdc_data.pop(-1)
-            cdc_data_float = map(float, cdc_data)
-            index = [i for i in range(len(cdc_data))]
-
-            # Draw the Graph
-            #
+            # Parse the file in the background and draw the graph
+            # when it's done
+            self.status_text.setText('Loading %s...' % fname)
+            self.loader = LogLoaderThread(str(fname), self)
+            self.connect(self.loader, SIGNAL('finished()'), self.on_log_loaded)
+            self.loader.start()
+
+    def on_log_loaded(self):
+        loader, self.loader = self.loader, None
+        if loader.error is not None:
+            self.status_text.setText('Monitor idle')
+            QMessageBox.critical(self, 'Open Graph error', loader.error)
+            return
+        self.overview = loader.overview
+        self.history = None
+        self.range_samples = None
 
-            self.curve.setData(index, cdc_data_float)
-            #self.curve.setData(index[0:3600], cdc_data_float[0:3600])
-            #Set up the axis scales
-            self.plot.setAxisAutoScale(Qwt.QwtPlot.xBottom)
-            self.plot.setAxisAutoScale(Qwt.QwtPlot.yLeft)
-            self.zoomer.setZoomBase(True)
+        # Draw the Graph
+        #
+
+        self.curve.setData(self.overview.x, self.overview.y)
+        #Set up the axis scales
+        self.plot.setAxisAutoScale(Qwt.QwtPlot.xBottom)
+        self.plot.setAxisAutoScale(Qwt.QwtPlot.yLeft)
+        self.zoomer.setZoomBase(True)
+        self.status_text.setText('%s: %d samples' % (loader.path, self.overview.n))
+
+        #self.plot.replot()
+
+    def on_open_history(self):
+        from rollup import open_store
+
+        fname = QFileDialog.getOpenFileName(self, 'Open history', '',
+                    'Rollups (*rollup-*.cdcr);;All Files (*)')
+        if fname.isEmpty():
+            return
+        try:
+            history = open_store(str(fname))
+            span = history.span()
+        except (IOError, ValueError), e:
+            QMessageBox.critical(self, 'Open history error', str(e))
+            return
+        if span is None:
+            QMessageBox.critical(self, 'Open history error',
+                'There is no data in %s yet' % fname)
+            return
+
+        self.history = history
+        self.overview = None
+        self.range_samples = None
+        self.show_history(span[0], span[1] + 1)
+        self.plot.setAxisAutoScale(Qwt.QwtPlot.xBottom)
+        self.plot.setAxisAutoScale(Qwt.QwtPlot.yLeft)
+        self.zoomer.setZoomBase(True)
+
+    def show_history(self, start, stop):
+        """ Draws the history between the times start and stop
+            from the finest rollup tier that fits the plot width.
+        """
+        from rollup import envelope
 
-            #self.plot.replot()
+        name, width, records = self.history.select(start, stop,
+                                                   self.plot.canvas().width())
+        xdata, ydata = envelope(records, width)
+        self.curve.setData(xdata, ydata)
+        self.plot.replot()
+        self.status_text.setText('History: %d buckets of %s' % (len(records), name))
+
+    def on_open_time_range(self):
+        from logloader import log_time_span, read_time_range
+
+        fname = QFileDialog.getOpenFileName(self, 'Open time range', '',
+                    'Logs (*.csv *.cdcb *.cdca);;All Files (*)')
+        if fname.isEmpty():
+            return
+        path = str(fname)
+        try:
+            span = log_time_span(path)
+        except (IOError, ValueError), e:
+            QMessageBox.critical(self, 'Open time range error', str(e))
+            return
+        if span is None:
+            QMessageBox.critical(self, 'Open time range error',
+                'There are no samples in %s' % path)
+            return
+
+        dialog = TimeRangeDialog(span, self)
+        if not dialog.exec_():
+            return
+        start, stop = dialog.time_range()
+        try:
+            self.range_samples = read_time_range(path, start, stop)
+        except (IOError, ValueError), e:
+            QMessageBox.critical(self, 'Open time range error', str(e))
+            return
+        self.overview = None
+        self.history = None
+
+        self.show_range(start, stop)
+        self.plot.setAxisScale(Qwt.QwtPlot.xBottom, start, stop)
+        self.plot.setAxisAutoScale(Qwt.QwtPlot.yLeft)
+        self.zoomer.setZoomBase(True)
+        self.status_text.setText('%s: %d samples' % (path, len(self.range_samples[0])))
+
+    def show_range(self, start, stop):
+        """ Draws the samples of the opened time range between the
+            times start and stop, reduced to the plot width.
+        """
+        xdata, ydata = self.range_samples
+        lo = np.searchsorted(xdata, start, 'left')
+        hi = np.searchsorted(xdata, stop, 'right')
+        xdata, ydata = minmax_decimate(xdata[lo:hi], ydata[lo:hi],
+                                       self.plot.canvas().width())
+        self.curve.setData(xdata, ydata)
+        self.plot.replot()
+
+    def on_zoomed(self, rect):
+        """ Called when the zoomer changes the visible area. For
+            an opened log file, shows the full resolution samples
+            once few enough of them are visible, and the envelope
+            otherwise. For an opened history, switches to the
+            rollup tier that fits the visible span.
+        """
+        if self.history is not None:
+            self.show_history(rect.left(), rect.right())
+            return
+        if self.range_samples is not None:
+            self.show_range(rect.left(), rect.right())
+            return
+        if self.overview is None:
+            return
+
+        start = int(math.floor(rect.left()))
+        stop = int(math.ceil(rect.right())) + 1
+        if self.zoomer.zoomRectIndex() > 0 and stop - start <= self.full_resolution_limit:
+            xdata, ydata = self.overview.read_range(start, stop)
+        else:
+            xdata, ydata = self.overview.x, self.overview.y
+
+        self.curve.setData(xdata, ydata)
+        self.plot.replot()
 
     def set_actions_enable_state(self):
         if self.portname.text() == '':
@@ -338,6 +612,87 @@ class PlottingDataMonitor(QMainWindow):
         msg = __doc__
         QMessageBox.about(self, "About cdcLogger", msg.strip())
 
+    def on_window_size(self):
+        size, ok = QInputDialog.getInt(self, 'Plot window',
+                    'Samples shown in the live plot:',
+                    self.temperature_samples.capacity, 10, 10000000)
+
+        if ok:
+            self.temperature_samples = self.temperature_samples.resized(size)
+
+    def on_frame_rate(self):
+        fps, ok = QInputDialog.getInt(self, 'Frame rate',
+                    'Target frames per second of the live plot:',
+                    int(round(self.governor.target_fps)), 1, 100)
+
+        if ok:
+            self.governor.set_target_fps(fps)
+
+    def on_serve(self):
+        if not self.serve_action.isChecked():
+            if self.stream_server is not None:
+                self.stream_server.join(1)
+                self.stream_server = None
+            return
+
+        import socket
+        from streamserver import StreamServer, DEFAULT_ADDRESS, parse_address
+
+        address, ok = QInputDialog.getText(self, 'Stream server',
+                    'Publish on [host:]port or Unix socket path:',
+                    QLineEdit.Normal, DEFAULT_ADDRESS)
+
+        if ok and not address.isEmpty():
+            try:
+                self.stream_server = StreamServer(parse_address(str(address)))
+            except socket.error, e:
+                QMessageBox.critical(self, 'StreamServer error', str(e))
+            else:
+                self.stream_server.start()
+                return
+        self.serve_action.setChecked(False)
+
+    def on_metrics(self):
+        if not self.metrics_action.isChecked():
+            if self.metrics_reporter is not None:
+                self.metrics_reporter.join(2)
+                self.metrics_reporter = None
+            self.metrics_text.setText('')
+            return
+
+        # Without a file the metrics are only shown in the status bar
+        path = QFileDialog.getSaveFileName(self, 'Write metrics to',
+                    'metrics.jsonl', 'JSON lines (*.jsonl);;All Files (*)')
+        try:
+            self.metrics_reporter = MetricsReporter(
+                path=str(path) if not path.isEmpty() else None)
+        except IOError, e:
+            QMessageBox.critical(self, 'MetricsReporter error', str(e))
+            self.metrics_action.setChecked(False)
+            return
+        self.metrics_reporter.start()
+
+    def on_log_format(self, fmt):
+        # Applies from the next start of the logger
+        self.log_format = fmt
+
+    def on_log_flush_interval(self):
+        # Applies from the next start of the logger
+        interval, ok = QInputDialog.getDouble(self, 'Log flush interval',
+                    'Seconds between flushes of the log file (0 to leave it to the buffer):',
+                    self.log_flush_interval or 0, 0, 3600, 1)
+
+        if ok:
+            self.log_flush_interval = interval or None
+
+    def on_log_fsync(self):
+        # Applies from the next start of the logger
+        self.log_fsync = self.fsync_action.isChecked()
+
+    def on_queue_policy(self, policy):
+        # Applies from the next start of the monitor
+        self.queue_policy = policy
+
     def on_select_port(self):
         ports = list(enumerate_serial_ports())
         if len(ports) == 0:
@@ -353,56 +708,88 @@ class PlottingDataMonitor(QMainWindow):
             self.set_actions_enable_state()
 
     def on_stopMon(self):
+        if self.data_q is not None:
+            # Releases the monitor thread if it is blocked on a full queue
+            self.data_q.close()
         if self.com_monitor is not None:
             self.com_monitor.join(10)
             self.com_monitor = None
 
         self.monitor_active = False
         self.timer.stop()
+        self.render_timer.stop()
+        self.fps_text.setText('')
+        self.queue_text.setText('')
         self.set_actions_enable_state()
         self.status_text.setText('Monitor idle')
 
     def on_startMon(self):
         if self.com_monitor is not None or self.portname.text() == '':
            return
+        import com_monitor
+
+        # Status bar text for the states of the monitor thread
+        self.monitor_status = {
+            com_monitor.STARTING: 'Starting device...',
+            com_monitor.STREAMING: 'Monitor running',
+            com_monitor.LOST: 'Device lost, reconnecting...',
+        }
 
         # First define a couple of variables that will be used to calculate the period
-        #self.startTime = 1.1
-        self.mark = 'False'
+        self.period_estimator = PeriodEstimator(method=self.period_method)
+        self.overview = None
+        self.history = None
+        self.range_samples = None
         self.periodAvg = []
+        self.period_stats = self.create_period_stats()
         self.periodCount = 0
 
 
-        self.data_q = Queue.Queue()
+        self.data_q = BatchQueue(self.queue_capacity, self.queue_policy)
+        registry.gauge('queue.samples', lambda: self.data_q.samples)
         self.error_q = Queue.Queue()
-        self.com_monitor = ComMonitorThread(
+        self.status_q = Queue.Queue()
+        self.com_monitor = com_monitor.ComMonitorThread(
             self.data_q,
             self.error_q,
             full_port_name(str(self.portname.text())),
-            57600)
+            57600,
+            batch=True,
+            status_q=self.status_q)
+        # The thread opens the port and starts the device on its
+        # own; errors and state changes are picked up by on_timer
         self.com_monitor.start()
 
-        com_error = get_item_from_queue(self.error_q)
-        if com_error is not None:
-            QMessageBox.critical(self, 'ComMonitorThread error', com_error)
-            self.com_monitor = None
-
         self.monitor_active = True
         self.set_actions_enable_state()
 
         self.timer = QTimer()
         self.connect(self.timer, SIGNAL('timeout()'), self.on_timer)
 
-        self.timer.start(.005)
-        self.status_text.setText('Monitor running')
+        self.timer.start(self.ingest_interval)
+        self.render_timer.start(int(self.governor.interval * 1000))
+        self.status_text.setText(self.monitor_status[com_monitor.STARTING])
 
     def on_startLog(self):
-        self.log()
+        from datalogger import LogWriterThread
+        fmt = self.log_format
+        self.log_error_q = Queue.Queue()
+        try:
+            self.log_writer = LogWriterThread(self.log_error_q, fmt=fmt,
+                                              flush_interval=self.log_flush_interval,
+                                              fsync=self.log_fsync, rollup=True)
+        except (IOError, ValueError), e:
+            QMessageBox.critical(self, 'LogWriterThread error', str(e))
+            return
+        self.log_writer.start()
         self.logger_active = True
         self.set_actions_enable_state()
 
     def on_stopLog(self):
         self.logger_active = False
+        if self.log_writer is not None:
+            self.log_writer.join()
+            self.log_writer = None
         self.set_actions_enable_state()
 
     def on_timer(self):
@@ -410,130 +797,146 @@ class PlottingDataMonitor(QMainWindow):
             is fired.
         """
         self.read_serial_data()
-        self.update_monitor()
-
-    def log(self):
-        self.log_state = True
-        self.reading_num = 0
-
-        self.today = str(datetime.date.today())
-        self.logname = '%s.csv' % self.today
-        self.file = open(self.logname, "wb")
-        self.file_cvs = csv.writer(self.file)
-
-    def save_data(self,reading):
-        self.file_cvs.writerow ([reading])
-
-    def save_data_stamps(self,reading_num,reading,timestamp,utimestamp):
-        self.file_cvs.writerow ([reading_num,reading,timestamp,utimestamp])
+        with self.update_time.time():
+            self.update_monitor()
 
     def update_monitor(self):
         """ Updates the state of the monitor window with new
-            data. The livefeed is used to find out whether new
-            data was received since the last update. If not,
-            nothing is updated.
+            data. The plot and the period estimator each read all
+            the samples added to the livefeed since their last
+            update through their own cursor. The plot itself is
+            redrawn by on_render_timer.
         """
-        if self.livefeed.has_new_data:
-            data = self.livefeed.read_data()
-
-
-
-            # time.time() is a timestamp for the graph X axis ticks
-            # This may be a good place to add period calculation
+        timestamps, counts, _ = self.plot_cursor.read()
+        if len(counts) > 0:
+            # The sample time is a timestamp for the graph X axis ticks
+            # Gaps in the data become NaN, which the curve leaves out
             #
-            self.temperature_samples.append((time.time(), data['temperature']))
-            if len(self.temperature_samples) > 765:
-                self.temperature_samples.pop(0)
-
-            xdata = [s[0] for s in self.temperature_samples]
-            ydata = [s[1] for s in self.temperature_samples]
-
-
-            if (len(self.temperature_samples) > 2 and self.stop == 0):
-
-                if data['temperature'] > self.temperature_samples[-2][1]:
-                    self.mark = 1
-                elif (data['temperature'] < self.temperature_samples[-2][1]) and (self.mark == 1):
-                    endTime = time.clock()
-                    period = (endTime - self.startTime)
-                    self.periodAvg.append(period)
-                    if (len(self.periodAvg) <= 3):
-                        self.periodBox.setText('0')
-                        self.deviationBox.setText('0')
-                        self.countBox.setText('Waiting')
-
-
-                    if (len(self.periodAvg) > 3):
-                        self.Average, self.Deviation = self.meanstdv(self.periodAvg[2:len(self.periodAvg)])
-                        self.periodBox.setText(str(self.Average))
-                        self.deviationBox.setText(str(self.Deviation))
-                        self.countBox.setText(str(len(self.periodAvg)-2))
-
+            self.temperature_samples.extend(timestamps,
+                np.where(counts == GAP_COUNT, np.nan, counts))
 
+            #avg = sum(ydata) / float(len(ydata))
 
+            self.plot_dirty = True
+
+        timestamps, counts, overflow = self.period_cursor.read()
+        if self.stop == 0 and len(counts) > 0:
+            gaps = np.flatnonzero(counts == GAP_COUNT)
+            if overflow or len(gaps):
+                # Periods spanning the lost samples would be wrong
+                self.period_estimator.reset()
+            if len(gaps):
+                timestamps, counts = timestamps[gaps[-1] + 1:], counts[gaps[-1] + 1:]
+            for period in self.period_estimator.add(timestamps, counts):
+                self.add_period(period)
+
+    def add_period(self, period):
+        """ Called for every period measured by the period
+            estimator while the period calculation is running.
+        """
+        self.periodAvg.append(period)
+        self.period_stats.add(period)
+        if (self.period_stats.n < 2):
+            self.periodBox.setText('0')
+            self.deviationBox.setText('0')
+            self.countBox.setText('Waiting')
+
+
+        if (self.period_stats.n >= 2):
+            self.Average = self.period_stats.mean
+            self.Deviation = self.period_stats.stdev
+            self.periodBox.setText(str(self.Average))
+            self.deviationBox.setText(str(self.Deviation))
+            self.countBox.setText(str(self.period_stats.seen - 2))
+
+        self.periodCount += 1
+
+    def on_render_timer(self):
+        """ Executed by the render timer. Redraws the plot if
+            new data arrived since the last frame and schedules
+            the next frame, as paced by the governor.
+        """
+        if self.plot_dirty:
+            start = monotonic()
+            self.render_monitor()
+            end = monotonic()
+            self.governor.frame_done(start, end)
+            self.replot_time.observe(end - start)
+            self.plot_dirty = False
+            self.fps_text.setText('%.1f fps' % self.governor.fps)
 
+        if self.data_q is not None:
+            self.queue_text.setText('Queue peak %d/%d, dropped %d, full %.1f s' % (
+                self.data_q.high_water, self.data_q.capacity,
+                self.data_q.dropped, self.data_q.full_time))
 
+        if self.metrics_reporter is not None:
+            self.metrics_text.setText(format_status(self.metrics_reporter.latest))
 
-                    self.startTime = endTime
-                    self.periodCount += 1
-                    self.mark = 0
+        self.render_timer.start(int(self.governor.interval * 1000))
 
-            #avg = sum(ydata) / float(len(ydata))
+    def render_monitor(self):
+        xdata = self.temperature_samples.x
+        ydata = self.temperature_samples.y
 
+        self.plot.setAxisAutoScale(Qwt.QwtPlot.yLeft)
+        self.plot.setAxisScale(Qwt.QwtPlot.xBottom, xdata[0], max(20, xdata[-1]))
 
-            self.plot.setAxisAutoScale(Qwt.QwtPlot.yLeft)
-            self.plot.setAxisScale(Qwt.QwtPlot.xBottom, xdata[0], max(20, xdata[-1]))
-            self.curve.setData(xdata, ydata)
+        # Draw at most a min/max pair per horizontal pixel, so the
+        # replot time doesn't grow with the window length
+        xdata, ydata = minmax_decimate(xdata, ydata, self.plot.canvas().width())
+        self.curve.setData(xdata, ydata)
 
-            self.plot.replot()
+        self.plot.replot()
 
-            #self.plot.setAxisAutoScale(Qwt.QwtPlot.xBottom)
-            #self.zoomer.setZoomBase(True)
-            #self.thermo.setValue(avg)
+        #self.plot.setAxisAutoScale(Qwt.QwtPlot.xBottom)
+        #self.zoomer.setZoomBase(True)
+        #self.thermo.setValue(avg)
 
     def read_serial_data(self):
         """ Called periodically by the update timer to read data
             from the serial port.
         """
         qdata = list(get_all_from_queue(self.data_q))
-        if len(qdata) > 0: # At this point qdata object is a list type
-            count = 0
+        if len(qdata) > 0: # At this point qdata is a list of SampleBatch tuples
 
-            # Updates the text box with the incoming values
-            # Clears the text box every 4096 values so that
-            # Memory does not fill up with scrolling text
-            for elem in list(qdata):
-                self.editbox.append(qdata[count][0])
-                if self.editbox.document().blockCount() == 4096:
-                    self.editbox.clear()
-                data = dict(timestamp=qdata[count][1],temperature=int(qdata[count][0]))
-                self.livefeed.add_data(data)
+            # Updates the console with all the incoming values at once;
+            # it keeps only the most recent lines
+            values = np.concatenate([batch.counts for batch in qdata]).tolist()
+            if GAP_COUNT in values:
+                values = ['(gap)' if value == GAP_COUNT else value for value in values]
+            self.console.append_values(values)
 
+            for batch in qdata:
+                self.livefeed.add_batch(batch.timestamps, batch.counts)
 
                 if self.logger_active:
-                    self.reading_num = self.reading_num + 1
-
-                    #Uncomment for stamps
-                    #
-
-                    #utimestamp = time.time() #A unix style timestamp for the log
-                    #self.save_data_stamps(self.reading_num,int(qdata[count][0]),qdata[count][1],utimestamp)
-
+                    self.log_writer.put(batch)
 
-                    if self.today != str(datetime.date.today()):
-                        self.file.close()
-                        self.log();
-                        self.reading_num = self.reading_num + 1
-
-                    self.save_data(int(qdata[count][0]))
-
-                count=count+1
+                if self.stream_server is not None:
+                    self.stream_server.publish(batch)
 
             #data = dict(timestamp=qdata[-1][1],
             #           temperature=int(qdata[-1][0]))
 
             #self.livefeed.add_data(data)
 
+        for state in get_all_from_queue(self.status_q):
+            if state in self.monitor_status:
+                self.status_text.setText(self.monitor_status[state])
+
+        com_errors = list(get_all_from_queue(self.error_q))
+        if len(com_errors) > 0:
+            self.on_stopMon()
+            QMessageBox.critical(self, 'ComMonitorThread error', com_errors[0])
+            return
+
+        if self.logger_active:
+            log_errors = list(get_all_from_queue(self.log_error_q))
+            if len(log_errors) > 0:
+                self.on_stopLog()
+                QMessageBox.critical(self, 'LogWriterThread error', log_errors[0])
+
     def add_actions(self, target, actions):
         '''The following two methods are utilities for simpler creation
         and assignment of actions
@@ -562,7 +965,7 @@ class PlottingDataMonitor(QMainWindow):
         return action
 
     def closeEvent(self, event):
-        self.editbox.append("closing PyQtTest")
+        self.console.appendPlainText("closing PyQtTest")
 
 def main():
     app = QApplication(sys.argv)
@@ -1,9 +1,303 @@
 import Queue
 import threading
-import time
 import datetime
+
+import numpy as np
 import serial
 
+from binlog import GAP_COUNT
+from metrics import registry
+from samplebatch import SampleBatch
+from timebase import SampleClock, monotonic
+
+samples_read = registry.counter('serial.samples')
+malformed_lines = registry.counter('serial.malformed')
+parse_time = registry.histogram('serial.parse')
+
+
+def split_lines(buf):
+    """ Splits the string buf after its last newline. Returns a
+        (lines, partial) pair, where lines holds the complete lines
+        and partial is the trailing incomplete line that should be
+        prepended to the next chunk read from the port.
+    """
+    end = buf.rfind('\n') + 1
+    return buf[:end], buf[end:]
+
+
+# Byte classes for parse_counts
+_BLANK, _DIGIT, _MINUS, _OTHER = range(4)
+_BYTE_CLASS = np.empty(256, np.int8)
+_BYTE_CLASS[:] = _OTHER
+_BYTE_CLASS[[ord(c) for c in ' \t\r\n']] = _BLANK
+_BYTE_CLASS[ord('0'):ord('9') + 1] = _DIGIT
+_BYTE_CLASS[ord('-')] = _MINUS
+
+_POW10 = 10.0 ** np.arange(20)
+
+# Below this many lines numpy's per-call overhead outweighs its
+# speed, and the lines are parsed one by one
+VECTORIZE_LINES = 32
+
+
+def _parse_counts_loop(lines):
+    counts = []
+    malformed = 0
+    for line in lines.split('\n')[:-1]:
+        line = line.strip(' \t\r')
+        if not line:
+            continue
+        digits = line[1:] if line[0] == '-' else line
+        if digits.isdigit() and len(digits) <= 10:
+            value = int(line)
+            if GAP_COUNT < value < 2 ** 31:
+                counts.append(value)
+                continue
+        malformed += 1
+    return np.array(counts, np.int32), malformed
+
+
+def parse_counts(lines):
+    """ Converts a string of complete lines (each ending in a
+        newline) into a numpy array of CDC counts, in one pass
+        over the bytes with numpy rather than a Python loop over
+        the lines.
+
+        A valid line holds an optionally negative integer that
+        fits in 32 bits (other than GAP_COUNT), possibly surrounded
+        by whitespace. Blank
+        lines are skipped; any other line (e.g. the partial line
+        left over after flushing the port, or one garbled on the
+        wire) is malformed, and skipped too.
+
+        Returns (counts, malformed), where malformed is the number
+        of malformed lines. Small blocks (the usual case at 50 Hz)
+        are parsed line by line with the same rules.
+    """
+    if lines.count('\n', 0, VECTORIZE_LINES * 16) < VECTORIZE_LINES:
+        return _parse_counts_loop(lines)
+    b = np.frombuffer(lines, np.uint8)
+    kind = _BYTE_CLASS[b]
+    ends = np.flatnonzero(b == ord('\n'))
+    n = len(ends)
+
+    # The line every byte belongs to (a newline belongs to the
+    # line it ends)
+    line = np.repeat(np.arange(n), np.diff(np.concatenate(([-1], ends))))
+
+    # Everything else works on the positions of the digits only.
+    # Lines are separated by newlines, so a digit starts a run of
+    # digits unless the byte before it is a digit.
+    at = np.flatnonzero(kind == _DIGIT)
+    if len(at) == 0:
+        # No counts at all, and every line that isn't blank is
+        # malformed
+        nonblank = np.bincount(line[kind != _BLANK], minlength=n)
+        return np.zeros(0, np.int32), int(np.count_nonzero(nonblank))
+    digit_line = line[at]
+    ndigits = np.bincount(digit_line, minlength=n)
+    run_start = np.concatenate(([True], np.diff(at) != 1))
+    runs = np.bincount(digit_line[run_start], minlength=n)
+
+    # Each digit's power of ten is the number of digits after it
+    # on its line
+    last = np.cumsum(ndigits) - 1
+    power = np.minimum(last[digit_line] - np.arange(len(at)), len(_POW10) - 1)
+    weights = (b[at] - ord('0')) * _POW10[power]
+    values = np.bincount(digit_line, weights, minlength=n)
+
+    # Minus signs and other characters are rare, so they are
+    # only looked at when present. A minus sign must come right
+    # before the digits.
+    nminus = stray_minus = other = np.zeros(n, np.intp)
+    unusual = np.flatnonzero(kind > _DIGIT)
+    if len(unusual):
+        minus = unusual[kind[unusual] == _MINUS]
+        nminus = np.bincount(line[minus], minlength=n)
+        stray = minus[kind[minus + 1] != _DIGIT]
+        stray_minus = np.bincount(line[stray], minlength=n)
+        other = np.bincount(line[unusual[kind[unusual] == _OTHER]], minlength=n)
+        values[nminus == 1] *= -1
+
+    valid = ((runs == 1) & (nminus <= 1) & (stray_minus == 0) & (other == 0) &
+             (ndigits <= 10) & (values > GAP_COUNT) & (values < 2 ** 31))
+    blank = (ndigits == 0) & (nminus == 0) & (other == 0)
+    malformed = n - int(valid.sum()) - int(blank.sum())
+    return values[valid].astype(np.int32), malformed
+
+
+class LineBatcher(object):
+    """ Turns the raw chunks read from a port into SampleBatches.
+        Lines split across chunks are carried over to the next
+        one, and the samples are numbered and timestamped with a
+        SampleClock.
+
+        feed(data, host_time):
+            Add a chunk of data read at host_time (monotonic()).
+            Returns a SampleBatch of the complete lines received,
+            or None if there are none.
+
+        gap(host_time):
+            Returns a SampleBatch marking a gap in the data at
+            host_time, and starts over as after a reconnect.
+
+        malformed:
+            Number of malformed lines skipped so far.
+    """
+    def __init__(self, sample_rate=50.0):
+        self.partial = ''
+        self.clock = SampleClock(sample_rate)
+        self.malformed = 0
+
+    def feed(self, data, host_time):
+        with parse_time.time():
+            lines, self.partial = split_lines(self.partial + data)
+            counts, malformed = parse_counts(lines)
+        if malformed:
+            self.malformed += malformed
+            malformed_lines.add(malformed)
+        if len(counts) == 0:
+            return None
+        samples_read.add(len(counts))
+
+        first, timestamps = self.clock.stamp(len(counts), host_time)
+        return SampleBatch(first, counts, timestamps)
+
+    def gap(self, host_time):
+        self.partial = ''
+        first = self.clock.index
+        self.clock.index += 1
+        self.clock.restart()
+        return SampleBatch(first,
+                           np.array([GAP_COUNT], np.int32),
+                           np.array([host_time + self.clock.wall_offset]))
+
+
+# States of a ComMonitorThread, reported on its status_q
+STARTING = 'starting'       # waiting for the device to stream
+STREAMING = 'streaming'
+LOST = 'lost'               # device lost, reconnecting
+STOPPED = 'stopped'
+
+
+class DeviceStalled(Exception):
+    """ Raised when no samples arrive from an open port.
+    """
+
+
+class DeviceTimeout(Exception):
+    """ Raised when a device doesn't start streaming in time.
+    """
+
+
+class DeviceSession(object):
+    """ Starts a symCDC device streaming over an open serial port.
+
+        The device is restarted with 'r', and then asked to stream
+        with 'm', which it ignores while it is still booting. So
+        rather than sleep for the worst-case boot time, 'm' is
+        repeated every retry_interval seconds until the first valid
+        count line arrives, which is when the device is ready.
+
+        Lines still in flight when 'r' was sent would look just
+        like the device streaming again, so everything is discarded
+        until the port has been quiet for quiet_time seconds, and
+        only then is 'm' sent.
+
+        begin(now):
+            Restart the device. 'now' is a monotonic() time.
+
+        poll(now):
+            Repeat 'm' if it is due. Raises DeviceTimeout if the
+            device isn't streaming boot_timeout seconds after
+            begin().
+
+        feed(data):
+            Hand over data read from the port. Returns None until
+            a valid count line was seen after the first 'm', and
+            then the data from that line on, to be parsed as
+            samples.
+
+        start(stopped=None):
+            All of the above for a port with a blocking read.
+            Returns what feed() returned, or None if the 'stopped'
+            Event was set meanwhile.
+
+        ready:
+            True once the device is streaming.
+    """
+    def __init__(self, serial_port, boot_timeout=5.0, retry_interval=0.25,
+                 quiet_time=0.1):
+        self.serial_port = serial_port
+        self.boot_timeout = boot_timeout
+        self.retry_interval = retry_interval
+        self.quiet_time = quiet_time
+        self.ready = False
+        self.buf = ''
+
+    def begin(self, now):
+        self.serial_port.write("r\n\r") #restart the AD7745 chip
+        self.ready = False
+        self.settled = False
+        self.heard = False
+        self.buf = ''
+        self.deadline = now + self.boot_timeout
+        self.quiet_since = now
+        self.next_request = now
+
+    def poll(self, now):
+        if self.ready:
+            return
+        if now >= self.deadline:
+            raise DeviceTimeout('device did not start streaming within %g s'
+                                % self.boot_timeout)
+        if not self.settled:
+            if self.heard:
+                self.heard = False
+                self.quiet_since = now
+            if now - self.quiet_since < self.quiet_time:
+                return
+            # Whatever was received so far predates the restart
+            self.serial_port.flushInput()
+            self.settled = True
+            self.buf = ''
+        if now >= self.next_request:
+            self.serial_port.write("m\n\r") #Start streaming back CDC counts
+            self.next_request = now + self.retry_interval
+
+    def feed(self, data):
+        if self.ready:
+            return data
+        if not self.settled:
+            self.heard = self.heard or bool(data)
+            return None
+        lines, partial = split_lines(self.buf + data)
+        offset = 0
+        for line in lines.split('\n')[:-1]:
+            if len(_parse_counts_loop(line + '\n')[0]):
+                self.ready = True
+                self.buf = ''
+                return lines[offset:] + partial
+            offset += len(line) + 1
+        # Only the incomplete line is worth keeping
+        self.buf = partial
+        return None
+
+    def start(self, stopped=None):
+        timeout = self.serial_port.timeout
+        self.serial_port.timeout = self.retry_interval / 2
+        try:
+            self.begin(monotonic())
+            while stopped is None or not stopped.isSet():
+                self.poll(monotonic())
+                data = self.serial_port.read(max(1, self.serial_port.inWaiting()))
+                rest = self.feed(data)
+                if rest is not None:
+                    return rest
+            return None
+        finally:
+            self.serial_port.timeout = timeout
+
 
 class ComMonitorThread(threading.Thread):
     """ A thread for monitoring a COM port. The COM port is
@@ -15,11 +309,19 @@ class ComMonitorThread(threading.Thread):
             string representing the received data, and timestamp
             is the time elapsed from the thread's start (in
             seconds).
+            In batch mode the items are SampleBatch tuples
+            instead, one per read of the port, timestamped from
+            the sample indices rather than the time of the read.
 
         error_q:
             Queue for error messages. In particular, if the
-            serial port fails to open for some reason, an error
-            is placed into this queue.
+            serial port fails to open for some reason, or the
+            device doesn't start streaming, an error is placed
+            into this queue and the thread ends.
+
+        status_q:
+            Optional queue the thread reports its state on as it
+            changes: STARTING, STREAMING, LOST or STOPPED.
 
         port:
             The COM port to open. Must be recognized by the
@@ -33,6 +335,36 @@ class ComMonitorThread(threading.Thread):
             value is low, the thread will return data in finer
             grained chunks, with more accurate timestamps, but
             it will also consume more CPU.
+
+        batch:
+            If True, everything buffered by the driver is read
+            in one call and the complete lines in it are put on
+            data_q as a single SampleBatch. Lines split across
+            reads are carried over to the next batch.
+
+        sample_rate:
+            Nominal rate of the device in Hz, used to reconstruct
+            the sample times in batch mode.
+
+        stall_timeout:
+            In batch mode, the device counts as lost when the port
+            fails, or when no sample arrived for this many seconds.
+            A gap marker (see SampleBatch) is then queued, and the
+            port is reopened, retrying with a backoff of up to
+            max_backoff seconds, and the device initialized again.
+
+        boot_timeout:
+            Longest time the device may take to start streaming
+            (see DeviceSession).
+
+        state, connected:
+            The current state, and whether it is STREAMING.
+
+        reconnects:
+            Number of times the device was lost and found again.
+
+        malformed:
+            Number of malformed lines skipped in batch mode.
     """
     def __init__(   self,
                     data_q, error_q,
@@ -41,7 +373,13 @@ class ComMonitorThread(threading.Thread):
                     port_stopbits=serial.STOPBITS_ONE,
                     port_parity=serial.PARITY_NONE,
                     #port_timeout=0.01 //Changed this so incoming data wasn't interrupted
-                    port_timeout=1):
+                    port_timeout=1,
+                    batch=False,
+                    sample_rate=50.0,
+                    stall_timeout=5.0,
+                    max_backoff=1.0,
+                    status_q=None,
+                    boot_timeout=5.0):
         threading.Thread.__init__(self)
 
         self.serial_port = None
@@ -53,57 +391,148 @@ class ComMonitorThread(threading.Thread):
 
         self.data_q = data_q
         self.error_q = error_q
+        self.status_q = status_q
+        self.batch = batch
+        self.sample_rate = sample_rate
+        self.batcher = LineBatcher(sample_rate)
+        self.stall_timeout = stall_timeout
+        self.max_backoff = max_backoff
+        self.boot_timeout = boot_timeout
+        self.state = None
+        self.reconnects = 0
 
         self.alive = threading.Event()
         self.alive.set()
+        self.stopped = threading.Event()
+
+    @property
+    def connected(self):
+        return self.state == STREAMING
+
+    def set_state(self, state):
+        self.state = state
+        if self.status_q is not None:
+            self.status_q.put(state)
 
     def run(self):
+        self.set_state(STARTING)
         try:
             if self.serial_port:
                 self.serial_port.close()
             self.serial_port = serial.Serial(**self.serial_arg)
+
+            #Restart the Chip
+            self.reset()
         except serial.SerialException, e:
             self.error_q.put(e.message)
-            return
+        except (DeviceTimeout, OSError, IOError), e:
+            self.error_q.put(str(e))
+        else:
+            if self.batch:
+                self.supervise()
+            else:
+                self.read_lines()
 
-        #Setup log File and Restart the Chip
+        #clean up
+        self.close_port()
+        self.set_state(STOPPED)
 
-        self.reset()
+    def supervise(self):
+        """ Reads batches until the thread is stopped, reconnecting
+            whenever the device is lost.
+        """
+        while self.alive.isSet():
+            try:
+                self.read_batches()
+                return
+            except (serial.SerialException, OSError, IOError, DeviceStalled):
+                pass
 
-        # Restart the clock
-        time.clock()
+            self.set_state(LOST)
+            self.data_q.put(self.batcher.gap(monotonic()))
+            self.reconnect()
 
+    def reconnect(self):
+        delay = 0.1
         while self.alive.isSet():
+            self.close_port()
+            try:
+                self.serial_port = serial.Serial(**self.serial_arg)
+                self.reset()
+            except (serial.SerialException, OSError, IOError, DeviceTimeout):
+                self.stopped.wait(delay)
+                delay = min(2 * delay, self.max_backoff)
+                continue
 
-            data = self.serial_port.readline()
-            data=data.strip("\n \r")
-
-            if len(data) > 0:
-                timestamp = time.clock() #A seconds elapsed style time stamp for the plot
-                self.data_q.put((data, timestamp))
+            if self.alive.isSet():
+                self.reconnects += 1
+            return
 
-        #clean up
+    def close_port(self):
         if self.serial_port:
-            self.serial_port.close()
+            try:
+                self.serial_port.close()
+            except (serial.SerialException, OSError):
+                pass
+            self.serial_port = None
 
+    def read_lines(self):
+        start = monotonic()
+        # Lines already read while starting the device (see reset)
+        pending, self.batcher.partial = self.batcher.partial, ''
 
+        while self.alive.isSet():
+            if '\n' in pending:
+                data, pending = pending.split('\n', 1)
+            else:
+                data, pending = pending + self.serial_port.readline(), ''
+            data=data.strip("\n \r")
 
+            if len(data) > 0:
+                timestamp = monotonic() - start #A seconds elapsed style time stamp for the plot
+                self.data_q.put((data, timestamp))
 
+    def read_batches(self):
+        batcher = self.batcher
+        last_sample = monotonic()
 
+        while self.alive.isSet():
+            # Wait (up to port_timeout) for the first byte, then
+            # drain whatever else the driver has buffered
+            data = self.serial_port.read(1)
+            now = monotonic()
+            if len(data) == 0:
+                if now - last_sample > self.stall_timeout:
+                    raise DeviceStalled()
+                continue
+            waiting = self.serial_port.inWaiting()
+            if waiting:
+                data += self.serial_port.read(waiting)
 
+            batch = batcher.feed(data, now)
+            if batch is not None:
+                self.data_q.put(batch)
+                last_sample = now
+            elif now - last_sample > self.stall_timeout:
+                raise DeviceStalled()
 
     def reset(self):
-        self.serial_port.write("r\n\r") #restart the AD7745 chip
-        time.sleep(3)
-        self.serial_port.write("m\n\r") #Start streaming back CDC counts
-        time.sleep(1)
-
-        #Clear the Port
-        self.serial_port.flushInput()
-
+        """ Restarts the device and waits until it streams. Raises
+            DeviceTimeout if it doesn't in time.
+        """
+        session = DeviceSession(self.serial_port, self.boot_timeout)
+        rest = session.start(self.stopped)
+        if rest is None:
+            return      # stopped meanwhile
+        # The lines read during the handshake are the first samples
+        self.batcher.partial = rest
+        self.set_state(STREAMING)
 
+    @property
+    def malformed(self):
+        return self.batcher.malformed
 
     def join(self, timeout=None):
         self.alive.clear()
+        self.stopped.set()
         threading.Thread.join(self, timeout)
-
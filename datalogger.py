@@ -0,0 +1,242 @@
+import csv
+import datetime
+import os
+import threading
+import time
+import Queue
+
+from archive import ArchiveWriter
+from binlog import BinaryLogWriter, GAP_COUNT
+from metrics import registry
+from rollup import RollupWriter
+from timeindex import TimeIndexWriter, index_path
+
+
+def next_midnight(now=None):
+    """ Returns the time (in seconds since the epoch) of the next
+        local midnight after 'now'.
+    """
+    if now is None:
+        now = time.time()
+    tomorrow = datetime.date.fromtimestamp(now) + datetime.timedelta(days=1)
+    return time.mktime(tomorrow.timetuple())
+
+
+class DataLogger(object):
+    """ Logs CDC counts to daily log files. The files are named
+        after the current date (e.g. 2012-10-20.csv) and a new
+        one is started at midnight.
+
+        directory:
+            Directory the log files are created in.
+
+        prefix:
+            Prepended to the file names, e.g. to tell apart the
+            logs of several devices.
+
+        fmt:
+            'csv' for one CSV row per count, 'tcsv' for one
+            'timestamp,count' row per sample plus a sparse time
+            index (see timeindex.py), 'bin' for the fixed-width
+            binary format of binlog (.cdcb files), which also
+            records sample indices and timestamps, or 'arc' for
+            the compressed archives of archive.py (.cdca files),
+            which record the same in a tenth of the space. Gaps
+            in the data are logged as 'nan' counts or gap records.
+
+        buffering:
+            Size of the file buffer in bytes. Rows are collected
+            in it and reach the disk in large writes.
+
+        Interface to writer:
+
+        write_batch(batch):
+            Log the counts of a SampleBatch.
+
+        flush(fsync=False):
+            Push buffered rows to the OS, and optionally to the
+            disk itself.
+
+        close():
+            Close the current log file.
+    """
+    extensions = {'csv': 'csv', 'tcsv': 'csv', 'bin': 'cdcb', 'arc': 'cdca'}
+
+    def __init__(self, directory='.', fmt='csv', buffering=1 << 20, prefix=''):
+        self.directory = directory
+        self.prefix = prefix
+        self.fmt = fmt
+        self.buffering = buffering
+        self.file = None
+        self.index = None
+        self.log()
+
+    def log(self):
+        self.reading_num = 0
+
+        self.today = str(datetime.date.today())
+        self.rollover_at = next_midnight()
+        self.logname = os.path.join(self.directory,
+            '%s%s.%s' % (self.prefix, self.today, self.extensions[self.fmt]))
+        if self.fmt == 'bin':
+            self.file = BinaryLogWriter(self.logname, self.buffering)
+        elif self.fmt == 'arc':
+            self.file = ArchiveWriter(self.logname, self.buffering)
+        else:
+            self.file = open(self.logname, "wb", self.buffering)
+            self.file_cvs = csv.writer(self.file)
+        if self.fmt == 'tcsv':
+            self.index = TimeIndexWriter(index_path(self.logname))
+            self.offset = 0
+
+    def write_batch(self, batch):
+        if time.time() >= self.rollover_at:
+            self.close()
+            self.log()
+
+        if self.fmt in ('bin', 'arc'):
+            self.file.write_batch(batch)
+        elif self.fmt == 'tcsv':
+            self.write_stamped(batch)
+        else:
+            #Uncomment for stamps
+            #
+            #utimestamp = time.time() #A unix style timestamp for the log
+            #for count, timestamp in zip(batch.counts, batch.timestamps):
+            #    self.reading_num = self.reading_num + 1
+            #    self.save_data_stamps(self.reading_num,int(count),timestamp,utimestamp)
+
+            counts = batch.counts.tolist()
+            if GAP_COUNT in counts:
+                counts = ['nan' if count == GAP_COUNT else count for count in counts]
+            self.file_cvs.writerows([count] for count in counts)
+        self.reading_num = self.reading_num + len(batch.counts)
+
+    def save_data_stamps(self,reading_num,reading,timestamp,utimestamp):
+        self.file_cvs.writerow ([reading_num,reading,timestamp,utimestamp])
+
+    def write_stamped(self, batch):
+        # Millisecond timestamps are finer than the 20 ms sample
+        # period, and keep the rows short
+        rows = ['%.3f,%s\n' % (timestamp, 'nan' if count == GAP_COUNT else count)
+                for timestamp, count in zip(batch.timestamps.tolist(),
+                                            batch.counts.tolist())]
+        lengths = [len(row) for row in rows]
+        self.index.add(batch.timestamps, lengths, self.reading_num, self.offset)
+        self.file.write(''.join(rows))
+        self.offset += sum(lengths)
+
+    def flush(self, fsync=False):
+        for f in (self.file, self.index):
+            if f is not None:
+                f.flush()
+                if fsync:
+                    os.fsync(f.fileno())
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+        if self.index is not None:
+            self.index.close()
+            self.index = None
+
+
+write_time = registry.histogram('log.write')
+flush_time = registry.histogram('log.flush')
+
+
+class LogWriterThread(threading.Thread):
+    """ A thread that logs SampleBatches with a DataLogger, so
+        that slow disks never hold up the acquisition or the GUI.
+
+        error_q:
+            Queue for error messages. If writing the log fails,
+            the error is placed into this queue and the thread
+            stops.
+
+        directory/fmt/prefix:
+            Passed on to the DataLogger. The first log file is
+            opened (and any error opening it raised) when the
+            thread is created.
+
+        rollup:
+            If True, a RollupWriter keeps multi-resolution
+            rollups of the samples in the same directory (see
+            rollup.py). Rollup files that can't be opened raise
+            IOError, or ValueError, when the thread is created.
+
+        flush_interval:
+            Seconds between flushes of the log file. None leaves
+            flushing to the file buffer.
+
+        fsync:
+            If True, every flush also waits for the data to reach
+            the disk.
+
+        Interface to writer:
+
+        put(batch):
+            Queue a SampleBatch for logging. Never blocks.
+    """
+    def __init__(   self,
+                    error_q,
+                    directory='.',
+                    fmt='csv',
+                    flush_interval=1.0,
+                    fsync=False,
+                    prefix='',
+                    rollup=False):
+        threading.Thread.__init__(self)
+
+        self.data_logger = DataLogger(directory, fmt, prefix=prefix)
+        try:
+            self.rollup = RollupWriter(directory, prefix) if rollup else None
+        except (IOError, ValueError):
+            self.data_logger.close()
+            raise
+        self.error_q = error_q
+        self.flush_interval = flush_interval
+        self.fsync = fsync
+        self.batch_q = Queue.Queue()
+
+        self.alive = threading.Event()
+        self.alive.set()
+
+    def put(self, batch):
+        self.batch_q.put(batch)
+
+    def run(self):
+        next_flush = time.time() + (self.flush_interval or 0)
+
+        try:
+            while self.alive.isSet() or not self.batch_q.empty():
+                timeout = 0.5
+                if self.flush_interval is not None:
+                    timeout = max(0, min(timeout, next_flush - time.time()))
+                try:
+                    batch = self.batch_q.get(True, timeout)
+                    with write_time.time():
+                        self.data_logger.write_batch(batch)
+                        if self.rollup is not None:
+                            self.rollup.add_batch(batch)
+                except Queue.Empty:
+                    pass
+
+                if self.flush_interval is not None and time.time() >= next_flush:
+                    with flush_time.time():
+                        self.data_logger.flush(self.fsync)
+                        if self.rollup is not None:
+                            self.rollup.flush()
+                    next_flush = time.time() + self.flush_interval
+        except (IOError, OSError), e:
+            self.error_q.put(str(e))
+        finally:
+            self.data_logger.close()
+            if self.rollup is not None:
+                self.rollup.close()
+
+    def join(self, timeout=None):
+        self.alive.clear()
+        threading.Thread.join(self, timeout)
+
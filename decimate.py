@@ -0,0 +1,85 @@
+import numpy as np
+
+
+def minmax_decimate(x, y, buckets):
+    """ Reduces the samples (x, y) to a min/max envelope of at most
+        'buckets' buckets of consecutive samples. Each bucket
+        becomes two points at the bucket's mean x, one at its
+        minimum and one at its maximum, so that drawn as a line
+        the envelope still shows every spike in the data.
+
+        Returns (x, y) unchanged if there are no more than two
+        samples per bucket anyway.
+    """
+    n = len(y)
+    if n <= 2 * buckets:
+        return x, y
+
+    x = np.asarray(x, np.float64)
+    y = np.asarray(y)
+    edges = np.linspace(0, n, buckets + 1).astype(np.intp)[:-1]
+    ex = np.add.reduceat(x, edges) / np.diff(np.append(edges, n))
+    return (np.repeat(ex, 2),
+            interleave(np.minimum.reduceat(y, edges),
+                       np.maximum.reduceat(y, edges)))
+
+
+def interleave(a, b):
+    """ Returns [a[0], b[0], a[1], b[1], ...].
+    """
+    out = np.empty(2 * len(a), np.result_type(a, b))
+    out[0::2] = a
+    out[1::2] = b
+    return out
+
+
+class Envelope(object):
+    """ Streaming min/max envelope of a sequence of values, built
+        a chunk at a time from data too large to hold in memory.
+
+        width:
+            Number of consecutive values per bucket.
+
+        Interface to writer:
+
+        add(values):
+            Add the next chunk of values.
+
+        Interface to reader:
+
+        envelope():
+            Returns (x, y) arrays with two points per bucket, at
+            the bucket's centre index, like minmax_decimate.
+    """
+    def __init__(self, width):
+        self.width = max(1, int(width))
+        self.mins = []
+        self.maxs = []
+        self.pending = np.zeros(0)
+        self.count = 0      # values added so far
+
+    def add(self, values):
+        self.count += len(values)
+        if len(self.pending):
+            values = np.concatenate((self.pending, values))
+        full = len(values) // self.width * self.width
+        if full:
+            buckets = values[:full].reshape(-1, self.width)
+            self.mins.append(buckets.min(axis=1))
+            self.maxs.append(buckets.max(axis=1))
+        self.pending = values[full:]
+
+    def envelope(self):
+        mins, maxs = list(self.mins), list(self.maxs)
+        if len(self.pending):
+            mins.append([self.pending.min()])
+            maxs.append([self.pending.max()])
+        if not mins:
+            return np.zeros(0), np.zeros(0)
+
+        mins = np.concatenate(mins)
+        maxs = np.concatenate(maxs)
+        x = np.arange(len(mins)) * float(self.width) + (self.width - 1) / 2.0
+        if len(self.pending):
+            x[-1] = self.count - (len(self.pending) + 1) / 2.0
+        return np.repeat(x, 2), interleave(mins, maxs)
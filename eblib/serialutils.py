@@ -1,19 +1,30 @@
 """
-Some serial port utilities for Windows and PySerial
+Some serial port utilities for Windows, Linux and PySerial
 
 Eli Bendersky (eliben@gmail.com)
 License: this code is in the public domain
 """
-import re, itertools
-import _winreg as winreg
+import re, itertools, os, glob, sys
+try:
+    import _winreg as winreg
+except ImportError:
+    winreg = None
+
+# Device nodes of USB serial adapters (FTDI, CDC ACM) on Linux
+# and OS X
+POSIX_PORT_PATTERNS = ['/dev/ttyUSB*', '/dev/ttyACM*',
+                       '/dev/cu.usbserial*', '/dev/cu.usbmodem*']
 
    
 def full_port_name(portname):
     """ Given a port-name (of the form COM7, 
         COM12, CNCA0, etc.) returns a full 
         name suitable for opening with the 
-        Serial class.
+        Serial class. Names of ports on other
+        systems are returned unchanged.
     """
+    if sys.platform != 'win32':
+        return portname
     m = re.match('^COM(\d+)$', portname)
     if m and int(m.group(1)) < 10:
         return portname    
@@ -21,6 +32,17 @@ def full_port_name(portname):
     
 
 def enumerate_serial_ports():
+    """ Returns an iterator of the serial ports
+        existing on this computer: from the Win32
+        registry on Windows, and from /dev
+        elsewhere.
+    """
+    if winreg is None:
+        return enumerate_posix_ports()
+    return enumerate_windows_ports()
+
+
+def enumerate_windows_ports():
     """ Uses the Win32 registry to return an 
         iterator of serial (COM) ports 
         existing on this computer.
@@ -39,6 +61,25 @@ def enumerate_serial_ports():
             break
 
 
+def enumerate_posix_ports():
+    """ Returns an iterator of the USB serial ports
+        in /dev. Where udev provides them, the
+        stable /dev/serial/by-id names come first,
+        since they survive replugging the device
+        into another socket; nodes they link to are
+        not listed again.
+    """
+    seen = set()
+    for path in sorted(glob.glob('/dev/serial/by-id/*')):
+        seen.add(os.path.realpath(path))
+        yield path
+
+    for pattern in POSIX_PORT_PATTERNS:
+        for path in sorted(glob.glob(pattern)):
+            if os.path.realpath(path) not in seen:
+                yield path
+
+
 if __name__ == "__main__":
     import serial
     for p in enumerate_serial_ports():
@@ -0,0 +1,220 @@
+"""
+A synthetic symCDC device for testing without the hardware.
+
+The emulator creates a pseudo-terminal and behaves like the PIC/AD7745
+package on the other end of it: an 'r' command restarts the converter
+(the device goes quiet for boot_time seconds) and an 'm' command starts
+streaming CDC counts, one decimal count per line. The counts are a
+sine wave with linear drift and gaussian noise, and the stream can be
+made to drop out for a while or to contain corrupted lines.
+
+The pseudo-terminal is opened by ComMonitorThread like any other serial
+port, so the whole acquisition pipeline can be exercised (and loaded
+with rates far above the device's 50 Hz) on a machine with no device
+attached. Pseudo-terminals are only available on POSIX systems.
+
+usage: python emulator.py [-r 50] [--dropout 0.01] [--corrupt 0.001]
+"""
+import argparse
+import errno
+import fcntl
+import math
+import os
+import select
+import sys
+import threading
+import time
+import tty
+
+import numpy as np
+
+
+class SymCDCEmulator(threading.Thread):
+    """ A thread emulating a symCDC device on a pseudo-terminal.
+        The name of the terminal to open is in the 'port'
+        attribute once the emulator is created.
+
+        rate:
+            Samples per second streamed after an 'm' command.
+
+        base/amplitude/frequency:
+            The counts follow base + amplitude * sin(2 pi f t).
+
+        drift:
+            Linear drift of the counts, in counts per second.
+
+        noise:
+            Standard deviation of the gaussian noise added to
+            each count.
+
+        dropout_rate/dropout_length:
+            Expected number of dropouts per second and their
+            length in seconds. No data is sent during a dropout.
+
+        corrupt:
+            Probability of a line being corrupted (truncated and
+            garbled) on the way out.
+
+        boot_time:
+            Seconds the device stays silent after an 'r' command.
+            'm' commands received while booting are ignored.
+
+        Data that does not fit into the terminal's buffer because
+        the reader is too slow is discarded, like a real UART
+        would, and counted in the 'overruns' attribute (in bytes).
+    """
+    def __init__(   self,
+                    rate=50.0,
+                    base=4000000,
+                    amplitude=100000,
+                    frequency=0.5,
+                    drift=0.0,
+                    noise=200.0,
+                    dropout_rate=0.0,
+                    dropout_length=0.5,
+                    corrupt=0.0,
+                    boot_time=0.5,
+                    seed=None):
+        threading.Thread.__init__(self)
+        self.daemon = True
+
+        self.rate = float(rate)
+        self.base = base
+        self.amplitude = amplitude
+        self.frequency = frequency
+        self.drift = drift
+        self.noise = noise
+        self.dropout_rate = dropout_rate
+        self.dropout_length = dropout_length
+        self.corrupt = corrupt
+        self.boot_time = boot_time
+        self.random = np.random.RandomState(seed)
+
+        self.master, self.slave = os.openpty()
+        tty.setraw(self.slave)
+        flags = fcntl.fcntl(self.master, fcntl.F_GETFL)
+        fcntl.fcntl(self.master, fcntl.F_SETFL, flags | os.O_NONBLOCK)
+        self.port = os.ttyname(self.slave)
+
+        self.streaming = False
+        self.booted_at = 0.0
+        self.samples_sent = 0
+        self.overruns = 0
+
+        self.alive = threading.Event()
+        self.alive.set()
+
+    def run(self):
+        start = time.time()
+        stream_start = None
+        dropout_until = 0.0
+        tick = max(1.0 / self.rate, 0.005)
+
+        while self.alive.isSet():
+            readable, _, _ = select.select([self.master], [], [], tick)
+            now = time.time()
+            if readable:
+                self.command(os.read(self.master, 1024), now)
+
+            if not self.streaming or now < self.booted_at:
+                stream_start = None
+                continue
+            if stream_start is None:
+                stream_start, sent = now, 0
+
+            # Number of samples due since streaming started
+            due = int((now - stream_start) * self.rate) - sent
+            if due <= 0:
+                continue
+            t = stream_start + (sent + np.arange(due)) / self.rate
+            sent += due
+
+            if now < dropout_until:
+                continue
+            if self.random.random_sample() < self.dropout_rate * due / self.rate:
+                dropout_until = now + self.dropout_length
+                continue
+
+            self.send(self.counts(t - start))
+
+        os.close(self.master)
+        os.close(self.slave)
+
+    def command(self, data, now):
+        for c in data:
+            if c == 'r':
+                self.streaming = False
+                self.booted_at = now + self.boot_time
+            elif c == 'm' and now >= self.booted_at:
+                self.streaming = True
+
+    def counts(self, t):
+        """ Returns the counts sampled at times t (in seconds since
+            the emulator started).
+        """
+        counts = (self.base
+                  + self.amplitude * np.sin(2 * math.pi * self.frequency * t)
+                  + self.drift * t
+                  + self.random.normal(0, self.noise, len(t)))
+        return np.clip(counts, 0, 2**24 - 1).astype(np.int32)
+
+    def send(self, counts):
+        lines = ['%d\r\n' % c for c in counts]
+        if self.corrupt:
+            bad = np.flatnonzero(self.random.random_sample(len(lines)) < self.corrupt)
+            for i in bad:
+                lines[i] = lines[i][:len(lines[i]) // 2] + '\x00?\r\n'
+        data = ''.join(lines)
+
+        try:
+            written = os.write(self.master, data)
+        except OSError, e:
+            if e.errno != errno.EAGAIN:
+                raise
+            written = 0
+        self.overruns += len(data) - written
+        self.samples_sent += len(counts)
+
+    def join(self, timeout=None):
+        self.alive.clear()
+        threading.Thread.join(self, timeout)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Emulate a symCDC device on a pseudo-terminal')
+    parser.add_argument('-r', '--rate', type=float, default=50.0,
+        help='samples per second (default: %(default)s)')
+    parser.add_argument('--frequency', type=float, default=0.5,
+        help='frequency of the sine wave in Hz (default: %(default)s)')
+    parser.add_argument('--drift', type=float, default=0.0,
+        help='drift in counts per second (default: %(default)s)')
+    parser.add_argument('--noise', type=float, default=200.0,
+        help='noise standard deviation in counts (default: %(default)s)')
+    parser.add_argument('--dropout', type=float, default=0.0,
+        help='expected dropouts per second (default: %(default)s)')
+    parser.add_argument('--corrupt', type=float, default=0.0,
+        help='probability of a corrupted line (default: %(default)s)')
+    args = parser.parse_args()
+
+    emulator = SymCDCEmulator(rate=args.rate,
+                              frequency=args.frequency,
+                              drift=args.drift,
+                              noise=args.noise,
+                              dropout_rate=args.dropout,
+                              corrupt=args.corrupt)
+    emulator.start()
+    print 'Emulating a symCDC device on', emulator.port
+    try:
+        while emulator.isAlive():
+            time.sleep(1)
+    except KeyboardInterrupt:
+        pass
+    emulator.join(1)
+    print 'Samples sent: %d, bytes lost to overruns: %d' % (
+        emulator.samples_sent, emulator.overruns)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,63 @@
+import collections
+
+
+class FrameRateGovernor(object):
+    """ Paces the redraws of a plot. Redraws are spaced to reach
+        target_fps, but when a redraw takes more than 'headroom'
+        of the frame budget the interval is stretched, so that
+        rendering never takes more than that share of the time
+        and the rest is left to data ingest.
+
+        target_fps:
+            Frame rate aimed for when redraws are cheap.
+
+        min_fps:
+            The frame rate never drops below this.
+
+        headroom:
+            Largest fraction of the time spent redrawing.
+
+        Interface:
+
+        frame_done(start, end):
+            Report a redraw that ran from start to end (seconds).
+
+        interval:
+            Seconds to wait before the next redraw.
+
+        fps:
+            The frame rate achieved recently (over the last
+            second, or two frames if they are further apart).
+    """
+    def __init__(self, target_fps=25.0, min_fps=1.0, headroom=0.5):
+        self.target_fps = target_fps
+        self.min_fps = min_fps
+        self.headroom = headroom
+        self.render_time = 0.0
+        self.interval = 1.0 / target_fps
+        self.frames = collections.deque()
+
+    def set_target_fps(self, target_fps):
+        self.target_fps = target_fps
+        self.update_interval()
+
+    def frame_done(self, start, end):
+        # Smooth the render time so a single slow frame (e.g. a
+        # resize) doesn't throttle the plot for long
+        self.render_time = 0.8 * self.render_time + 0.2 * (end - start)
+        self.update_interval()
+
+        self.frames.append(end)
+        while self.frames[0] < end - max(1.0, 2 * self.interval):
+            self.frames.popleft()
+
+    def update_interval(self):
+        self.interval = min(1.0 / self.min_fps,
+                            max(1.0 / self.target_fps,
+                                self.render_time / self.headroom))
+
+    @property
+    def fps(self):
+        if len(self.frames) < 2 or self.frames[-1] <= self.frames[0]:
+            return 0.0
+        return (len(self.frames) - 1) / (self.frames[-1] - self.frames[0])
@@ -0,0 +1,203 @@
+"""
+Headless acquisition and logging for the symCDC electronics package.
+
+Reads CDC counts from the serial port with a ComMonitorThread and logs
+them to daily log files exactly like the logger of the cdcLogger GUI,
+but without Qt, so it can run unattended on machines with no display.
+When the run ends (after --duration seconds or on Ctrl-C) the achieved
+throughput is printed.
+
+With --emulate RATE the data comes from a SymCDCEmulator streaming RATE
+samples per second instead of a real device (POSIX only), which is
+handy for finding the rate at which the pipeline saturates.
+
+With --serve ADDRESS the samples are also published to subscribers of a
+StreamServer (see streamserver.py) on that TCP port or Unix socket.
+
+--flush-interval and --fsync set how often the log file is flushed, and
+whether each flush waits for the data to reach the disk.
+
+With --rollup the logger also keeps the 1 s, 1 min and 1 h rollups of
+rollup.py next to the logs, which the GUI's Open history browses.
+
+usage: python headless.py -p COM5 [-d 3600] [-o logs] [--serve 5745]
+       python headless.py --emulate 2000 -d 30 --no-log
+"""
+import argparse
+import socket
+import sys
+import time
+import Queue
+
+from batchqueue import BatchQueue, POLICIES
+from com_monitor import ComMonitorThread
+from datalogger import LogWriterThread
+from eblib.utils import get_item_from_queue
+from metrics import MetricsReporter, registry
+from streamserver import StreamServer, parse_address
+
+
+def report(samples, batches, elapsed):
+    print 'Samples logged:  %d' % samples
+    print 'Batches:         %d' % batches
+    if batches:
+        print 'Mean batch size: %.1f' % (samples / float(batches))
+    if elapsed > 0:
+        print 'Elapsed:         %.1f s' % elapsed
+        print 'Throughput:      %.1f samples/s' % (samples / elapsed)
+
+
+def run(port, baud=57600, duration=None, directory='.', log=True, fmt='csv',
+        serve=None, queue_capacity=65536, queue_policy='block', metrics=None,
+        rollup=False, flush_interval=1.0, fsync=False):
+    """ Acquires (and optionally logs and serves) data from the
+        given port until 'duration' seconds have passed since the
+        first sample arrived, or until interrupted with Ctrl-C.
+    """
+    data_q = BatchQueue(queue_capacity, queue_policy)
+    registry.gauge('queue.samples', lambda: data_q.samples)
+    reporter = None
+    if metrics is not None:
+        try:
+            reporter = MetricsReporter(path=metrics)
+        except IOError, e:
+            print >> sys.stderr, 'Error:', e
+            return 1
+    error_q = Queue.Queue()
+    log_writer = None
+    stream_server = None
+    if serve is not None:
+        try:
+            stream_server = StreamServer(parse_address(serve))
+        except socket.error, e:
+            print >> sys.stderr, 'Error:', e
+            return 1
+        stream_server.start()
+    if log:
+        try:
+            log_writer = LogWriterThread(error_q, directory, fmt,
+                                         flush_interval=flush_interval,
+                                         fsync=fsync, rollup=rollup)
+        except (IOError, ValueError), e:
+            print >> sys.stderr, 'Error:', e
+            if stream_server is not None:
+                stream_server.join(1)
+            return 1
+        log_writer.start()
+
+    if reporter is not None:
+        reporter.start()
+    com_monitor = ComMonitorThread(data_q, error_q, port, baud, batch=True)
+    com_monitor.start()
+    samples = batches = 0
+    start = None
+
+    try:
+        while com_monitor.isAlive() and (log_writer is None or log_writer.isAlive()):
+            try:
+                batch = data_q.get(True, 0.5)
+            except Queue.Empty:
+                continue
+
+            if start is None:
+                start = time.time()
+            if log_writer is not None:
+                log_writer.put(batch)
+            if stream_server is not None:
+                stream_server.publish(batch)
+            samples += len(batch.counts)
+            batches += 1
+
+            if duration is not None and time.time() - start >= duration:
+                break
+    except KeyboardInterrupt:
+        pass
+    finally:
+        data_q.close()
+        com_monitor.join(10)
+        if log_writer is not None:
+            log_writer.join()
+        if stream_server is not None:
+            stream_server.join(1)
+        if reporter is not None:
+            reporter.join(2)
+
+    com_error = get_item_from_queue(error_q)  # from either thread
+    if com_error is not None:
+        print >> sys.stderr, 'Error:', com_error
+        return 1
+
+    elapsed = time.time() - start if start is not None else 0
+    report(samples, batches, elapsed)
+    print 'Queue peak:      %d samples (%d dropped, %.1f s full)' % (
+        data_q.high_water, data_q.dropped, data_q.full_time)
+    print 'Malformed lines: %d' % com_monitor.malformed
+    print 'Reconnects:      %d' % com_monitor.reconnects
+    if stream_server is not None and stream_server.samples_dropped:
+        print 'Stream dropped:  %d samples for slow subscribers' % (
+            stream_server.samples_dropped)
+    return 0
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Acquire and log symCDC data without the GUI')
+    parser.add_argument('-p', '--port',
+        help='serial port the symCDC package is connected to')
+    parser.add_argument('--emulate', type=float, metavar='RATE',
+        help='read from an emulated device streaming RATE samples/s')
+    parser.add_argument('-b', '--baud', type=int, default=57600,
+        help='baud rate (default: %(default)s)')
+    parser.add_argument('-d', '--duration', type=float,
+        help='stop after this many seconds (default: run until Ctrl-C)')
+    parser.add_argument('-o', '--directory', default='.',
+        help='directory for the daily log files (default: current)')
+    parser.add_argument('-f', '--format', choices=('csv', 'tcsv', 'bin', 'arc'), default='csv',
+        help='log file format; tcsv is CSV with timestamps and a time index, '
+             'arc a compressed archive (default: %(default)s)')
+    parser.add_argument('--no-log', dest='log', action='store_false',
+        help='acquire without logging, e.g. to measure throughput')
+    parser.add_argument('--flush-interval', type=float, default=1.0, metavar='SECONDS',
+        help='seconds between flushes of the log file; 0 leaves flushing to '
+             'the file buffer (default: %(default)s)')
+    parser.add_argument('--fsync', action='store_true',
+        help='wait for every flush to reach the disk')
+    parser.add_argument('--rollup', action='store_true',
+        help='also keep 1 s/1 min/1 h rollups next to the logs (see rollup.py)')
+    parser.add_argument('--queue-size', type=int, default=65536, metavar='SAMPLES',
+        help='most samples waiting to be logged (default: %(default)s)')
+    parser.add_argument('--queue-policy', choices=POLICIES, default='block',
+        help='what to do when the queue is full (default: %(default)s)')
+    parser.add_argument('--metrics', metavar='FILE',
+        help='append pipeline metrics to FILE every second, as JSON lines')
+    parser.add_argument('--serve', metavar='ADDRESS',
+        help='publish the samples on a TCP port ([host:]port) or Unix socket')
+    args = parser.parse_args()
+
+    if args.emulate:
+        from emulator import SymCDCEmulator
+        emulator = SymCDCEmulator(rate=args.emulate)
+        emulator.start()
+        port = emulator.port
+    elif args.port:
+        emulator = None
+        port = args.port
+        if sys.platform == 'win32':
+            from eblib.serialutils import full_port_name
+            port = full_port_name(port)
+    else:
+        parser.error('either --port or --emulate is required')
+
+    result = run(port, args.baud, args.duration, args.directory, args.log,
+                 args.format, args.serve, args.queue_size, args.queue_policy,
+                 args.metrics, args.rollup, args.flush_interval or None, args.fsync)
+
+    if emulator is not None:
+        emulator.join(1)
+        print 'Emulator sent:   %d samples (%d bytes lost to overruns)' % (
+            emulator.samples_sent, emulator.overruns)
+    return result
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,35 +1,109 @@
+import numpy as np
+
+from ringbuffer import RingBuffer
+
+
 class LiveDataFeed(object):
-    """ A simple "live data feed" abstraction that allows a reader 
-        to read the most recent data and find out whether it was 
-        updated since the last read. 
-        
+    """ A "live data feed" shared by any number of readers. Every
+        sample added gets the next sequence number, and the most
+        recent 'capacity' samples are kept in a RingBuffer.
+
+        Each reader gets its own FeedCursor, which remembers the
+        sequence number it read up to, and reads all the samples
+        added since as one batch. A reader that falls more than
+        'capacity' samples behind loses the oldest of them, and
+        is told how many.
+
         Interface to data writer:
-        
+
+        add_batch(timestamps, values):
+            Add a batch of samples to the feed.
+
         add_data(data):
-            Add new data to the feed.
-        
+            Add a single sample, a dict with 'timestamp' and
+            'temperature' keys.
+
         Interface to reader:
-        
+
+        subscribe():
+            Returns a FeedCursor positioned at the end of the
+            feed, so that it reads only samples added later.
+
         read_data():
-            Returns the most recent data.
-            
+            Returns the most recent sample as a dict, or None.
+
         has_new_data:
-            A boolean attribute telling the reader whether the
-            data was updated since the last read.    
+            A boolean attribute telling whether a sample was
+            added since the last read_data().
     """
-    def __init__(self):
-        self.cur_data = None
+    def __init__(self, capacity=65536, dtype=np.int32):
+        self.samples = RingBuffer(capacity, dtype)
+        self.seq = 0
         self.has_new_data = False
-    
+
+    def add_batch(self, timestamps, values):
+        self.samples.extend(timestamps, values)
+        self.seq += len(values)
+        if len(values):
+            self.has_new_data = True
+
     def add_data(self, data):
-        self.cur_data = data
+        self.samples.append(data['timestamp'], data['temperature'])
+        self.seq += 1
         self.has_new_data = True
-    
+
     def read_data(self):
         self.has_new_data = False
-        return self.cur_data
+        if len(self.samples) == 0:
+            return None
+        return dict(timestamp=self.samples.x[-1],
+                    temperature=self.samples.y[-1])
+
+    def subscribe(self):
+        return FeedCursor(self)
+
+
+class FeedCursor(object):
+    """ A reader's position in a LiveDataFeed.
+
+        read():
+            Returns (timestamps, values, overflow): all the samples
+            added to the feed since the previous read, and the
+            number of samples before them that were evicted from
+            the feed before they could be read. The arrays are
+            views into the feed, only valid until the next add.
+
+        skip():
+            Move to the end of the feed without reading.
+
+        pending:
+            Number of samples added since the previous read.
+
+        lost:
+            Total number of samples lost to overflows.
+    """
+    def __init__(self, feed):
+        self.feed = feed
+        self.seq = feed.seq
+        self.lost = 0
+
+    @property
+    def pending(self):
+        return self.feed.seq - self.seq
+
+    def read(self):
+        samples = self.feed.samples
+        available = min(self.pending, len(samples))
+        overflow = self.pending - available
+        self.lost += overflow
+        self.seq = self.feed.seq
+
+        start = len(samples) - available
+        return samples.x[start:], samples.y[start:], overflow
+
+    def skip(self):
+        self.seq = self.feed.seq
 
 
 if __name__ == "__main__":
     pass
-
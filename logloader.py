@@ -0,0 +1,338 @@
+"""
+Streaming access to CDC log files too large to read in one go.
+
+load_overview() reads a log a chunk at a time, parsing each chunk with
+numpy, and keeps only a min/max envelope of it plus a sparse index of
+chunk offsets. The returned LogOverview can then read any range of
+samples at full resolution without scanning the file again.
+
+The CSV logs (one count per line, or 'timestamp,count' rows), the
+binary .cdcb logs of binlog and the compressed .cdca archives of
+archive.py are supported. Samples are numbered from
+0, after dropping the first and last line of a CSV log, which are often
+partial. Gaps in the data ('nan' counts, or gap records) are read as
+NaN.
+
+read_time_range() reads the samples of a time range from a timestamped
+log, seeking with the log's time index (see timeindex.py) rather than
+reading the file from the start.
+"""
+import bisect
+import os
+
+import numpy as np
+
+import archive
+from binlog import BinaryLog, counts_as_float
+from decimate import Envelope
+from timeindex import load_index, seek_offset
+
+
+CHUNK_SIZE = 4 << 20
+
+# Chunk size for reading short time ranges
+RANGE_CHUNK_SIZE = 256 << 10
+
+
+# Characters separating the numbers of a line
+_SEPARATORS = np.zeros(256, bool)
+_SEPARATORS[[ord(c) for c in ' \t\r\n,']] = True
+
+
+def _well_formed(block, columns):
+    """ True if every line of the block is blank or holds exactly
+        'columns' comma separated fields.
+    """
+    b = np.frombuffer(block, np.uint8)
+    if not len(b):
+        return True
+    sep = _SEPARATORS[b]
+    newline = b == ord('\n')
+    line = np.cumsum(newline) - newline
+    n = line[-1] + 1
+    starts = np.flatnonzero(~sep & np.concatenate(([True], sep[:-1])))
+    fields = np.bincount(line[starts], minlength=n)
+    commas = np.bincount(line[b == ord(',')], minlength=n)
+    return bool(np.all(((fields == columns) & (commas == columns - 1)) |
+                       ((fields == 0) & (commas == 0))))
+
+
+def _parse_lines(block, columns):
+    rows = []
+    for line in block.split('\n'):
+        fields = line.split(',')
+        if len(fields) != columns:
+            continue
+        try:
+            rows.append([float(field) for field in fields])
+        except ValueError:
+            continue
+    return np.array(rows, dtype=np.float64).reshape(-1, columns)
+
+
+def parse_block(block, columns=1):
+    """ Parses a block of complete lines holding 'columns' comma
+        separated numbers each. Returns an array of shape (lines,)
+        for one column, and (lines, columns) otherwise.
+
+        Malformed lines (e.g. garbled, or torn by a crash while
+        logging) and lines with the wrong number of columns are
+        skipped.
+    """
+    try:
+        values = np.array(block.replace(',', ' ').split(), dtype=np.float64)
+    except ValueError:
+        values = None
+    if values is None or not _well_formed(block, columns):
+        # Fall back to parsing line by line
+        values = _parse_lines(block, columns)
+    if columns == 1:
+        return values.reshape(-1)
+    return values.reshape(-1, columns)
+
+
+def log_columns(path):
+    """ Number of columns of a CSV log: 1 for the plain logs, and
+        2 for timestamped ones.
+    """
+    with open(path, 'rb') as f:
+        lines = f.read(4096).split('\n')
+    # The first line may be partial
+    line = lines[1] if len(lines) > 2 else lines[0]
+    return line.count(',') + 1
+
+
+def iter_chunks(f, offset=0, chunk_size=CHUNK_SIZE, columns=1):
+    """ Reads the CSV log file f from byte 'offset' on and yields
+        (offset, values) for every chunk of complete lines, where
+        offset is the byte offset of the chunk's first line and
+        values is as returned by parse_block.
+    """
+    f.seek(offset)
+    partial = ''
+    while True:
+        data = f.read(chunk_size)
+        if not data:
+            break
+        data = partial + data
+        cut = data.rfind('\n') + 1
+        block, partial = data[:cut], data[cut:]
+        if block:
+            yield offset, parse_block(block, columns)
+            offset += len(block)
+    if partial.strip():
+        yield offset, parse_block(partial, columns)
+
+
+class LogOverview(object):
+    """ A min/max envelope of a whole log file, produced by
+        load_overview().
+
+        n:
+            Number of samples in the log.
+
+        x, y:
+            The envelope, ready for QwtPlotCurve.setData. x is
+            the sample number.
+
+        read_range(start, stop):
+            Returns (x, y) for samples start..stop-1 at full
+            resolution.
+    """
+    def __init__(self, path, n, x, y, offsets=None, lines=None, log=None, columns=1,
+                 is_archive=False):
+        self.path = path
+        self.n = n
+        self.x = x
+        self.y = y
+        self._offsets = offsets
+        self._lines = lines
+        self._log = log
+        self._columns = columns
+        self._is_archive = is_archive
+
+    def read_range(self, start, stop):
+        start = max(0, start)
+        stop = min(self.n, stop)
+        if stop <= start:
+            return np.zeros(0), np.zeros(0)
+
+        if self._log is not None:
+            return (np.arange(start, stop, dtype=np.float64),
+                    counts_as_float(self._log.counts[start:stop]))
+
+        if self._is_archive:
+            return (np.arange(start, stop, dtype=np.float64),
+                    self._read_archive_range(start, stop))
+
+        # CSV sample i is on line i + 1
+        first, last = start + 1, stop + 1
+        i = bisect.bisect_right(self._lines, first) - 1
+        line = self._lines[i]
+        parts = []
+        with open(self.path, 'rb') as f:
+            for _, values in iter_chunks(f, self._offsets[i], columns=self._columns):
+                if self._columns > 1:
+                    values = values[:, -1]
+                parts.append(values[max(0, first - line):last - line])
+                line += len(values)
+                if line >= last:
+                    break
+        return (np.arange(start, stop, dtype=np.float64),
+                np.concatenate(parts))
+
+    def _read_archive_range(self, start, stop):
+        # _lines holds the number of the first sample of each block
+        i = bisect.bisect_right(self._lines, start) - 1
+        sample = self._lines[i]
+        parts = []
+        f = archive.open_archive(self.path)
+        try:
+            f.seek(self._offsets[i])
+            for _, batch in archive.iter_blocks(f, self.path):
+                values = counts_as_float(batch.counts)
+                parts.append(values[max(0, start - sample):stop - sample])
+                sample += len(values)
+                if sample >= stop:
+                    break
+        finally:
+            f.close()
+        return np.concatenate(parts)
+
+
+def load_archive_overview(path, buckets):
+    f = archive.open_archive(path)
+    try:
+        # The block headers give the size of the envelope buckets
+        # before any block is decoded
+        start = f.tell()
+        n = sum(samples for _, samples, _, _ in archive.iter_block_headers(f, path))
+        envelope = Envelope(n // buckets + 1)
+        offsets, lines = [], []
+        f.seek(start)
+        for offset, batch in archive.iter_blocks(f, path):
+            offsets.append(offset)
+            lines.append(envelope.count)
+            envelope.add(counts_as_float(batch.counts))
+    finally:
+        f.close()
+    x, y = envelope.envelope()
+    return LogOverview(path, envelope.count, x, y, offsets, lines, is_archive=True)
+
+
+def load_overview(path, buckets=4096, chunk_size=CHUNK_SIZE):
+    """ Streams the log file at 'path' into a LogOverview with an
+        envelope of about 'buckets' min/max buckets.
+    """
+    if path.endswith('.cdcb'):
+        log = BinaryLog(path)
+        counts = log.counts
+        n = len(counts)
+        envelope = Envelope(n // buckets + 1)
+        step = chunk_size // 4
+        for i in xrange(0, n, step):
+            envelope.add(counts_as_float(counts[i:i + step]))
+        x, y = envelope.envelope()
+        return LogOverview(path, n, x, y, log=log)
+    if path.endswith('.cdca'):
+        return load_archive_overview(path, buckets)
+
+    columns = log_columns(path)
+    offsets, lines = [], []
+    envelope = None
+    line = 0
+    held = np.zeros(0)
+    with open(path, 'rb') as f:
+        for offset, values in iter_chunks(f, 0, chunk_size, columns):
+            if columns > 1:
+                values = values[:, -1]     # the counts
+            if envelope is None:
+                # Size the buckets from the line length seen so far
+                estimate = os.path.getsize(path) * len(values) // max(1, f.tell())
+                envelope = Envelope(estimate // buckets + 1)
+            offsets.append(offset)
+            lines.append(line)
+            line += len(values)
+
+            # Drop the first line, and hold back the latest one
+            # until we know it is not the last
+            if offset == 0:
+                values = values[1:]
+            values = np.concatenate((held, values))
+            envelope.add(values[:-1])
+            held = values[-1:]
+
+    if envelope is None:
+        return LogOverview(path, 0, np.zeros(0), np.zeros(0), offsets, lines,
+                           columns=columns)
+    x, y = envelope.envelope()
+    return LogOverview(path, envelope.count, x, y, offsets, lines, columns=columns)
+
+
+def log_time_span(path):
+    """ Times of the first and last sample of a timestamped log
+        (binary or CSV), or None if it has none.
+    """
+    if path.endswith('.cdcb'):
+        log = BinaryLog(path)
+        if not len(log):
+            return None
+        return float(log.timestamps[0]), float(log.timestamps[-1])
+    if path.endswith('.cdca'):
+        f = archive.open_archive(path)
+        try:
+            blocks = list(archive.iter_block_headers(f, path))
+            if not blocks:
+                return None
+            f.seek(blocks[-1][0])
+            _, batch = next(archive.iter_blocks(f, path))
+        finally:
+            f.close()
+        if batch.timestamps is None:
+            raise ValueError('%s: the archive has no timestamps' % path)
+        return blocks[0][3], float(batch.timestamps[-1])
+
+    if log_columns(path) < 2:
+        raise ValueError('%s: the log has no timestamps' % path)
+    with open(path, 'rb') as f:
+        head = f.read(RANGE_CHUNK_SIZE)
+        f.seek(max(0, os.path.getsize(path) - RANGE_CHUNK_SIZE))
+        tail = f.read()
+    head = parse_block(head[:head.rfind('\n') + 1], 2)
+    tail = parse_block(tail[tail.find('\n') + 1:tail.rfind('\n') + 1], 2)
+    if not len(head):
+        return None
+    if not len(tail):
+        # The tail's first line, which may be partial, was its only one
+        tail = head
+    return float(head[0, 0]), float(tail[-1, 0])
+
+
+def read_time_range(path, start, stop, chunk_size=RANGE_CHUNK_SIZE):
+    """ Returns (timestamps, values) of the samples of a
+        timestamped log from time 'start' to 'stop' (in seconds
+        since the epoch). A CSV log is read from the last index
+        entry before 'start' on, or from the start if it has no
+        index.
+    """
+    if path.endswith('.cdcb'):
+        log = BinaryLog(path)
+        timestamps = log.timestamps
+        lo = np.searchsorted(timestamps, start, 'left')
+        hi = np.searchsorted(timestamps, stop, 'right')
+        return (np.array(timestamps[lo:hi]),
+                counts_as_float(log.counts[lo:hi]))
+    if path.endswith('.cdca'):
+        return archive.read_time_range(path, start, stop)
+
+    if log_columns(path) < 2:
+        raise ValueError('%s: the log has no timestamps' % path)
+    parts = [np.zeros((0, 2))]
+    with open(path, 'rb') as f:
+        for _, rows in iter_chunks(f, seek_offset(load_index(path), start),
+                                   chunk_size, 2):
+            parts.append(rows[(rows[:, 0] >= start) & (rows[:, 0] <= stop)])
+            if len(rows) and rows[-1, 0] > stop:
+                break
+    rows = np.concatenate(parts)
+    return rows[:, 0], rows[:, 1]
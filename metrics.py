@@ -0,0 +1,266 @@
+"""
+Pipeline metrics: counters, gauges and latency histograms.
+
+The acquisition, logging and display code records what it does in the
+module-level 'registry'. While the registry is disabled (the default)
+recording costs one attribute check; once enabled, a MetricsReporter
+thread takes a snapshot every second or so, keeps the latest one for
+display and appends it as a line of JSON to a file:
+
+    {"time": 1350763200.0, "interval": 1.0,
+     "counters": {"serial.samples": {"count": 50, "rate": 50.0}},
+     "gauges": {"queue.samples": 3},
+     "histograms": {"gui.replot": {"count": 25, "mean": 0.004,
+                                   "p50": 0.0038, "p90": ..., "max": ...}}}
+
+Counters and histograms cover the interval since the previous snapshot.
+Metrics are updated without locking, so a value recorded by another
+thread while a snapshot is taken may be counted in the next interval.
+"""
+import json
+import math
+import threading
+import time
+
+from timebase import monotonic
+
+
+class Counter(object):
+    """ Counts events, e.g. samples read.
+    """
+    def __init__(self, registry):
+        self.registry = registry
+        self.count = 0
+
+    def add(self, n=1):
+        if self.registry.enabled:
+            self.count += n
+
+    def snapshot(self, interval):
+        count, self.count = self.count, 0
+        return dict(count=count, rate=count / interval if interval > 0 else 0.0)
+
+
+class Gauge(object):
+    """ A value sampled at snapshot time: either the last value
+        set, or the result of calling 'read'.
+    """
+    def __init__(self, registry, read=None):
+        self.registry = registry
+        self.read = read
+        self.value = None
+
+    def set(self, value):
+        if self.registry.enabled:
+            self.value = value
+
+    def snapshot(self, interval):
+        if self.read is not None:
+            return self.read()
+        return self.value
+
+
+class _Timing(object):
+    def __init__(self, histogram):
+        self.histogram = histogram
+
+    def __enter__(self):
+        self.start = monotonic()
+
+    def __exit__(self, *exc_info):
+        self.histogram.observe(monotonic() - self.start)
+
+
+class _NoTiming(object):
+    def __enter__(self):
+        pass
+
+    def __exit__(self, *exc_info):
+        pass
+
+_no_timing = _NoTiming()
+
+
+class Histogram(object):
+    """ Distribution of durations (or other positive values) in
+        logarithmic buckets, four per doubling, from 'smallest' up.
+        Quantiles are reported as the upper edge of their bucket,
+        so they are accurate to within 19%.
+
+        observe(value):
+            Record a value.
+
+        time():
+            Context manager recording the duration of its body.
+    """
+    per_doubling = 4
+
+    def __init__(self, registry, smallest=1e-6, buckets=120):
+        self.registry = registry
+        self.smallest = smallest
+        self.counts = [0] * buckets
+        self.n = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def observe(self, value):
+        if not self.registry.enabled:
+            return
+        if value > self.smallest:
+            i = int(math.log(value / self.smallest, 2) * self.per_doubling)
+            i = min(i, len(self.counts) - 1)
+        else:
+            i = 0
+        self.counts[i] += 1
+        self.n += 1
+        self.total += value
+        if value > self.max:
+            self.max = value
+
+    def time(self):
+        if not self.registry.enabled:
+            return _no_timing
+        return _Timing(self)
+
+    def quantile(self, q):
+        if self.n == 0:
+            return None
+        rank = q * self.n
+        seen = 0
+        for i, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank:
+                return min(self.max,
+                           self.smallest * 2 ** ((i + 1.0) / self.per_doubling))
+        return self.max
+
+    def snapshot(self, interval):
+        result = dict(count=self.n,
+                      mean=self.total / self.n if self.n else None,
+                      p50=self.quantile(0.5),
+                      p90=self.quantile(0.9),
+                      p99=self.quantile(0.99),
+                      max=self.max if self.n else None)
+        self.counts = [0] * len(self.counts)
+        self.n = 0
+        self.total = 0.0
+        self.max = 0.0
+        return result
+
+
+class Registry(object):
+    """ A named set of metrics. counter(), gauge() and histogram()
+        return the metric of that name, creating it the first time,
+        so the code recording a metric doesn't need to know whether
+        metrics are enabled.
+    """
+    def __init__(self, enabled=False):
+        self.enabled = enabled
+        self.counters = {}
+        self.gauges = {}
+        self.histograms = {}
+        self.last_snapshot = monotonic()
+
+    def counter(self, name):
+        if name not in self.counters:
+            self.counters[name] = Counter(self)
+        return self.counters[name]
+
+    def gauge(self, name, read=None):
+        if name not in self.gauges:
+            self.gauges[name] = Gauge(self, read)
+        elif read is not None:
+            self.gauges[name].read = read
+        return self.gauges[name]
+
+    def histogram(self, name):
+        if name not in self.histograms:
+            self.histograms[name] = Histogram(self)
+        return self.histograms[name]
+
+    def snapshot(self):
+        """ The metrics of the interval since the previous
+            snapshot, as a dict (see the module docstring).
+        """
+        now = monotonic()
+        interval = now - self.last_snapshot
+        self.last_snapshot = now
+
+        def collect(metrics):
+            return dict((name, metric.snapshot(interval))
+                        for name, metric in sorted(metrics.items()))
+
+        return dict(time=time.time(),
+                    interval=interval,
+                    counters=collect(self.counters),
+                    gauges=collect(self.gauges),
+                    histograms=collect(self.histograms))
+
+
+registry = Registry()
+
+
+class MetricsReporter(threading.Thread):
+    """ Enables the registry and snapshots it every 'interval'
+        seconds. The latest snapshot is kept in 'latest'; if a
+        path is given, every snapshot is also appended to that
+        file as a line of JSON.
+
+        The file is opened when the reporter is created, so a bad
+        path raises IOError right away.
+    """
+    def __init__(self, interval=1.0, path=None, registry=registry):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.interval = interval
+        self.registry = registry
+        self.file = open(path, 'a') if path is not None else None
+        self.latest = None
+        self.stopped = threading.Event()
+
+    def run(self):
+        self.registry.enabled = True
+        self.registry.snapshot()    # start the first interval now
+        try:
+            while not self.stopped.isSet():
+                self.stopped.wait(self.interval)
+                self.report()
+        finally:
+            self.registry.enabled = False
+            if self.file is not None:
+                self.file.close()
+
+    def report(self):
+        self.latest = self.registry.snapshot()
+        if self.file is not None:
+            self.file.write(json.dumps(self.latest, sort_keys=True) + '\n')
+            self.file.flush()
+
+    def join(self, timeout=None):
+        self.stopped.set()
+        threading.Thread.join(self, timeout)
+
+
+def format_status(snapshot):
+    """ A one-line summary of a snapshot for the status bar.
+    """
+    if snapshot is None:
+        return ''
+    parts = []
+    samples = snapshot['counters'].get('serial.samples')
+    if samples is not None:
+        parts.append('%.0f samples/s' % samples['rate'])
+    malformed = snapshot['counters'].get('serial.malformed')
+    if malformed is not None and malformed['count']:
+        parts.append('%d malformed' % malformed['count'])
+    depth = snapshot['gauges'].get('queue.samples')
+    if depth is not None:
+        parts.append('queue %d' % depth)
+    for name, label in (('serial.parse', 'parse'),
+                        ('gui.update_monitor', 'update'),
+                        ('gui.replot', 'replot'),
+                        ('log.write', 'log')):
+        histogram = snapshot['histograms'].get(name)
+        if histogram is not None and histogram['count']:
+            parts.append('%s p90 %.1f ms' % (label, histogram['p90'] * 1000))
+    return ', '.join(parts)
@@ -0,0 +1,308 @@
+"""
+A PyQt program monitoring several symCDC electronics packages at once.
+
+All the serial ports are read by a single MultiPortMonitor thread, so
+adding a sensor doesn't add a thread. Every channel gets its own curve
+in the shared plot, its own period statistics and, while logging, its
+own daily log files, named after the port (e.g. COM5-2012-10-20.csv).
+
+usage: python multimonitor.py COM5 COM6 [...]
+"""
+import os
+import re
+import sys
+import Queue
+
+from PyQt4.QtCore import *
+from PyQt4.QtGui import *
+import PyQt4.Qwt5 as Qwt
+
+from batchqueue import BatchQueue
+from datalogger import LogWriterThread
+from decimate import minmax_decimate
+from eblib.utils import get_all_from_queue
+from governor import FrameRateGovernor
+from multiplex import MultiPortMonitor
+from period import PeriodEstimator
+from plotwidgets import DateTimeScaleDraw
+from ringbuffer import RingBuffer
+from stats import RunningStats
+from timebase import monotonic
+
+
+COLORS = ['limegreen', 'yellow', 'cyan', 'magenta',
+          'orange', 'red', 'dodgerblue', 'white']
+
+
+def channel_name(port):
+    """ A short name for the port, usable in file names.
+    """
+    return re.sub(r'[^\w.-]', '_', os.path.basename(port))
+
+
+class Channel(object):
+    """ The state of one channel of the MultiChannelMonitor: its
+        plot window, period statistics and log writer.
+    """
+    def __init__(self, port, color, window_size):
+        self.port = port
+        self.name = channel_name(port)
+        self.samples = RingBuffer(window_size)
+        self.period_estimator = PeriodEstimator()
+        self.period_stats = RunningStats(skip=2)
+        self.sample_count = 0
+        self.log_writer = None
+
+        self.curve = Qwt.QwtPlotCurve(self.name)
+        pen = QPen(QColor(color))
+        pen.setWidth(2)
+        self.curve.setPen(pen)
+
+    def add_batch(self, batch):
+        self.samples.extend(batch.timestamps, batch.counts)
+        self.sample_count += len(batch.counts)
+        for period in self.period_estimator.add(batch.timestamps, batch.counts):
+            self.period_stats.add(period)
+        if self.log_writer is not None:
+            self.log_writer.put(batch)
+
+
+class MultiChannelMonitor(QMainWindow):
+    # Milliseconds between reads of the data queue
+    ingest_interval = 10
+
+    def __init__(self, ports, parent=None, window_size=765):
+        super(MultiChannelMonitor, self).__init__(parent)
+
+        self.monitor = None
+        self.logger_active = False
+        self.channels = [Channel(port, COLORS[i % len(COLORS)], window_size)
+                         for i, port in enumerate(ports)]
+        self.by_port = dict((channel.port, channel) for channel in self.channels)
+
+        self.timer = QTimer()
+        self.connect(self.timer, SIGNAL('timeout()'), self.on_timer)
+        self.governor = FrameRateGovernor()
+        self.plot_dirty = False
+        self.render_timer = QTimer()
+        self.render_timer.setSingleShot(True)
+        self.connect(self.render_timer, SIGNAL('timeout()'), self.on_render_timer)
+
+        self.create_menu()
+        self.create_main_frame()
+        self.create_status_bar()
+        self.set_actions_enable_state()
+
+    def create_plot(self):
+        plot = Qwt.QwtPlot(self)
+        plot.setCanvasBackground(Qt.black)
+
+        plot.setAxisTitle(Qwt.QwtPlot.xBottom, 'Time')
+        plot.setAxisScaleDraw(Qwt.QwtPlot.xBottom, DateTimeScaleDraw())
+        plot.setAxisLabelRotation(Qwt.QwtPlot.xBottom, -45.0 )
+        plot.setAxisLabelAlignment(Qwt.QwtPlot.xBottom, Qt.AlignLeft | Qt.AlignBottom )
+
+        plot.setAxisTitle(Qwt.QwtPlot.yLeft, 'CDC Counts')
+        plot.setAxisAutoScale(Qwt.QwtPlot.yLeft)
+        plot.insertLegend(Qwt.QwtLegend(), Qwt.QwtPlot.RightLegend)
+
+        for channel in self.channels:
+            channel.curve.attach(plot)
+        return plot
+
+    def create_main_frame(self):
+        self.plot = self.create_plot()
+        plot_layout = QVBoxLayout()
+        plot_layout.addWidget(self.plot)
+        plot_groupbox = QGroupBox('Capacitive to Digital Sensor Graph')
+        plot_groupbox.setLayout(plot_layout)
+
+        self.table = QTableWidget(len(self.channels), 4)
+        self.table.setHorizontalHeaderLabels(
+            ['Samples', 'Period', 'Deviation', 'Periods'])
+        self.table.setVerticalHeaderLabels(
+            [channel.port for channel in self.channels])
+        self.table.setEditTriggers(QAbstractItemView.NoEditTriggers)
+        for row in range(len(self.channels)):
+            for col in range(4):
+                self.table.setItem(row, col, QTableWidgetItem('0'))
+        table_layout = QVBoxLayout()
+        table_layout.addWidget(self.table)
+        table_groupbox = QGroupBox('Channels')
+        table_groupbox.setLayout(table_layout)
+
+        self.main_frame = QWidget()
+        main_layout = QVBoxLayout()
+        main_layout.addWidget(plot_groupbox, 3)
+        main_layout.addWidget(table_groupbox, 1)
+        self.main_frame.setLayout(main_layout)
+        self.setCentralWidget(self.main_frame)
+
+    def create_status_bar(self):
+        self.status_text = QLabel('Monitor idle')
+        self.statusBar().addWidget(self.status_text, 1)
+        self.fps_text = QLabel('')
+        self.statusBar().addPermanentWidget(self.fps_text)
+
+    def create_menu(self):
+        self.file_menu = self.menuBar().addMenu("&File")
+        self.startMon_action = self.create_action("&Start monitor",
+            shortcut="Ctrl+M", slot=self.on_startMon, tip="Start the data monitor")
+        self.stopMon_action = self.create_action("&Stop monitor",
+            shortcut="Ctrl+T", slot=self.on_stopMon, tip="Stop the data monitor")
+        self.startLog_action = self.create_action("&Start logger",
+            shortcut="Ctrl+L", slot=self.on_startLog, tip="Start logging all channels")
+        self.stopLog_action = self.create_action("&Stop logger",
+            slot=self.on_stopLog, tip="Stop logging")
+        exit_action = self.create_action("E&xit", slot=self.close,
+            shortcut="Ctrl+X", tip="Exit the application")
+
+        for action in (self.startMon_action, self.stopMon_action,
+                       self.startLog_action, self.stopLog_action,
+                       None, exit_action):
+            if action is None:
+                self.file_menu.addSeparator()
+            else:
+                self.file_menu.addAction(action)
+
+    def create_action(  self, text, slot=None, shortcut=None,
+                        tip=None, signal="triggered()"):
+        action = QAction(text, self)
+        if shortcut is not None:
+            action.setShortcut(shortcut)
+        if tip is not None:
+            action.setToolTip(tip)
+            action.setStatusTip(tip)
+        if slot is not None:
+            self.connect(action, SIGNAL(signal), slot)
+        return action
+
+    def set_actions_enable_state(self):
+        self.startMon_action.setEnabled(self.monitor is None)
+        self.stopMon_action.setEnabled(self.monitor is not None)
+        self.startLog_action.setEnabled(not self.logger_active)
+        self.stopLog_action.setEnabled(self.logger_active)
+
+    def on_startMon(self):
+        if self.monitor is not None:
+            return
+
+        self.data_q = BatchQueue()
+        self.error_q = Queue.Queue()
+        self.monitor = MultiPortMonitor(self.data_q, self.error_q,
+                                        [channel.port for channel in self.channels],
+                                        57600)
+        self.monitor.start()
+
+        self.timer.start(self.ingest_interval)
+        self.render_timer.start(int(self.governor.interval * 1000))
+        self.status_text.setText('Monitor running')
+        self.set_actions_enable_state()
+
+    def on_stopMon(self):
+        if self.monitor is not None:
+            self.data_q.close()
+            self.monitor.join(10)
+            self.monitor = None
+
+        self.timer.stop()
+        self.render_timer.stop()
+        self.fps_text.setText('')
+        self.status_text.setText('Monitor idle')
+        self.set_actions_enable_state()
+
+    def on_startLog(self):
+        self.log_error_q = Queue.Queue()
+        for channel in self.channels:
+            try:
+                channel.log_writer = LogWriterThread(self.log_error_q,
+                                                     prefix=channel.name + '-')
+            except IOError, e:
+                QMessageBox.critical(self, 'LogWriterThread error', str(e))
+                self.on_stopLog()
+                return
+            channel.log_writer.start()
+
+        self.logger_active = True
+        self.set_actions_enable_state()
+
+    def on_stopLog(self):
+        self.logger_active = False
+        for channel in self.channels:
+            if channel.log_writer is not None:
+                channel.log_writer.join()
+                channel.log_writer = None
+        self.set_actions_enable_state()
+
+    def on_timer(self):
+        """ Executed periodically by the ingest timer. Hands the
+            received batches to their channels.
+        """
+        for port, batch in get_all_from_queue(self.data_q):
+            self.by_port[port].add_batch(batch)
+            self.plot_dirty = True
+
+        for error in get_all_from_queue(self.error_q):
+            self.status_text.setText(error)
+
+        if self.logger_active:
+            log_errors = list(get_all_from_queue(self.log_error_q))
+            if len(log_errors) > 0:
+                self.on_stopLog()
+                QMessageBox.critical(self, 'LogWriterThread error', log_errors[0])
+
+    def on_render_timer(self):
+        if self.plot_dirty:
+            start = monotonic()
+            self.render_monitor()
+            self.governor.frame_done(start, monotonic())
+            self.plot_dirty = False
+            self.fps_text.setText('%.1f fps' % self.governor.fps)
+
+        self.render_timer.start(int(self.governor.interval * 1000))
+
+    def render_monitor(self):
+        width = self.plot.canvas().width()
+        xmin = xmax = None
+        for row, channel in enumerate(self.channels):
+            if len(channel.samples) == 0:
+                continue
+            xdata, ydata = channel.samples.x, channel.samples.y
+            xmin = xdata[0] if xmin is None else min(xmin, xdata[0])
+            xmax = xdata[-1] if xmax is None else max(xmax, xdata[-1])
+            channel.curve.setData(*minmax_decimate(xdata, ydata, width))
+
+            stats = channel.period_stats
+            self.table.item(row, 0).setText(str(channel.sample_count))
+            if stats.n >= 2:
+                self.table.item(row, 1).setText(str(stats.mean))
+                self.table.item(row, 2).setText(str(stats.stdev))
+                self.table.item(row, 3).setText(str(stats.n))
+
+        if xmin is not None:
+            self.plot.setAxisScale(Qwt.QwtPlot.xBottom, xmin, xmax)
+        self.plot.replot()
+
+    def closeEvent(self, event):
+        self.on_stopMon()
+        self.on_stopLog()
+        event.accept()
+
+
+def main():
+    ports = sys.argv[1:]
+    if not ports:
+        print __doc__.strip()
+        return 1
+
+    if sys.platform == 'win32':
+        from eblib.serialutils import full_port_name
+        ports = [full_port_name(port) for port in ports]
+
+    app = QApplication(sys.argv)
+    form = MultiChannelMonitor(ports)
+    form.show()
+    return app.exec_()
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,192 @@
+import errno
+import os
+import select
+import threading
+import time
+
+import serial
+
+from com_monitor import DeviceSession, DeviceTimeout, LineBatcher
+from timebase import monotonic
+
+
+class MultiPortMonitor(threading.Thread):
+    """ A single thread monitoring several COM ports at once. The
+        ports are opened when the thread is started, and each one
+        gets its own line buffer and sample clock.
+
+        On POSIX systems the thread sleeps in epoll (or select)
+        until any of the ports has data. Serial handles can't be
+        waited on like that on Windows, so there the ports are
+        polled every poll_interval seconds instead - still from
+        one thread.
+
+        data_q:
+            Queue for received data. Items in the queue are
+            (port, batch) pairs, where port is the name the port
+            was given by and batch is a SampleBatch.
+
+        error_q:
+            Queue for error messages, prefixed with the port name.
+            A port that fails to open or read, or whose device
+            doesn't start streaming within boot_timeout seconds,
+            is dropped; the thread goes on with the others.
+
+        ports:
+            Names of the COM ports to open.
+
+        port_baud:
+            Baud rate of all the ports.
+
+        sample_rate:
+            Nominal rate of the devices in Hz.
+    """
+    def __init__(   self,
+                    data_q, error_q,
+                    ports,
+                    port_baud,
+                    sample_rate=50.0,
+                    poll_interval=0.005,
+                    boot_timeout=5.0):
+        threading.Thread.__init__(self)
+
+        self.ports = list(ports)
+        self.port_baud = port_baud
+        self.sample_rate = sample_rate
+        self.poll_interval = poll_interval
+        self.boot_timeout = boot_timeout
+
+        self.data_q = data_q
+        self.error_q = error_q
+        self.serial_ports = {}
+        self.sessions = {}
+        self.poller = None
+
+        self.alive = threading.Event()
+        self.alive.set()
+
+    def run(self):
+        for port in self.ports:
+            try:
+                self.serial_ports[port] = serial.Serial(port=port,
+                                                        baudrate=self.port_baud,
+                                                        timeout=0)
+            except serial.SerialException, e:
+                self.error_q.put('%s: %s' % (port, e))
+        if not self.serial_ports:
+            return
+
+        self.reset()
+        batchers = dict((port, LineBatcher(self.sample_rate))
+                        for port in self.serial_ports)
+        wait = self.make_waiter()
+
+        try:
+            while self.alive.isSet() and self.serial_ports:
+                if self.sessions:
+                    wait = self.poll_sessions(wait)
+                for port in wait(0.1 if self.sessions else 0.5):
+                    serial_port = self.serial_ports[port]
+                    try:
+                        data = serial_port.read(max(1, serial_port.inWaiting()))
+                    except (serial.SerialException, OSError), e:
+                        self.error_q.put('%s: %s' % (port, e))
+                        self.drop(port)
+                        wait = self.make_waiter()
+                        continue
+
+                    if data and port in self.sessions:
+                        data = self.sessions[port].feed(data)
+                        if data is None:
+                            continue
+                        del self.sessions[port]
+                    if data:
+                        batch = batchers[port].feed(data, monotonic())
+                        if batch is not None:
+                            self.data_q.put((port, batch))
+        finally:
+            for port in list(self.serial_ports):
+                self.drop(port)
+            self.close_poller()
+
+    def make_waiter(self):
+        """ Returns a function that waits up to 'timeout' seconds
+            for data on any of the open ports and returns the names
+            of those that have some.
+        """
+        if os.name != 'posix':
+            def wait(timeout):
+                time.sleep(self.poll_interval)
+                return [port for port, serial_port in self.serial_ports.items()
+                        if serial_port.inWaiting()]
+            return wait
+
+        by_fd = dict((serial_port.fileno(), port)
+                     for port, serial_port in self.serial_ports.items())
+        if hasattr(select, 'epoll'):
+            # Rebuilt whenever a port is dropped
+            self.close_poller()
+            self.poller = poller = select.epoll()
+            for fd in by_fd:
+                poller.register(fd, select.EPOLLIN)
+
+            def wait(timeout):
+                try:
+                    events = poller.poll(timeout)
+                except IOError, e:
+                    if e.errno == errno.EINTR:
+                        return []
+                    raise
+                return [by_fd[fd] for fd, _ in events]
+        else:
+            def wait(timeout):
+                try:
+                    readable, _, _ = select.select(list(by_fd), [], [], timeout)
+                except select.error, e:
+                    if e.args[0] == errno.EINTR:
+                        return []
+                    raise
+                return [by_fd[fd] for fd in readable]
+        return wait
+
+    def close_poller(self):
+        if self.poller is not None:
+            self.poller.close()
+            self.poller = None
+
+    def drop(self, port):
+        serial_port = self.serial_ports.pop(port)
+        try:
+            serial_port.close()
+        except (serial.SerialException, OSError):
+            pass
+
+    def reset(self):
+        # All the devices are restarted together, and each one
+        # starts streaming as soon as it is ready (see
+        # poll_sessions), so starting N of them takes no longer
+        # than starting the slowest one
+        now = monotonic()
+        for port, serial_port in self.serial_ports.items():
+            self.sessions[port] = DeviceSession(serial_port, self.boot_timeout)
+            self.sessions[port].begin(now)
+
+    def poll_sessions(self, wait):
+        """ Asks the devices that aren't streaming yet to start,
+            dropping those that took too long. Returns the waiter
+            to use from now on.
+        """
+        now = monotonic()
+        for port, session in self.sessions.items():
+            try:
+                session.poll(now)
+            except (DeviceTimeout, serial.SerialException, OSError), e:
+                self.error_q.put('%s: %s' % (port, e))
+                del self.sessions[port]
+                self.drop(port)
+                wait = self.make_waiter()
+        return wait
+
+    def join(self, timeout=None):
+        self.alive.clear()
+        threading.Thread.join(self, timeout)
@@ -0,0 +1,169 @@
+"""
+Period measurement of an oscillating CDC signal.
+
+PeriodEstimator works on whole batches of timestamped samples with
+numpy. Rising crossings of the signal's mean are located by linear
+interpolation between the two samples on either side, so the period
+resolution is not limited by the sample spacing, and all times come
+from the sample timestamps rather than from when the batch is handled.
+"""
+import numpy as np
+
+from ringbuffer import RingBuffer
+
+
+def rising_crossings(t, y, level, low, armed=False, start=0):
+    """ Finds the times at which y rises through 'level'. A rising
+        crossing only counts once y has been below 'low' since the
+        previous one (a Schmitt trigger), so noise around the level
+        doesn't produce extra crossings.
+
+        armed:
+            Whether y was below 'low' (and has not risen through
+            the level since) before sample 'start'.
+
+        start:
+            Samples before this index were already handled with
+            the previous batch. They only serve to interpolate a
+            crossing just after them.
+
+        Returns (times, armed), where armed is the state after the
+        last sample, to be passed along with the next batch.
+    """
+    # +1 where y is at or above the level, -1 where it is below
+    # 'low', 0 in between; the state is the last non-zero event
+    events = np.where(y >= level, 1, np.where(y < low, -1, 0))
+    events[:start] = 0
+    events = np.concatenate(([-1 if armed else 1], events))
+    last = np.where(events != 0, np.arange(len(events)), 0)
+    state = events[np.maximum.accumulate(last)]
+
+    # Crossings are between samples i - 1 and i, where i is an
+    # index into y (one less than into state)
+    i = np.flatnonzero((state[1:] == 1) & (state[:-1] == -1))
+    i = i[i > 0]
+    y0, y1 = y[i - 1], y[i]
+    t0, t1 = t[i - 1], t[i]
+    times = t0 + (level - y0) / (y1 - y0) * (t1 - t0)
+    return times, state[-1] == -1
+
+
+def autocorrelation_period(t, y):
+    """ Estimates the period of the samples (t, y) from the first
+        peak of their autocorrelation, refined by fitting a parabola
+        through the peak. Returns None if no period is found.
+    """
+    n = len(y)
+    if n < 4:
+        return None
+    y = y - y.mean()
+    spectrum = np.fft.rfft(y, 2 * n)
+    acf = np.fft.irfft(spectrum * np.conj(spectrum))[:n]
+    acf /= n - np.arange(n)     # unbiased, so the peaks don't lean left
+
+    # The first peak is the largest value of the first positive
+    # lobe after the autocorrelation has gone negative. Lags beyond
+    # n / 2 rest on too few products to be trusted.
+    acf = acf[:n // 2]
+    negative = np.flatnonzero(acf < 0)
+    if len(negative) == 0:
+        return None
+    positive = negative[0] + np.flatnonzero(acf[negative[0]:] > 0)
+    if len(positive) == 0:
+        return None
+    start = positive[0]
+    end = np.flatnonzero(acf[start:] < 0)
+    if len(end) == 0:
+        return None
+    lag = start + np.argmax(acf[start:start + end[0]])
+    if lag <= start:
+        return None
+
+    a, b, c = acf[lag - 1], acf[lag], acf[lag + 1]
+    if a - 2 * b + c != 0:
+        lag = lag + 0.5 * (a - c) / (a - 2 * b + c)
+    return lag * (t[-1] - t[0]) / (n - 1)
+
+
+class PeriodEstimator(object):
+    """ Measures periods of a signal fed to it in batches.
+
+        history:
+            Number of recent samples the signal's mean (the level
+            whose crossings are timed) and amplitude are taken
+            from. Should cover a few periods.
+
+        hysteresis:
+            Fraction of the signal's peak-to-peak amplitude the
+            signal must drop below the mean to re-arm the detector.
+
+        method:
+            'crossing' times every period from mean crossings.
+            'autocorrelation' estimates the period of the history
+            each time it has been completely replaced.
+
+        Interface:
+
+        add(timestamps, values):
+            Add a batch of samples. Returns an array of the
+            periods completed within the batch.
+
+        reset():
+            Forget all samples and crossings.
+    """
+    def __init__(self, history=500, hysteresis=0.1, method='crossing'):
+        self.history = history
+        self.hysteresis = hysteresis
+        self.method = method
+        self.reset()
+
+    def reset(self):
+        self.samples = RingBuffer(self.history)
+        self.armed = False
+        self.last_crossing = None
+        self.fresh = 0
+
+    def add(self, timestamps, values):
+        if len(values) == 0:
+            return np.zeros(0)
+        t = np.asarray(timestamps, np.float64)
+        y = np.asarray(values, np.float64)
+
+        # Prepend the last sample of the previous batch, so that
+        # crossings between batches are found too
+        start = 0
+        if len(self.samples):
+            t = np.concatenate((self.samples.x[-1:], t))
+            y = np.concatenate((self.samples.y[-1:], y))
+            start = 1
+        self.samples.extend(t[start:], y[start:])
+        self.fresh += len(values)
+
+        if self.method == 'autocorrelation':
+            return self._autocorrelation()
+
+        # Wait for enough samples to tell the mean and amplitude
+        if len(self.samples) < self.history // 2:
+            return np.zeros(0)
+        history = self.samples.y
+        level = history.mean()
+        low = level - self.hysteresis * (history.max() - history.min())
+        if low >= level:
+            return np.zeros(0)
+        times, self.armed = rising_crossings(t, y, level, low, self.armed, start)
+        if len(times) == 0:
+            return np.zeros(0)
+
+        if self.last_crossing is not None:
+            times = np.concatenate(([self.last_crossing], times))
+        self.last_crossing = times[-1]
+        return np.diff(times)
+
+    def _autocorrelation(self):
+        if self.fresh < self.history:
+            return np.zeros(0)
+        self.fresh = 0
+        period = autocorrelation_period(self.samples.x, self.samples.y)
+        if period is None:
+            return np.zeros(0)
+        return np.array([period])
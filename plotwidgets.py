@@ -0,0 +1,104 @@
+import collections
+import datetime
+
+import numpy as np
+from PyQt4.QtGui import *
+import PyQt4.Qwt5 as Qwt
+
+
+class DateTimeScaleDraw( Qwt.QwtScaleDraw ):
+    '''Class used to draw a datetime axis on our plot.
+    '''
+    def __init__( self, *args ):
+        Qwt.QwtScaleDraw.__init__( self, *args )
+
+    def label( self, value ):
+        '''Function used to create the text of each label
+        used to draw the axis.
+        '''
+        try:
+            dt = datetime.datetime.fromtimestamp(  value )
+        except:
+            dt = datetime.datetime.fromtimestamp(  1349931600 )
+        #return Qwt.QwtText( '%s' % dt.strftime( '%d/%m%Y %H:%M:%S' ) )
+        return Qwt.QwtText( '%s' % dt.strftime( '%H:%M:%S' ) )
+
+
+class GapCurve( Qwt.QwtPlotCurve ):
+    '''A curve that leaves gaps at NaN values (marking gaps in
+    the data) instead of drawing a line through them. Each run
+    of valid points is drawn as a separate segment.
+    '''
+    def __init__( self, *args ):
+        Qwt.QwtPlotCurve.__init__( self, *args )
+        self.segments = None
+        self.bounds = None
+
+    def setData( self, x, y ):
+        x = np.asarray(x, np.float64)
+        y = np.asarray(y, np.float64)
+        missing = np.isnan(y)
+        if missing.any():
+            # Alternating starts and ends of the runs of valid points
+            edges = np.flatnonzero(np.diff(
+                np.concatenate(([1], missing, [1])).astype(np.int8)))
+            self.segments = zip(edges[0::2], edges[1::2] - 1)
+            valid = ~missing
+            self.bounds = ((x[valid].min(), y[valid].min(),
+                            x[valid].max(), y[valid].max())
+                           if valid.any() else None)
+        else:
+            self.segments = None
+            self.bounds = None
+        Qwt.QwtPlotCurve.setData( self, x, y )
+
+    def boundingRect( self ):
+        if self.bounds is None:
+            return Qwt.QwtPlotCurve.boundingRect( self )
+        x0, y0, x1, y1 = self.bounds
+        return Qwt.QwtDoubleRect(x0, y0, x1 - x0, y1 - y0)
+
+    def drawCurve( self, painter, style, xMap, yMap, start, stop ):
+        if self.segments is None:
+            Qwt.QwtPlotCurve.drawCurve( self, painter, style, xMap, yMap, start, stop )
+            return
+        for first, last in self.segments:
+            first, last = max(first, start), min(last, stop)
+            if first <= last:
+                Qwt.QwtPlotCurve.drawCurve( self, painter, style, xMap, yMap, first, last )
+
+
+class RawConsole(QPlainTextEdit):
+    '''Read-only view of the most recent raw values, one per line.
+    QPlainTextEdit lays out only the visible lines, and with a
+    maximum block count it drops the oldest line as each new one
+    arrives, so the view holds max_lines lines at a constant cost.
+
+    append_values() adds a whole batch of values with a single
+    append. While paused the view stays put; the last max_lines
+    values keep being collected and are shown on resuming.
+    '''
+    def __init__( self, max_lines=4096, parent=None ):
+        QPlainTextEdit.__init__( self, parent )
+        self.setReadOnly(True)
+        self.setUndoRedoEnabled(False)
+        self.setLineWrapMode(QPlainTextEdit.NoWrap)
+        self.setMaximumBlockCount(max_lines)
+        self.paused = False
+        self.held = collections.deque(maxlen=max_lines)
+
+    def append_values( self, values ):
+        if len(values) == 0:
+            return
+        values = values[-self.maximumBlockCount():]
+        if self.paused:
+            self.held.extend(values)
+            return
+        self.appendPlainText('\n'.join(str(value) for value in values))
+
+    def set_paused( self, paused ):
+        self.paused = bool(paused)
+        if not self.paused and self.held:
+            values = list(self.held)
+            self.held.clear()
+            self.append_values(values)
@@ -0,0 +1,91 @@
+import numpy as np
+
+
+class RingBuffer(object):
+    """ A fixed-capacity buffer of (x, y) samples backed by
+        preallocated numpy arrays. Once the buffer is full, adding
+        a sample evicts the oldest one.
+
+        Every sample is stored twice, 'capacity' elements apart,
+        so the samples currently held always form one contiguous
+        slice of the underlying arrays. The x and y attributes are
+        views of that slice, oldest sample first, and can be handed
+        straight to QwtPlotCurve.setData without copying.
+
+        Interface to writer:
+
+        append(x, y):
+            Add a single sample.
+
+        extend(xs, ys):
+            Add a sequence of samples.
+
+        Interface to reader:
+
+        x, y:
+            Views of the samples currently held. They are only
+            valid until the next append/extend.
+    """
+    def __init__(self, capacity, dtype=np.float64):
+        self.capacity = capacity
+        self._x = np.zeros(2 * capacity)
+        self._y = np.zeros(2 * capacity, dtype)
+        self._end = 0
+        self._len = 0
+
+    def __len__(self):
+        return self._len
+
+    @property
+    def x(self):
+        return self._x[self._start():self._end + self.capacity]
+
+    @property
+    def y(self):
+        return self._y[self._start():self._end + self.capacity]
+
+    def _start(self):
+        return self._end + self.capacity - self._len
+
+    def append(self, x, y):
+        i = self._end
+        self._x[i] = self._x[i + self.capacity] = x
+        self._y[i] = self._y[i + self.capacity] = y
+        self._end = (i + 1) % self.capacity
+        self._len = min(self._len + 1, self.capacity)
+
+    def extend(self, xs, ys):
+        n = len(xs)
+        if n == 0:
+            return
+        if n >= self.capacity:
+            xs = xs[-self.capacity:]
+            ys = ys[-self.capacity:]
+            for offset in (0, self.capacity):
+                self._x[offset:offset + self.capacity] = xs
+                self._y[offset:offset + self.capacity] = ys
+            self._end = 0
+            self._len = self.capacity
+            return
+
+        idx = (self._end + np.arange(n)) % self.capacity
+        self._x[idx] = self._x[idx + self.capacity] = xs
+        self._y[idx] = self._y[idx + self.capacity] = ys
+        self._end = (self._end + n) % self.capacity
+        self._len = min(self._len + n, self.capacity)
+
+    def clear(self):
+        self._end = 0
+        self._len = 0
+
+    def resized(self, capacity):
+        """ Returns a new RingBuffer with the given capacity,
+            holding the most recent samples of this one.
+        """
+        rb = RingBuffer(capacity, self._y.dtype)
+        rb.extend(self.x, self.y)
+        return rb
+
+
+if __name__ == "__main__":
+    pass
@@ -0,0 +1,306 @@
+"""
+Multi-resolution rollups of the CDC counts, for browsing long histories.
+
+RollupWriter is fed the same SampleBatches as the logger and keeps, next
+to the daily log files, one file per tier of fixed-width buckets:
+
+    <prefix>rollup-1s.cdcr      one record per second
+    <prefix>rollup-1m.cdcr      one record per minute
+    <prefix>rollup-1h.cdcr      one record per hour
+
+Each tier covers the whole history rather than a day, so a month of data
+is about 2.6 million one-second records, 43200 one-minute records and
+720 one-hour records. A file starts with a HEADER_SIZE byte header
+followed by packed little-endian records of ROLLUP_DTYPE:
+
+    start       float64  start of the bucket in seconds since the epoch
+    min         float64  smallest count in the bucket
+    max         float64  largest count in the bucket
+    mean        float64  mean count in the bucket
+    count       uint32   number of samples in the bucket
+
+Buckets are aligned to multiples of their width, and only buckets that
+received samples are written, so gaps in the data are gaps between
+records. A bucket that was still open when the logger stopped is written
+as it is, and may appear a second time if logging resumes within it.
+
+RollupStore reads the tiers back and picks, for a span of time, the
+finest tier that still fits in the width of the plot.
+"""
+import os
+import re
+import struct
+
+import numpy as np
+
+from binlog import GAP_COUNT
+from decimate import interleave
+
+
+MAGIC = 'CDCR'
+VERSION = 1
+
+# magic, version, header size, record size, bucket width, padding
+HEADER_FORMAT = '<4sHHHd14x'
+HEADER_SIZE = struct.calcsize(HEADER_FORMAT)
+
+ROLLUP_DTYPE = np.dtype([('start', '<f8'),
+                         ('min', '<f8'),
+                         ('max', '<f8'),
+                         ('mean', '<f8'),
+                         ('count', '<u4')])
+
+# (name, bucket width in seconds), finest first
+TIERS = (('1s', 1.0), ('1m', 60.0), ('1h', 3600.0))
+
+
+def tier_path(directory, prefix, name):
+    return os.path.join(directory, '%srollup-%s.cdcr' % (prefix, name))
+
+
+def open_store(path):
+    """ The RollupStore that the tier file at 'path' (named as by
+        tier_path) belongs to.
+    """
+    directory, filename = os.path.split(path)
+    m = re.match(r'^(.*)rollup-\w+\.cdcr$', filename)
+    if m is None:
+        raise ValueError('%s: not a CDC rollup' % path)
+    return RollupStore(directory or '.', m.group(1))
+
+
+def sample_records(batch):
+    """ The samples of a SampleBatch as single-sample buckets,
+        leaving out the gap markers.
+    """
+    valid = batch.counts != GAP_COUNT
+    counts = batch.counts[valid].astype(np.float64)
+    records = np.empty(len(counts), ROLLUP_DTYPE)
+    records['start'] = batch.timestamps[valid]
+    records['min'] = counts
+    records['max'] = counts
+    records['mean'] = counts
+    records['count'] = 1
+    return records
+
+
+def merge_buckets(records, width):
+    """ Merges records in time order into buckets 'width' seconds
+        wide. A record dated before its predecessor (e.g. after the
+        sample clock was corrected) is merged into the predecessor's
+        bucket.
+    """
+    keys = np.maximum.accumulate(np.floor(records['start'] / width))
+    edges = np.concatenate(([0], np.flatnonzero(np.diff(keys)) + 1))
+    counts = np.add.reduceat(records['count'].astype(np.float64), edges)
+    sums = np.add.reduceat(records['mean'] * records['count'], edges)
+
+    merged = np.empty(len(edges), ROLLUP_DTYPE)
+    merged['start'] = keys[edges] * width
+    merged['min'] = np.minimum.reduceat(records['min'], edges)
+    merged['max'] = np.maximum.reduceat(records['max'], edges)
+    merged['mean'] = sums / counts
+    merged['count'] = counts
+    return merged
+
+
+def read_header(path):
+    """ (header size, bucket width) from the header of the tier
+        file at 'path'. Raises ValueError if it isn't one.
+    """
+    with open(path, 'rb') as f:
+        header = f.read(HEADER_SIZE)
+    if len(header) < HEADER_SIZE:
+        raise ValueError('%s: not a CDC rollup' % path)
+    magic, version, header_size, record_size, width = struct.unpack(
+        HEADER_FORMAT, header)
+    if (magic != MAGIC or version != VERSION or
+            record_size != ROLLUP_DTYPE.itemsize):
+        raise ValueError('%s: not a CDC rollup' % path)
+    return header_size, width
+
+
+class RollupTier(object):
+    """ One tier of a RollupWriter: appends the buckets of one
+        width to its file as they are completed.
+
+        add(records):
+            Merge records (in time order) into the tier, and
+            return the buckets this completed.
+
+        close():
+            Write the open bucket, close the file and return
+            the open bucket.
+
+        An existing file is appended to, and raises ValueError if
+        it isn't a tier of the same width.
+    """
+    def __init__(self, path, width, buffering=-1):
+        self.path = path
+        self.width = width
+        new = not os.path.exists(path) or os.path.getsize(path) == 0
+        if not new:
+            header_size, file_width = read_header(path)
+            if file_width != width:
+                raise ValueError('%s: a rollup of %g s buckets, not %g s'
+                                 % (path, file_width, width))
+        self.file = open(path, 'ab', buffering)
+        if not new:
+            # Drop a record that was only partially written, so that
+            # new ones don't end up misaligned
+            size = os.path.getsize(path)
+            extra = (size - header_size) % ROLLUP_DTYPE.itemsize
+            if extra:
+                self.file.truncate(size - extra)
+        if new:
+            self.file.write(struct.pack(HEADER_FORMAT, MAGIC, VERSION, HEADER_SIZE,
+                                        ROLLUP_DTYPE.itemsize, width))
+            # so that a RollupStore can read the file right away
+            self.file.flush()
+        self.open = np.zeros(0, ROLLUP_DTYPE)
+
+    def add(self, records):
+        merged = merge_buckets(np.concatenate((self.open, records)), self.width)
+        self.open = merged[-1:]
+        done = merged[:-1]
+        if len(done):
+            self.file.write(done.tostring())
+        return done
+
+    def flush(self):
+        self.file.flush()
+
+    def close(self):
+        rest, self.open = self.open, np.zeros(0, ROLLUP_DTYPE)
+        if len(rest):
+            self.file.write(rest.tostring())
+        self.file.close()
+        return rest
+
+
+class RollupWriter(object):
+    """ Keeps the rollup tiers of a stream of SampleBatches. The
+        finest tier is fed the samples, and every coarser tier the
+        buckets completed by the tier below it, so a sample costs
+        the same however long the history grows.
+
+        The tier files are opened (or created) when the writer is
+        created, so a bad directory raises IOError right away, and
+        a tier file of another layout ValueError.
+
+        Interface to writer:
+
+        add_batch(batch):
+            Add the samples of a SampleBatch.
+
+        flush():
+            Push the completed buckets to the OS.
+
+        close():
+            Write the open buckets and close the files.
+    """
+    def __init__(self, directory='.', prefix='', tiers=TIERS, buffering=-1):
+        self.tiers = []
+        try:
+            for name, width in tiers:
+                self.tiers.append(RollupTier(tier_path(directory, prefix, name),
+                                             width, buffering))
+        except (IOError, ValueError):
+            for tier in self.tiers:
+                tier.file.close()
+            raise
+
+    def add_batch(self, batch):
+        records = sample_records(batch)
+        for tier in self.tiers:
+            if not len(records):
+                break
+            records = tier.add(records)
+
+    def flush(self):
+        for tier in self.tiers:
+            tier.flush()
+
+    def close(self):
+        records = np.zeros(0, ROLLUP_DTYPE)
+        for tier in self.tiers:
+            if len(records):
+                records = tier.add(records)
+            records = np.concatenate((records, tier.close()))
+
+
+def read_tier(path):
+    """ The records of a tier file, mapped into memory, and its
+        bucket width. A missing file reads as an empty tier.
+    """
+    if not os.path.exists(path):
+        return np.zeros(0, ROLLUP_DTYPE), None
+    header_size, width = read_header(path)
+    record_size = ROLLUP_DTYPE.itemsize
+
+    # A record that was only partially written is ignored
+    n = (os.path.getsize(path) - header_size) // record_size
+    if n == 0:
+        return np.zeros(0, ROLLUP_DTYPE), width
+    return np.memmap(path, ROLLUP_DTYPE, 'r', offset=header_size, shape=(n,)), width
+
+
+def envelope(records, width):
+    """ The min/max envelope of the buckets, ready for
+        QwtPlotCurve.setData: two points per bucket at its centre,
+        with a NaN between buckets that aren't adjacent so that a
+        GapCurve leaves the gap open.
+    """
+    if not len(records):
+        return np.zeros(0), np.zeros(0)
+    starts = np.asarray(records['start'])
+    x = np.repeat(starts + width / 2.0, 2)
+    y = interleave(np.asarray(records['min']), np.asarray(records['max']))
+    breaks = np.flatnonzero(np.diff(starts) > width * 1.5) + 1
+    if len(breaks):
+        x = np.insert(x, 2 * breaks, x[2 * breaks - 1])
+        y = np.insert(y, 2 * breaks, np.nan)
+    return x, y
+
+
+class RollupStore(object):
+    """ Reads the rollup tiers that a RollupWriter keeps in
+        'directory'. The files are mapped anew by every query,
+        so a store can follow a writer that is still running.
+
+        span():
+            (first, last) bucket start of the whole history, or
+            None if there is none yet.
+
+        select(start, stop, points):
+            Returns (name, width, records) of the finest tier
+            with at most 'points' buckets between the times start
+            and stop (in seconds since the epoch), or the
+            coarsest tier if none is that coarse.
+    """
+    def __init__(self, directory='.', prefix='', tiers=TIERS):
+        self.directory = directory
+        self.prefix = prefix
+        self.tiers = tiers
+
+    def span(self):
+        first = last = None
+        for name, _ in self.tiers:
+            records, _ = read_tier(tier_path(self.directory, self.prefix, name))
+            if len(records):
+                if first is None or records['start'][0] < first:
+                    first = records['start'][0]
+                if last is None or records['start'][-1] > last:
+                    last = records['start'][-1]
+        if first is None:
+            return None
+        return float(first), float(last)
+
+    def select(self, start, stop, points):
+        for i, (name, width) in enumerate(self.tiers):
+            records, file_width = read_tier(tier_path(self.directory, self.prefix, name))
+            starts = records['start']
+            lo = np.searchsorted(starts, start - width, 'left')
+            hi = np.searchsorted(starts, stop, 'right')
+            if hi - lo <= points or i == len(self.tiers) - 1:
+                return name, file_width or width, records[lo:hi]
@@ -0,0 +1,19 @@
+"""
+The unit in which CDC samples travel through the program.
+"""
+from collections import namedtuple
+
+
+# One item placed on data_q by a ComMonitorThread in batch mode.
+#
+#   first:      running index (from the thread's start) of the first
+#               sample in the batch
+#   counts:     numpy int32 array of CDC counts
+#   timestamps: numpy float64 array with the time of each sample, in
+#               seconds since the epoch, as reconstructed by a
+#               timebase.SampleClock from the sample indices
+#
+# A sample with the count binlog.GAP_COUNT is not a sample but marks a
+# gap in the data, e.g. while the device was disconnected.
+#
+SampleBatch = namedtuple('SampleBatch', 'first counts timestamps')
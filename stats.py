@@ -0,0 +1,136 @@
+"""
+Incremental statistics over a stream of values.
+
+Both classes update their mean, standard deviation, minimum and maximum
+in O(1) (amortized) per value with Welford's running moments, instead
+of passing over all the values seen so far.
+"""
+import collections
+import math
+
+
+class RunningStats(object):
+    """ Cumulative statistics of all values added.
+
+        skip:
+            Number of initial values to ignore (e.g. periods
+            measured before the signal settled). They are counted
+            in 'seen' but not in the statistics.
+
+        Interface:
+
+        add(x):
+            Add a value.
+
+        n, mean, stdev, min, max:
+            Statistics of the values added. stdev is the sample
+            standard deviation (n - 1 in the denominator) and is
+            0 for fewer than two values.
+    """
+    def __init__(self, skip=0):
+        self.skip = skip
+        self.clear()
+
+    def clear(self):
+        self.seen = 0
+        self.n = 0
+        self.mean = 0.0
+        self._m2 = 0.0
+        self.min = None
+        self.max = None
+
+    def add(self, x):
+        self.seen += 1
+        if self.seen <= self.skip:
+            return
+
+        self.n += 1
+        delta = x - self.mean
+        self.mean += delta / self.n
+        self._m2 += delta * (x - self.mean)
+        if self.min is None or x < self.min:
+            self.min = x
+        if self.max is None or x > self.max:
+            self.max = x
+
+    @property
+    def stdev(self):
+        if self.n < 2:
+            return 0.0
+        return math.sqrt(self._m2 / (self.n - 1))
+
+
+class WindowedStats(object):
+    """ Statistics of the last 'size' values added, with the same
+        interface as RunningStats. The minimum and maximum are
+        kept with monotonic queues, so evicting a value never
+        requires a scan of the window.
+    """
+    def __init__(self, size, skip=0):
+        self.size = size
+        self.skip = skip
+        self.clear()
+
+    def clear(self):
+        self.seen = 0
+        self.mean = 0.0
+        self._m2 = 0.0
+        self._values = collections.deque()
+        self._mins = collections.deque()
+        self._maxs = collections.deque()
+
+    @property
+    def n(self):
+        return len(self._values)
+
+    def add(self, x):
+        self.seen += 1
+        if self.seen <= self.skip:
+            return
+
+        if len(self._values) == self.size:
+            self._remove(self._values.popleft())
+
+        self._values.append(x)
+        delta = x - self.mean
+        self.mean += delta / len(self._values)
+        self._m2 += delta * (x - self.mean)
+
+        # Each deque holds (index, value) candidates for the window
+        # extreme, oldest first
+        while self._mins and self._mins[-1][1] >= x:
+            self._mins.pop()
+        self._mins.append((self.seen, x))
+        while self._maxs and self._maxs[-1][1] <= x:
+            self._maxs.pop()
+        self._maxs.append((self.seen, x))
+
+        oldest = self.seen - len(self._values)
+        while self._mins[0][0] <= oldest:
+            self._mins.popleft()
+        while self._maxs[0][0] <= oldest:
+            self._maxs.popleft()
+
+    def _remove(self, x):
+        # Called after x has left self._values
+        n = len(self._values)
+        if n == 0:
+            self.mean = self._m2 = 0.0
+            return
+        delta = x - self.mean
+        self.mean -= delta / n
+        self._m2 = max(0.0, self._m2 - delta * (x - self.mean))
+
+    @property
+    def stdev(self):
+        if self.n < 2:
+            return 0.0
+        return math.sqrt(self._m2 / (self.n - 1))
+
+    @property
+    def min(self):
+        return self._mins[0][1] if self._mins else None
+
+    @property
+    def max(self):
+        return self._maxs[0][1] if self._maxs else None
@@ -0,0 +1,366 @@
+"""
+Live distribution of CDC samples to local subscribers.
+
+A StreamServer listens on a TCP or Unix domain socket and sends every
+SampleBatch published to it to all connected clients, so analysis tools
+can follow the acquisition live rather than tail the log files. The
+sending is done by the server's own thread: publish() merely queues the
+encoded batch with each client. Every client's queue is bounded, and a
+client that falls behind loses its oldest batches (or is disconnected),
+so a stalled client never holds up acquisition.
+
+The stream is a sequence of frames, each a FRAME_HEADER
+
+    magic       4s      'CDCS'
+    samples     uint32  number of records following the header
+    dropped     uint32  samples dropped for this client since its last frame
+
+followed by 'samples' records of binlog.RECORD_DTYPE, where a count of
+binlog.GAP_COUNT marks a gap in the data. StreamClient reads the frames
+back as SampleBatches; run this module to print a stream as CSV:
+
+usage: python streamserver.py localhost:5745
+"""
+import collections
+import errno
+import os
+import select
+import socket
+import stat
+import struct
+import sys
+import threading
+
+import numpy as np
+
+from binlog import RECORD_DTYPE, batch_records
+from samplebatch import SampleBatch
+
+
+MAGIC = 'CDCS'
+FRAME_HEADER = '<4sII'
+FRAME_HEADER_SIZE = struct.calcsize(FRAME_HEADER)
+
+DEFAULT_ADDRESS = 'localhost:5745'
+
+
+def parse_address(address):
+    """ 'host:port' (or just 'port' for localhost) is a TCP address,
+        anything else is the path of a Unix domain socket.
+    """
+    if address.isdigit():
+        return ('localhost', int(address))
+    host, sep, port = address.rpartition(':')
+    if sep and port.isdigit():
+        return (host or 'localhost', int(port))
+    return address
+
+
+def stream_socket(address):
+    """ A new stream socket of the family the address belongs to.
+    """
+    if isinstance(address, tuple):
+        return socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    if not hasattr(socket, 'AF_UNIX'):
+        raise socket.error('Unix domain sockets are not supported here: %s' % address)
+    return socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+
+
+def wakeup_pair():
+    """ A pair of connected sockets. Writing to the second one wakes
+        up a select() on the first.
+    """
+    if hasattr(socket, 'socketpair'):
+        reader, writer = socket.socketpair()
+    else:
+        # Windows: connect over the loopback interface
+        listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        listener.bind(('127.0.0.1', 0))
+        listener.listen(1)
+        writer = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        writer.connect(listener.getsockname())
+        reader, _ = listener.accept()
+        listener.close()
+    reader.setblocking(0)
+    writer.setblocking(0)
+    return reader, writer
+
+
+class Subscriber(object):
+    """ A client of the StreamServer and the frames queued for it.
+    """
+    def __init__(self, sock):
+        self.sock = sock
+        self.frames = collections.deque()   # (samples, payload)
+        self.queued = 0                     # samples in self.frames
+        self.dropped = 0                    # not yet reported to the client
+        self.overflowed = False
+        self.pending = None                 # frame being sent...
+        self.sent = 0                       # ...and how much of it was
+
+
+class StreamServer(threading.Thread):
+    """ Publishes sample batches to any number of subscribers.
+        The socket is bound when the server is created, so a bad
+        or busy address raises socket.error right away.
+
+        address:
+            ('host', port) for TCP, or the path of a Unix domain
+            socket (see parse_address).
+
+        backlog:
+            Most samples queued for a single client.
+
+        policy:
+            What happens when a client's queue is full: 'drop'
+            drops its oldest batches, 'disconnect' disconnects it.
+
+        Interface:
+
+        publish(batch):
+            Queue a SampleBatch for all current subscribers.
+            Never blocks on the network.
+
+        subscribers:
+            Number of connected clients.
+
+        samples_dropped:
+            Total samples dropped for slow clients.
+    """
+    def __init__(self, address, backlog=65536, policy='drop'):
+        threading.Thread.__init__(self)
+        self.daemon = True
+
+        if policy not in ('drop', 'disconnect'):
+            raise ValueError('unknown policy: %r' % policy)
+        self.address = address
+        self.backlog = backlog
+        self.policy = policy
+        self.samples_dropped = 0
+
+        self.listener = stream_socket(address)
+        if isinstance(address, tuple):
+            self.listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        else:
+            self._remove_stale_socket()
+        self.listener.bind(address)
+        self.listener.listen(5)
+        self.listener.setblocking(0)
+
+        self.clients = {}
+        self.lock = threading.Lock()
+        self.wake_r, self.wake_w = wakeup_pair()
+
+        self.alive = threading.Event()
+        self.alive.set()
+
+    @property
+    def subscribers(self):
+        return len(self.clients)
+
+    def publish(self, batch):
+        n = len(batch.counts)
+        if n == 0 or not self.clients:
+            return
+        payload = batch_records(batch).tostring()
+
+        with self.lock:
+            for client in self.clients.values():
+                if client.overflowed:
+                    continue
+                while client.frames and client.queued + n > self.backlog:
+                    if self.policy == 'disconnect':
+                        client.overflowed = True
+                        break
+                    dropped, _ = client.frames.popleft()
+                    client.queued -= dropped
+                    client.dropped += dropped
+                    self.samples_dropped += dropped
+                else:
+                    client.frames.append((n, payload))
+                    client.queued += n
+        self._wake()
+
+    def run(self):
+        try:
+            while self.alive.isSet():
+                with self.lock:
+                    clients = self.clients.values()
+                for client in clients:
+                    if client.overflowed:
+                        self._drop(client.sock)
+                clients = [c for c in clients if not c.overflowed]
+
+                readers = [self.listener, self.wake_r] + [c.sock for c in clients]
+                writers = [c.sock for c in clients if c.pending or c.frames]
+                try:
+                    readable, writable, _ = select.select(readers, writers, [], 0.5)
+                except select.error, e:
+                    if e.args[0] == errno.EINTR:
+                        continue
+                    raise
+
+                for sock in readable:
+                    if sock is self.listener:
+                        self._accept()
+                    elif sock is self.wake_r:
+                        self._recv(sock)
+                    elif not self._recv(sock):
+                        # Clients send nothing, so this is a hang-up
+                        self._drop(sock)
+
+                for sock in writable:
+                    client = self.clients.get(sock)
+                    if client is not None:
+                        self._send(client)
+        finally:
+            for sock in list(self.clients):
+                self._drop(sock)
+            self.listener.close()
+            if not isinstance(self.address, tuple):
+                self._remove_stale_socket()
+            self.wake_r.close()
+            self.wake_w.close()
+
+    def join(self, timeout=None):
+        self.alive.clear()
+        self._wake()
+        threading.Thread.join(self, timeout)
+
+    def _accept(self):
+        try:
+            sock, _ = self.listener.accept()
+        except socket.error:
+            return
+        sock.setblocking(0)
+        if isinstance(self.address, tuple):
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        with self.lock:
+            self.clients[sock] = Subscriber(sock)
+
+    def _recv(self, sock):
+        try:
+            return sock.recv(4096)
+        except socket.error, e:
+            return e.args[0] in (errno.EAGAIN, errno.EWOULDBLOCK, errno.EINTR)
+
+    def _send(self, client):
+        while True:
+            if client.pending is None:
+                with self.lock:
+                    if not client.frames:
+                        return
+                    n, payload = client.frames.popleft()
+                    client.queued -= n
+                    header = struct.pack(FRAME_HEADER, MAGIC, n, client.dropped)
+                    client.dropped = 0
+                client.pending = header + payload
+                client.sent = 0
+
+            try:
+                client.sent += client.sock.send(buffer(client.pending, client.sent))
+            except socket.error, e:
+                if e.args[0] not in (errno.EAGAIN, errno.EWOULDBLOCK, errno.EINTR):
+                    self._drop(client.sock)
+                return
+
+            if client.sent < len(client.pending):
+                return
+            client.pending = None
+
+    def _drop(self, sock):
+        with self.lock:
+            self.clients.pop(sock, None)
+        sock.close()
+
+    def _wake(self):
+        try:
+            self.wake_w.send('x')
+        except socket.error:
+            pass    # the wakeup socket is full, so a wakeup is pending
+
+    def _remove_stale_socket(self):
+        # Only a socket nobody listens on any more is stale
+        try:
+            if not stat.S_ISSOCK(os.stat(self.address).st_mode):
+                return
+        except OSError:
+            return
+        probe = stream_socket(self.address)
+        try:
+            probe.connect(self.address)
+        except socket.error, e:
+            if e.args[0] == errno.ECONNREFUSED:
+                try:
+                    os.unlink(self.address)
+                except OSError:
+                    pass
+        finally:
+            probe.close()
+
+
+class StreamClient(object):
+    """ Connects to a StreamServer and reads the batches it
+        publishes.
+
+        read_batch():
+            Blocks until the next batch arrives and returns it as
+            a SampleBatch, or returns None if the server closed
+            the connection. The number of samples the server
+            dropped before it is in 'dropped'.
+
+        Iterating over the client yields its batches.
+    """
+    def __init__(self, address):
+        self.sock = stream_socket(address)
+        self.sock.connect(address)
+        self.file = self.sock.makefile('rb')
+        self.dropped = 0
+        self.total_dropped = 0
+
+    def read_batch(self):
+        header = self.file.read(FRAME_HEADER_SIZE)
+        if len(header) < FRAME_HEADER_SIZE:
+            return None
+        magic, n, self.dropped = struct.unpack(FRAME_HEADER, header)
+        if magic != MAGIC:
+            raise ValueError('not a CDC sample stream')
+        self.total_dropped += self.dropped
+
+        size = n * RECORD_DTYPE.itemsize
+        data = self.file.read(size)
+        if len(data) < size:
+            return None
+        records = np.frombuffer(data, RECORD_DTYPE)
+        return SampleBatch(int(records['index'][0]),
+                           records['count'].copy(),
+                           records['timestamp'].copy())
+
+    def __iter__(self):
+        while True:
+            batch = self.read_batch()
+            if batch is None:
+                return
+            yield batch
+
+    def close(self):
+        self.file.close()
+        self.sock.close()
+
+
+def main():
+    address = parse_address(sys.argv[1] if len(sys.argv) > 1 else DEFAULT_ADDRESS)
+    client = StreamClient(address)
+    try:
+        for batch in client:
+            if client.dropped:
+                print >> sys.stderr, '%d samples dropped' % client.dropped
+            for i, (timestamp, count) in enumerate(zip(batch.timestamps, batch.counts)):
+                print '%d,%.6f,%d' % (batch.first + i, timestamp, count)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        client.close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,168 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+import archive
+from binlog import BinaryLogWriter, GAP_COUNT
+from samplebatch import SampleBatch
+
+
+def read_archive(path):
+    f = archive.open_archive(path)
+    try:
+        return [batch for _, batch in archive.iter_blocks(f, path)]
+    finally:
+        f.close()
+
+
+class CodecTest(unittest.TestCase):
+    def test_zigzag(self):
+        values = np.array([0, -1, 1, -2, 2, 2 ** 40, -2 ** 40, 2 ** 62])
+        self.assertEqual(archive.zigzag(values[:5]).tolist(), [0, 1, 2, 3, 4])
+        self.assertEqual(archive.unzigzag(archive.zigzag(values)).tolist(),
+                         values.tolist())
+
+    def test_varints(self):
+        values = np.array([0, 1, 127, 128, 300, 2 ** 32, 2 ** 63], np.uint64)
+        data = archive.encode_varints(values) + '\x05'
+        decoded, used = archive.decode_varints(np.frombuffer(data, np.uint8),
+                                               len(values))
+        self.assertEqual(decoded.tolist(), values.tolist())
+        self.assertEqual(used, len(data) - 1)
+        self.assertRaises(ValueError, archive.decode_varints,
+                          np.frombuffer(data[:-2], np.uint8), len(values))
+
+    def test_block(self):
+        rng = np.random.RandomState(3)
+        counts = np.cumsum(rng.randint(-300, 300, 1000)).astype(np.int32)
+        counts[[0, 10, 999]] = [GAP_COUNT, np.iinfo(np.int32).max, GAP_COUNT]
+        timestamps = 1.35e9 + np.cumsum(rng.uniform(0.015, 0.025, 1000))
+        block = archive.encode_block(7, counts, timestamps)
+        size = archive.BLOCK_HEADER_SIZE
+        batch = archive.decode_block(block[:size], block[size:])
+        self.assertEqual(batch.first, 7)
+        self.assertEqual(batch.counts.dtype, np.int32)
+        self.assertEqual(batch.counts.tolist(), counts.tolist())
+        self.assertTrue(np.all(np.abs(batch.timestamps - timestamps) <= 1e-6))
+
+        without = archive.encode_block(0, counts)
+        self.assertEqual(archive.decode_block(without[:size], without[size:]).timestamps,
+                         None)
+
+    def test_crc(self):
+        block = archive.encode_block(0, [1, 2, 3])
+        size = archive.BLOCK_HEADER_SIZE
+        corrupt = block[:-1] + chr(ord(block[-1]) ^ 1)
+        self.assertRaises(ValueError, archive.decode_block,
+                          corrupt[:size], corrupt[size:])
+
+
+class ArchiveFileTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def path(self, name):
+        return os.path.join(self.directory, name)
+
+    def test_writer(self):
+        path = self.path('log.cdca')
+        writer = archive.ArchiveWriter(path, block_samples=100)
+        counts = np.arange(250, dtype=np.int32)
+        timestamps = 1.35e9 + np.arange(250) * 0.02
+        for i in range(0, 250, 30):
+            writer.write_batch(SampleBatch(i, counts[i:i + 30], timestamps[i:i + 30]))
+        # A discontinuity starts a new block
+        writer.write_batch(SampleBatch(1000, counts[:5], timestamps[:5]))
+        writer.close()
+
+        batches = read_archive(path)
+        self.assertEqual([batch.first for batch in batches], [0, 100, 200, 1000])
+        self.assertEqual(np.concatenate([b.counts for b in batches[:3]]).tolist(),
+                         counts.tolist())
+
+    def test_partial_block_is_ignored(self):
+        path = self.path('log.cdca')
+        writer = archive.ArchiveWriter(path, block_samples=10, timestamps=False)
+        writer.write_batch(SampleBatch(0, np.arange(20, dtype=np.int32), None))
+        writer.close()
+        with open(path, 'r+b') as f:
+            f.truncate(os.path.getsize(path) - 1)
+        self.assertEqual([len(batch.counts) for batch in read_archive(path)], [10])
+
+
+class TranscodeTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def transcode(self, name, data):
+        path = os.path.join(self.directory, name)
+        with open(path, 'wb') as f:
+            f.write(data)
+        out_path = os.path.join(self.directory, 'out.cdca')
+        n = archive.transcode(path, out_path)
+        batches = read_archive(out_path)
+        self.assertEqual(n, sum(len(batch.counts) for batch in batches))
+        return batches
+
+    def test_csv(self):
+        counts = [5, -3, 0, 2 ** 31 - 1, 7] * 500
+        data = ''.join('%d\n' % count for count in counts)
+        batches = self.transcode('log.csv', data + 'nan\n12')
+        got = np.concatenate([batch.counts for batch in batches])
+        # Every row is kept, down to a last line with no newline
+        self.assertEqual(got.tolist(), counts + [GAP_COUNT, 12])
+        self.assertEqual(batches[0].timestamps, None)
+
+    def test_timestamped_csv(self):
+        times = 1.35e9 + np.arange(3000) * 0.02
+        data = ''.join('%.3f,%d\n' % (t, i % 700) for i, t in enumerate(times))
+        # A garbled line and a torn last line are skipped
+        data = data.replace('\n', '\nxx,\x00\n', 1) + '1350000060.0'
+        batches = self.transcode('log.csv', data)
+        self.assertEqual(np.concatenate([b.counts for b in batches]).tolist(),
+                         [i % 700 for i in range(3000)])
+        self.assertTrue(np.all(np.abs(np.concatenate([b.timestamps for b in batches])
+                                      - times) < 1e-6))
+
+    def test_binary(self):
+        path = os.path.join(self.directory, 'log.cdcb')
+        writer = BinaryLogWriter(path)
+        counts = np.arange(100, dtype=np.int32) * 3
+        timestamps = 1.35e9 + np.arange(100) * 0.02
+        writer.write_batch(SampleBatch(0, counts[:60], timestamps[:60]))
+        writer.write_batch(SampleBatch(70, counts[60:], timestamps[60:]))
+        writer.close()
+        out_path = os.path.join(self.directory, 'out.cdca')
+        self.assertEqual(archive.transcode(path, out_path), 100)
+        batches = read_archive(out_path)
+        self.assertEqual([batch.first for batch in batches], [0, 70])
+        self.assertEqual(np.concatenate([b.counts for b in batches]).tolist(),
+                         counts.tolist())
+
+    def test_mismatch_is_detected(self):
+        path = os.path.join(self.directory, 'log.csv')
+        with open(path, 'wb') as f:
+            f.write(''.join('%d\n' % i for i in range(100)))
+        original = archive.read_log_batches
+        def lossy(path):
+            for batch in original(path):
+                yield batch._replace(counts=batch.counts[1:])
+        archive.read_log_batches = lossy
+        try:
+            self.assertRaises(ValueError, archive.transcode, path,
+                              os.path.join(self.directory, 'out.cdca'))
+        finally:
+            archive.read_log_batches = original
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,43 @@
+import unittest
+
+import numpy as np
+
+from batchqueue import BatchQueue
+from samplebatch import SampleBatch
+
+
+def batch(first, n=10):
+    return SampleBatch(first, np.zeros(n, np.int32), None)
+
+
+class BatchQueueTest(unittest.TestCase):
+    def test_drop_oldest_stays_bounded(self):
+        # A stalled consumer: batches keep coming and nobody calls get()
+        q = BatchQueue(capacity=100, policy='drop-oldest')
+        for i in range(100000):
+            q.put(batch(10 * i))
+        self.assertEqual(q.qsize(), 10)
+        self.assertEqual(len(q.items), 10)
+        self.assertEqual(q.samples, 100)
+        self.assertEqual(q.dropped, 10 * 100000 - 100)
+        self.assertEqual([q.get().first for _ in range(10)],
+                         [10 * i for i in range(99990, 100000)])
+
+    def test_decimate_stays_bounded(self):
+        q = BatchQueue(capacity=100, policy='decimate')
+        for i in range(10000):
+            q.put(batch(10 * i))
+        self.assertTrue(len(q.items) <= 10)
+        self.assertEqual(q.samples, 10 * len(q.items))
+        self.assertEqual(q.dropped + q.samples, 10 * 10000)
+
+    def test_fifo(self):
+        q = BatchQueue(capacity=100, policy='block')
+        for i in range(5):
+            q.put(batch(i))
+        self.assertEqual([q.get_nowait().first for _ in range(5)], range(5))
+        self.assertTrue(q.empty())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,133 @@
+import Queue
+import random
+import unittest
+
+import numpy as np
+
+from binlog import GAP_COUNT
+from com_monitor import (ComMonitorThread, DeviceSession, DeviceTimeout, LineBatcher,
+                         VECTORIZE_LINES, _parse_counts_loop, parse_counts)
+
+
+def random_line(rng):
+    kind = rng.randrange(8)
+    if kind == 0:
+        return rng.choice(['', ' ', '\r', ' \t\r'])
+    if kind == 1:
+        # partial or garbled
+        return ''.join(rng.choice('0123456789-?x \t\r') for _ in range(rng.randrange(1, 12)))
+    if kind == 2:
+        return str(GAP_COUNT) + rng.choice(['', '\r'])
+    if kind == 3:
+        return str(rng.randrange(2 ** 31, 2 ** 34))
+    if kind == 4:
+        return rng.choice(['-', '--5', '5-', '1 2', '-\r', '0x10'])
+    value = rng.randrange(GAP_COUNT + 1, 2 ** 31)
+    return ' ' * rng.randrange(2) + str(value) + rng.choice(['', '\r', ' \r'])
+
+
+class ParseCountsTest(unittest.TestCase):
+    def check(self, lines):
+        counts, malformed = parse_counts(lines)
+        expected, expected_malformed = _parse_counts_loop(lines)
+        self.assertEqual(counts.dtype, np.int32)
+        self.assertEqual(counts.tolist(), expected.tolist())
+        self.assertEqual(malformed, expected_malformed)
+
+    def test_matches_loop_on_random_lines(self):
+        rng = random.Random(1)
+        for _ in range(300):
+            n = rng.randrange(1, 4 * VECTORIZE_LINES)
+            self.check(''.join(random_line(rng) + '\n' for _ in range(n)))
+
+    def test_no_digits(self):
+        self.check('?\r\n' * 40)
+        self.check('\r\n' * 40)
+        self.check('-\n \n' * 40)
+        self.assertEqual(parse_counts('?\r\n' * 40)[1], 40)
+
+    def test_valid_block(self):
+        lines = ''.join('%d\r\n' % v for v in range(-50, 50))
+        counts, malformed = parse_counts(lines)
+        self.assertEqual(counts.tolist(), range(-50, 50))
+        self.assertEqual(malformed, 0)
+
+    def test_batcher_survives_garbage(self):
+        batcher = LineBatcher()
+        self.assertEqual(batcher.feed('?\r\n' * 40, 1.0), None)
+        self.assertEqual(batcher.malformed, 40)
+
+
+class FakePort(object):
+    def __init__(self):
+        self.written = []
+        self.flushes = 0
+
+    def write(self, data):
+        self.written.append(data)
+
+    def flushInput(self):
+        self.flushes += 1
+
+
+class DeviceSessionTest(unittest.TestCase):
+    def setUp(self):
+        self.port = FakePort()
+        self.session = DeviceSession(self.port, boot_timeout=2.0,
+                                     retry_interval=0.25, quiet_time=0.1)
+        self.session.begin(0.0)
+
+    def test_stale_lines_are_ignored(self):
+        # Lines sent before the restart took effect
+        self.session.poll(0.0)
+        self.assertEqual(self.session.feed('123\n456\n'), None)
+        self.session.poll(0.05)
+        self.assertEqual(self.session.feed('789\n'), None)
+        self.session.poll(0.1)
+        self.assertEqual(self.port.written, ['r\n\r'])
+        self.assertFalse(self.session.ready)
+
+        # Quiet long enough: the device is asked to stream
+        self.session.poll(0.3)
+        self.assertEqual(self.port.flushes, 1)
+        self.assertEqual(self.port.written, ['r\n\r', 'm\n\r'])
+        self.assertEqual(self.session.feed('\n?\n'), None)
+        self.session.poll(0.6)
+        self.assertEqual(self.port.written[-1], 'm\n\r')
+        self.assertEqual(self.session.feed('12\n3'), '12\n3')
+        self.assertTrue(self.session.ready)
+
+    def test_timeout(self):
+        for now in (0.0, 0.5, 1.0, 1.5):
+            self.session.feed('1\n')
+            self.session.poll(now)
+        self.assertRaises(DeviceTimeout, self.session.poll, 2.0)
+
+
+class LinePort(object):
+    def __init__(self, monitor, lines):
+        self.monitor = monitor
+        self.lines = list(lines)
+
+    def readline(self):
+        if not self.lines:
+            self.monitor.alive.clear()
+            return ''
+        return self.lines.pop(0)
+
+
+class ReadLinesTest(unittest.TestCase):
+    def test_keeps_handshake_lines(self):
+        q = Queue.Queue()
+        monitor = ComMonitorThread(q, Queue.Queue(), 'port', 57600, batch=False)
+        # What DeviceSession.start returned: complete lines and a
+        # partial one that the port completes
+        monitor.batcher.partial = '11\r\n22\r\n3'
+        monitor.serial_port = LinePort(monitor, ['3\r\n', '44\r\n'])
+        monitor.read_lines()
+        self.assertEqual([q.get_nowait()[0] for _ in range(q.qsize())],
+                         ['11', '22', '33', '44'])
+
+
+if __name__ == '__main__':
+    unittest.main()
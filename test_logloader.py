@@ -0,0 +1,70 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+from logloader import _parse_lines, load_overview, log_time_span, parse_block
+
+
+class ParseBlockTest(unittest.TestCase):
+    def test_valid_block(self):
+        self.assertEqual(parse_block('1\n2\n\n-3\n').tolist(), [1, 2, -3])
+        rows = parse_block('1.5,10\n2.5,nan\n', 2)
+        self.assertEqual(rows.shape, (2, 2))
+        self.assertEqual(rows[0].tolist(), [1.5, 10])
+        self.assertTrue(np.isnan(rows[1, 1]))
+
+    def test_skips_malformed_lines(self):
+        self.assertEqual(parse_block('1\n2x\n3 4\n,\n5\n').tolist(), [1, 5])
+        self.assertEqual(parse_block('1,2\n3\n4,5,6\n7,8\n', 2).tolist(),
+                         [[1, 2], [7, 8]])
+
+    def test_torn_row_keeps_columns_aligned(self):
+        # The field counts add up, but the lines don't
+        block = '1.0,10\n2.0,20 3.0\n,\n4.0,40\n'
+        self.assertEqual(parse_block(block, 2).tolist(), [[1, 10], [4, 40]])
+
+    def test_matches_line_parser(self):
+        rng = np.random.RandomState(2)
+        pieces = ['1', '22', '-3', ',', ' ', 'x', 'nan', '\n', '\n', '4.5', '\r']
+        for _ in range(200):
+            block = ''.join(rng.choice(pieces, rng.randint(1, 60))) + '\n'
+            for columns in (1, 2):
+                expected = _parse_lines(block, columns)
+                got = parse_block(block, columns).reshape(-1, columns)
+                np.testing.assert_array_equal(got, expected)
+
+    def test_empty(self):
+        self.assertEqual(parse_block('').shape, (0,))
+        self.assertEqual(parse_block('', 2).shape, (0, 2))
+
+
+class LoadOverviewTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_garbled_line(self):
+        path = os.path.join(self.directory, 'log.csv')
+        with open(path, 'wb') as f:
+            f.write('0\n1\n2\n\x00\x00garbage\n3\n4\n5')
+        overview = load_overview(path)
+        self.assertEqual(overview.n, 4)
+        self.assertEqual(overview.read_range(0, 4)[1].tolist(), [1, 2, 3, 4])
+
+    def test_time_span(self):
+        path = os.path.join(self.directory, 'log.csv')
+        with open(path, 'wb') as f:
+            f.write('1350000000.000,5\n')
+        self.assertEqual(log_time_span(path), (1350000000.0, 1350000000.0))
+        with open(path, 'ab') as f:
+            f.write('1350000000.020,6\n1350000000.040,7\n')
+        self.assertEqual(log_time_span(path), (1350000000.0, 1350000000.04))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,168 @@
+import os
+import shutil
+import struct
+import tempfile
+import unittest
+
+import numpy as np
+
+import rollup
+from binlog import GAP_COUNT
+from samplebatch import SampleBatch
+
+
+# Aligned to the hour
+T0 = 1350000000.0
+
+
+def combine(records):
+    """ Buckets by start, merging those written twice (a bucket
+        still open when the writer was closed).
+    """
+    out = {}
+    for r in records:
+        start = float(r['start'])
+        lo, hi, total, n = out.get(start, (np.inf, -np.inf, 0.0, 0))
+        out[start] = (min(lo, r['min']), max(hi, r['max']),
+                      total + r['mean'] * r['count'], n + int(r['count']))
+    return dict((start, (lo, hi, total / n, n))
+                for start, (lo, hi, total, n) in out.items())
+
+
+def expected(timestamps, counts, width):
+    keys = np.floor(timestamps / width) * width
+    out = {}
+    for key in np.unique(keys):
+        c = counts[keys == key].astype(np.float64)
+        out[float(key)] = (c.min(), c.max(), c.mean(), len(c))
+    return out
+
+
+class MergeBucketsTest(unittest.TestCase):
+    def records(self, starts, values):
+        batch = SampleBatch(0, np.array(values, np.int32), np.array(starts))
+        return rollup.sample_records(batch)
+
+    def test_buckets(self):
+        merged = rollup.merge_buckets(self.records([0.1, 0.5, 1.2, 3.9], [4, 2, 7, 5]), 1.0)
+        self.assertEqual(merged['start'].tolist(), [0, 1, 3])
+        self.assertEqual(merged['min'].tolist(), [2, 7, 5])
+        self.assertEqual(merged['max'].tolist(), [4, 7, 5])
+        self.assertEqual(merged['mean'].tolist(), [3, 7, 5])
+        self.assertEqual(merged['count'].tolist(), [2, 1, 1])
+
+    def test_out_of_order_goes_to_previous_bucket(self):
+        merged = rollup.merge_buckets(self.records([5.9, 6.2, 5.5, 7.1], [1, 2, 9, 3]), 1.0)
+        self.assertEqual(merged['start'].tolist(), [5, 6, 7])
+        self.assertEqual(merged['count'].tolist(), [1, 2, 1])
+        self.assertEqual(merged['max'].tolist(), [1, 9, 3])
+
+    def test_gaps_are_left_out(self):
+        records = self.records([0.1, 0.2, 0.3], [1, GAP_COUNT, 3])
+        self.assertEqual(records['min'].tolist(), [1, 3])
+
+
+class RollupWriterTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        rng = np.random.RandomState(4)
+        self.timestamps = T0 + np.arange(2500) * 0.1
+        self.counts = rng.randint(-1000, 1000, 2500).astype(np.int32)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def write(self, start, stop, batch=37):
+        writer = rollup.RollupWriter(self.directory)
+        for i in range(start, stop, batch):
+            j = min(i + batch, stop)
+            writer.add_batch(SampleBatch(i, self.counts[i:j], self.timestamps[i:j]))
+        writer.close()
+
+    def read(self, name):
+        records, width = rollup.read_tier(rollup.tier_path(self.directory, '', name))
+        return records, width
+
+    def test_close_and_reopen(self):
+        # The second run starts within the minute the first ended in
+        self.write(0, 1500)
+        self.write(1500, 2500)
+
+        for name, width in rollup.TIERS:
+            records, file_width = self.read(name)
+            self.assertEqual(file_width, width)
+            got = combine(records)
+            want = expected(self.timestamps, self.counts, width)
+            self.assertEqual(sorted(got), sorted(want))
+            for start in want:
+                lo, hi, mean, n = got[start]
+                self.assertEqual((lo, hi, n), (want[start][0], want[start][1], want[start][3]))
+                self.assertAlmostEqual(mean, want[start][2])
+
+        # The minute open at the first close was written twice
+        minutes, _ = self.read('1m')
+        self.assertEqual(minutes['start'].tolist(),
+                         [T0, T0 + 60, T0 + 120, T0 + 120, T0 + 180, T0 + 240])
+
+    def test_select(self):
+        self.write(0, 2500)
+        store = rollup.RollupStore(self.directory)
+        self.assertEqual(store.span(), (T0, T0 + 249))
+        end = T0 + 250
+        self.assertEqual(store.select(T0, end, 1000)[:2], ('1s', 1.0))
+        self.assertEqual(len(store.select(T0, end, 1000)[2]), 250)
+        self.assertEqual(store.select(T0, end, 100)[:2], ('1m', 60.0))
+        self.assertEqual(store.select(T0, end, 1)[:2], ('1h', 3600.0))
+        # A short span fits in the finest tier
+        name, _, records = store.select(T0 + 100, T0 + 150, 100)
+        self.assertEqual(name, '1s')
+        self.assertEqual(records['start'][0], T0 + 99)
+        self.assertEqual(records['start'][-1], T0 + 150)
+
+
+class RollupTierTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'rollup-1s.cdcr')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_other_width_is_rejected(self):
+        rollup.RollupTier(self.path, 1.0).close()
+        self.assertRaises(ValueError, rollup.RollupTier, self.path, 60.0)
+
+    def test_other_layout_is_rejected(self):
+        for version, record_size in ((rollup.VERSION + 1, rollup.ROLLUP_DTYPE.itemsize),
+                                     (rollup.VERSION, rollup.ROLLUP_DTYPE.itemsize + 8)):
+            with open(self.path, 'wb') as f:
+                f.write(struct.pack(rollup.HEADER_FORMAT, rollup.MAGIC, version,
+                                    rollup.HEADER_SIZE, record_size, 1.0))
+            self.assertRaises(ValueError, rollup.RollupTier, self.path, 1.0)
+        with open(self.path, 'wb') as f:
+            f.write('not a rollup')
+        self.assertRaises(ValueError, rollup.RollupTier, self.path, 1.0)
+        self.assertEqual(os.path.getsize(self.path), len('not a rollup'))
+
+    def test_partial_record_is_dropped(self):
+        tier = rollup.RollupTier(self.path, 1.0)
+        tier.add(rollup.merge_buckets(rollup.sample_records(
+            SampleBatch(0, np.arange(3, dtype=np.int32), T0 + np.arange(3.0))), 1.0))
+        tier.close()
+        with open(self.path, 'ab') as f:
+            f.write('xyz')
+        tier = rollup.RollupTier(self.path, 1.0)
+        tier.add(rollup.sample_records(
+            SampleBatch(3, np.array([7, 8], np.int32), T0 + np.array([5.0, 6.0]))))
+        tier.close()
+        records, _ = rollup.read_tier(self.path)
+        self.assertEqual(records['start'].tolist(), [T0, T0 + 1, T0 + 2, T0 + 5, T0 + 6])
+
+    def test_writer_closes_opened_tiers(self):
+        with open(rollup.tier_path(self.directory, '', '1h'), 'wb') as f:
+            f.write('not a rollup')
+        self.assertRaises(ValueError, rollup.RollupWriter, self.directory)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,143 @@
+"""
+Sample timing for the CDC data stream.
+
+The AD7745 produces samples at a fixed rate, so the time of a sample
+follows from its index far more precisely than from when the host got
+around to reading it: reads are delayed by the FTDI latency timer,
+driver buffering and thread scheduling, and a burst read delivers many
+samples at once. SampleClock numbers the samples and reconstructs their
+times from a line fitted through the least delayed arrivals, which also
+corrects for the device clock drifting against the host.
+"""
+import collections
+import ctypes
+import ctypes.util
+import os
+import sys
+import time
+
+import numpy as np
+
+
+def _posix_monotonic():
+    class timespec(ctypes.Structure):
+        _fields_ = [('tv_sec', ctypes.c_long), ('tv_nsec', ctypes.c_long)]
+
+    librt = ctypes.CDLL(ctypes.util.find_library('rt') or ctypes.util.find_library('c'),
+                        use_errno=True)
+    clock_gettime = librt.clock_gettime
+    clock_gettime.argtypes = [ctypes.c_int, ctypes.POINTER(timespec)]
+    CLOCK_MONOTONIC = 1
+    ts = timespec()
+
+    def monotonic():
+        if clock_gettime(CLOCK_MONOTONIC, ctypes.pointer(ts)) != 0:
+            errno = ctypes.get_errno()
+            raise OSError(errno, os.strerror(errno))
+        return ts.tv_sec + ts.tv_nsec * 1e-9
+    return monotonic
+
+
+if hasattr(time, 'monotonic'):
+    monotonic = time.monotonic
+elif sys.platform == 'win32':
+    # On Windows time.clock is the wall-clock performance counter
+    monotonic = time.clock
+else:
+    # (on POSIX time.clock is CPU time, which is useless here)
+    monotonic = _posix_monotonic()
+
+
+class SampleClock(object):
+    """ Assigns indices and timestamps to the samples of a stream
+        produced at a known, fixed rate.
+
+        rate:
+            Nominal sample rate of the device, in Hz.
+
+        block/blocks:
+            The least delayed arrival out of every 'block' samples
+            is kept, for the last 'blocks' blocks, and the sample
+            period is refitted through them as each block completes.
+
+        max_drift:
+            Largest relative deviation of the fitted period from
+            the nominal one.
+
+        resync:
+            If samples arrive more than this many seconds later than
+            predicted, samples were lost (or the device restarted)
+            and the clock starts over from the arrival.
+
+        restart():
+            Start over from the next arrival anyway, e.g. after
+            reconnecting to the device. The indices carry on.
+
+        stamp(n, host_time):
+            Number the next n samples, the last of which arrived
+            at host_time (from monotonic()). Returns the index of
+            the first one and an array of their times, in seconds
+            since the epoch.
+    """
+    def __init__(   self,
+                    rate=50.0,
+                    block=50,
+                    blocks=720,
+                    max_drift=0.01,
+                    resync=1.0):
+        self.nominal = 1.0 / rate
+        self.period = self.nominal
+        self.block = block
+        self.max_drift = max_drift
+        self.resync = resync
+
+        # Converts monotonic() times to seconds since the epoch
+        self.wall_offset = time.time() - monotonic()
+
+        self.index = 0
+        self.points = collections.deque(maxlen=blocks)
+        self.restart()
+
+    def restart(self):
+        self.offset = None
+        self.points.clear()
+        self.best = None
+        self.block_end = self.index + self.block
+
+    def stamp(self, n, host_time):
+        first = self.index
+        last = first + n - 1
+        self.index += n
+
+        if self.offset is None:
+            self.offset = host_time - last * self.period
+        residual = host_time - (self.offset + last * self.period)
+        if residual < 0:
+            # Arrived earlier than any sample so far
+            self.offset += residual
+            residual = 0.0
+        elif residual > self.resync:
+            self.offset = host_time - last * self.period
+            self.points.clear()
+            self.best = None
+            residual = 0.0
+
+        if self.best is None or residual <= self.best[2]:
+            self.best = (last, host_time, residual)
+        if last >= self.block_end:
+            self.points.append(self.best[:2])
+            self.best = None
+            self.block_end = last + self.block
+            self.fit()
+
+        times = self.offset + np.arange(first, last + 1) * self.period
+        return first, times + self.wall_offset
+
+    def fit(self):
+        if len(self.points) < 4:
+            return
+        index, host = np.array(self.points).T
+        period = np.polyfit(index, host, 1)[0]
+        self.period = min(self.nominal * (1 + self.max_drift),
+                          max(self.nominal * (1 - self.max_drift), period))
+        self.offset = np.min(host - index * self.period)
@@ -0,0 +1,93 @@
+"""
+A sparse time index for timestamped CSV logs.
+
+A timestamped CSV log ('tcsv' format of datalogger) has one
+'timestamp,count' row per sample. To find the rows of a time range
+without parsing the whole daily file, the logger writes a sidecar index
+next to it (e.g. 2012-10-20.csv.idx) with an entry for every
+INDEX_INTERVAL-th sample. The index is a headerless sequence of
+little-endian records of INDEX_DTYPE:
+
+    timestamp   float64  time of the sample in seconds since the epoch
+    sample      uint64   number of the sample in the log, from 0
+    offset      uint64   byte offset of the sample's row in the log
+
+At 50 Hz a day of samples takes 1440 entries, so the index is read
+whole, and a range is found with a binary search and a single seek.
+"""
+import os
+
+import numpy as np
+
+
+INDEX_DTYPE = np.dtype([('timestamp', '<f8'),
+                        ('sample', '<u8'),
+                        ('offset', '<u8')])
+
+# Samples between index entries: a minute at 50 Hz
+INDEX_INTERVAL = 3000
+
+
+def index_path(log_path):
+    return log_path + '.idx'
+
+
+class TimeIndexWriter(object):
+    """ Writes the index of a timestamped CSV log as the log is
+        written.
+
+        add(timestamps, lengths, sample, offset):
+            Index the rows of a batch: the timestamps of its
+            samples, the length in bytes of each row, the number
+            of its first sample and the offset of its first row.
+    """
+    def __init__(self, path, interval=INDEX_INTERVAL, buffering=-1):
+        self.path = path
+        self.interval = interval
+        self.file = open(path, 'wb', buffering)
+
+    def add(self, timestamps, lengths, sample, offset):
+        # Rows within the batch whose sample number is a multiple
+        # of the interval
+        first = -sample % self.interval
+        rows = np.arange(first, len(timestamps), self.interval)
+        if not len(rows):
+            return
+        starts = offset + np.concatenate(([0], np.cumsum(lengths)[:-1]))
+        entries = np.empty(len(rows), INDEX_DTYPE)
+        entries['timestamp'] = np.asarray(timestamps)[rows]
+        entries['sample'] = sample + rows
+        entries['offset'] = starts[rows]
+        self.file.write(entries.tostring())
+
+    def flush(self):
+        self.file.flush()
+
+    def fileno(self):
+        return self.file.fileno()
+
+    def close(self):
+        self.file.close()
+
+
+def load_index(log_path):
+    """ The index entries of a log, or an empty array if it has no
+        index. A partially written entry is ignored.
+    """
+    path = index_path(log_path)
+    if not os.path.exists(path):
+        return np.zeros(0, INDEX_DTYPE)
+    with open(path, 'rb') as f:
+        data = f.read()
+    n = len(data) // INDEX_DTYPE.itemsize
+    return np.frombuffer(data[:n * INDEX_DTYPE.itemsize], INDEX_DTYPE)
+
+
+def seek_offset(index, start):
+    """ Byte offset to start reading at for the samples from time
+        'start' on: that of the last entry before it, or 0.
+    """
+    i = np.searchsorted(index['timestamp'], start, 'left') - 1
+    if i < 0:
+        return 0
+    return int(index['offset'][i])